@@ -0,0 +1,94 @@
+"""
+Micro-benchmarks for the add-on's card building.
+
+Run a single benchmark with e.g. `python bench.py cloze --clozes 20 50`.
+Every benchmark prints a small table.
+"""
+import argparse
+import re
+import time
+
+from cloze import ClozeCache, parse, render
+
+# The cloze handling _build_front_html had before the cloze module
+LEGACY_CLOZE_PATTERN = re.compile(r"{{c(\d+)::(.+?)}}")
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _print_table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header, *rows]:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def _legacy_front(front_field, cloze_number):
+    cloze_answer = None
+    for cn, content in LEGACY_CLOZE_PATTERN.findall(front_field):
+        if int(cn) == cloze_number:
+            front_field = re.sub(rf"{{{{c{cn}::(.+?)}}}}", r"{}", front_field)
+            cloze_answer = content
+        else:
+            front_field = re.sub(rf"{{{{c{cn}::(.+?)}}}}", r"\1", front_field)
+    return front_field, cloze_answer
+
+
+def _cloze_note(clozes, words=8):
+    filler = " ".join(f"word{i}" for i in range(words))
+    return " ".join(f"{filler} {{{{c{n}::answer {n}::hint {n}}}}}" for n in range(1, clozes + 1))
+
+
+def bench_cloze(clozes, notes=200):
+    """
+    Building the fronts of every sibling card of notes with many clozes: the
+    previous per-cloze re.sub, parsing each card's field, and one cached parse per note.
+    """
+    fields = [_cloze_note(clozes) + f" note {i}" for i in range(notes)]
+
+    def legacy():
+        for field in fields:
+            for n in range(1, clozes + 1):
+                _legacy_front(field, n)
+
+    def parse_every_card():
+        for field in fields:
+            for n in range(1, clozes + 1):
+                render(parse(field), n)
+
+    def parse_per_note():
+        cache = ClozeCache(entries=notes)
+        for note_id, field in enumerate(fields):
+            for n in range(1, clozes + 1):
+                render(cache.get(note_id, 0, field), n)
+
+    cards = notes * clozes
+    rows = []
+    for name, fn in (("re.sub per cloze", legacy), ("parse per card", parse_every_card),
+                     ("parse per note", parse_per_note)):
+        _, seconds = _timed(fn)
+        rows.append((name, f"{seconds * 1000:.1f}", f"{seconds / cards * 1e6:.1f}"))
+    print(f"{notes} notes x {clozes} clozes ({len(fields[0])} chars per field)")
+    _print_table(("method", "total ms", "us/card"), rows)
+
+
+BENCHMARKS = {
+    "cloze": bench_cloze,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add-on micro-benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--clozes", type=int, nargs="+", default=[20])
+    args = parser.parse_args(argv)
+    for clozes in args.clozes:
+        BENCHMARKS[args.benchmark](clozes)
+        print()
+
+
+if __name__ == "__main__":
+    main()
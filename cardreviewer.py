@@ -4,7 +4,9 @@ This module is responsible for handling the card review process.
 import re
 import logging
 import os
-import subprocess
+import json
+import html
+from collections import namedtuple
 from aqt import mw
 from aqt import gui_hooks
 from aqt.reviewer import Reviewer
@@ -12,6 +14,9 @@ from .my_card import AnkiCardWrapper
 from .strikecounter import GlobalStrikeCounter
 from .logger import initialize_logging
 from .hebrewhandler import HebrewHandler
+from .mathrenderer import MathRenderer, placeholder_id
+from .prefetcher import CardPrefetcher, upcoming_cards
+from .cloze import ClozeCache, render as render_cloze
 
 
 KEY_EVENTS_SCRIPT = """
@@ -30,6 +35,7 @@ SCRACTHPAD_HTML = """<div id='scratchpad-container' style='display: flex; justif
               </div>"""
 
 PANDOC_PATH = '/usr/local/bin/pandoc'
+PANDOC_FLAGS = ['-f', 'latex', '--mathjax', '-t', 'html', '--webtex']
 
 
 INLINE_MATH_PATTERN = re.compile(r"""
@@ -38,13 +44,9 @@ INLINE_MATH_PATTERN = re.compile(r"""
     \\\)   # Matches the closing delimiter \)
 """, re.VERBOSE)
 
-CLOZE_PATTERN = re.compile(r"""
-    {{c      # Matches the opening cloze notation {{c
-    (\d+)    # Captures one or more digits, representing the cloze number
-    ::       # Matches the delimiter between the cloze number and its content
-    (.+?)    # Lazily captures the content of the cloze until the closing }}
-    }}       # Matches the closing cloze notation }}
-""", re.VERBOSE)
+# HTML of one card, built ahead of time by the prefetcher or when the card is shown
+CardHtml = namedtuple("CardHtml", ["front", "scratchpad", "back", "cloze_answer"])
+
 
 
 
@@ -55,7 +57,15 @@ def my_get_scratchpad(card) -> None:
     mw.reviewer.card_reviewer.get_scratchpad(card)
 
 
+def my_profile_will_close() -> None:
+    """
+    This function is called before the profile is closed.
+    """
+    mw.reviewer.card_reviewer.shutdown()
+
+
 gui_hooks.reviewer_did_show_answer.append(my_get_scratchpad)
+gui_hooks.profile_will_close.append(my_profile_will_close)
 
 
 class CardReviewer:
@@ -71,6 +81,33 @@ class CardReviewer:
         self._setup_bridge_command()
         self._initialize_link_handler()
         self.cloze_answer = None
+        self.cloze_cache = ClozeCache()
+        self.math_renderer = None
+        self.prefetcher = None
+        self._start_workers()
+
+    def _start_workers(self):
+        """
+        Starts the math renderer and prefetcher pools, unless they are running.
+        shutdown() stops them when the profile closes; the reviewer object
+        outlives the profile, so the next card shown starts them again.
+        """
+        if self.prefetcher is not None:
+            return
+        self.math_renderer = MathRenderer(PANDOC_PATH, PANDOC_FLAGS) if os.path.exists(PANDOC_PATH) else None
+        self.prefetcher = CardPrefetcher(
+            lambda fields, ordinal, note_key: self._build_card_html(fields, ordinal, note_key, wait=True))
+
+    def shutdown(self):
+        """
+        Stops the background pools without waiting for them.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
+        if self.math_renderer is not None:
+            self.math_renderer.shutdown()
+            self.math_renderer = None
 
     def _initialize_logging(self):
         initialize_logging()
@@ -100,71 +137,82 @@ class CardReviewer:
 
     def _update_card_review(self, card=None):
         card = mw.reviewer.card
-        fields = card.note().fields
-        front_field = self._find_first_non_empty_field(fields)
-        self._inject_card_html(
-            self._build_front_html(front_field),
-            self._build_scratchpad_html(),
-            self._build_back_html(fields, front_field)
-        )
+        note = card.note()
+        self._start_workers()
+        card_html = self.prefetcher.get(card.id, note.mod)
+        if card_html is None:
+            card_html = self._build_card_html(note.fields, card.ord, (note.id, note.mod))
+        self.cloze_answer = card_html.cloze_answer
+        self._inject_card_html(card_html.front, card_html.scratchpad, card_html.back)
         self.card_wrapper = AnkiCardWrapper(card)
         logging.info("Card wrapper: %s", self.card_wrapper)
         self._add_key_events()
         self.focus_scratchpad()
+        self.card_reviewer_logger.debug("Prefetch: %s", self.prefetcher.stats())
+        self.prefetcher.prefetch(upcoming_cards(mw.col, skip_id=card.id))
 
-    def _find_first_non_empty_field(self, fields):
-        return next((field for field in fields if not field.startswith("[sound:") and field.strip()), None)
-
-    def _find_clozes(self, front_field):
+    def _build_card_html(self, fields, ordinal, note_key, wait=False):
         """
-        Find all cloze deletions in the given field text and return them.
+        Builds the HTML of a card from its note fields and ordinal; note_key is
+        the (note id, mod time) its cloze parse is cached under. Safe to call
+        off the main thread; with wait=True math is rendered before returning.
         """
-        return CLOZE_PATTERN.findall(front_field)
+        front_field = self._find_first_non_empty_field(fields)
+        front_html, cloze = self._build_front_html(front_field, ordinal + 1, note_key, wait)
+        cloze_answer = cloze.answer
+        scratchpad_html = self._build_scratchpad_html(cloze_answer, cloze.hint)
+        back_html = self._build_back_html(fields, front_field, cloze_answer)
+
+        if "$$" in back_html or "\\(" in back_html:
+            back_html = self._render_math(back_html, wait)
+
+        if "$$" in scratchpad_html or "\\(" in scratchpad_html:
+            scratchpad_html = self._render_math(scratchpad_html, wait)
+
+        return CardHtml(front_html, scratchpad_html, back_html, cloze_answer)
+
+    def _find_first_non_empty_field(self, fields):
+        return next((field for field in fields if not field.startswith("[sound:") and field.strip()), None)
 
-    def _build_front_html(self, front_field):
+    def _build_front_html(self, front_field, cloze_number, note_key, wait=False):
         """
         Build the HTML for the front of the card, showing only the current cloze.
+        Returns the HTML and the RenderedCloze with the answer and hint of the
+        current cloze, if any.
         """
         self.card_reviewer_logger.debug("Front field before: %s", front_field)
-        cloze_number = self.reviewer.card.ord + 1  # Get the current cloze number
-        clozes = self._find_clozes(front_field)
-
-        for cn, content in clozes:
-            if int(cn) == cloze_number:
-                # Replace only the current cloze with a placeholder for the scratchpad
-                front_field = re.sub(rf"{{{{c{cn}::(.+?)}}}}", r"{}", front_field)
-                self.cloze_answer = content
-                self.card_reviewer_logger.debug("content: %s", content)
-            else:
-                # Replace other clozes with their contents directly, removing cloze notation
-                front_field = re.sub(rf"{{{{c{cn}::(.+?)}}}}", r"\1", front_field)
-
-
-            self.card_reviewer_logger.debug("Front field after cloze extract: %s", front_field)
+        # Sibling cards of a note share one parse of the field
+        cloze = render_cloze(self.cloze_cache.get(*note_key, front_field), cloze_number)
+        # The current cloze becomes a placeholder for the scratchpad, the others show their contents
+        front_field = cloze.text
+        self.card_reviewer_logger.debug("Front field after cloze extract: %s, answer: %s",
+                                        front_field, cloze.answer)
 
         if "$$" in front_field or "\\(" in front_field:
-            front_field = self._render_math(front_field)
+            front_field = self._render_math(front_field, wait)
             self.card_reviewer_logger.debug(
                 "Front field after math: %s", front_field)
 
         # TODO: Move scripts to separate file
-        return f"<div id='front-container' style='display: flex; flex-direction: column; align-items: center; font-size: 24px;'><div class='field'>{front_field}</div></div>"
+        return f"<div id='front-container' style='display: flex; flex-direction: column; align-items: center; font-size: 24px;'><div class='field'>{front_field}</div></div>", cloze
 
-    def _build_back_html(self, fields, front_field):
+    def _build_back_html(self, fields, front_field, cloze_answer=None):
         self.card_reviewer_logger.debug("Fields: %s", fields)
-        if self.cloze_answer is not None:
-            return f"<div id='back-container' style='display: none; text-align: center; font-size: 24px;'><div class='field'>{self.cloze_answer}</div></div>"
+        if cloze_answer is not None:
+            return f"<div id='back-container' style='display: none; text-align: center; font-size: 24px;'><div class='field'>{cloze_answer}</div></div>"
         return "<div id='back-container' style='display: none; text-align: center; font-size: 24px;'>" + \
                "".join([f"<div class='field'>{field}</div>" for field in fields if "sound" not in field and field.strip() and field != front_field]) + \
                "</div>"
 
-    def _build_scratchpad_html(self):
+    def _build_scratchpad_html(self, cloze_answer=None, hint=None):
         self.card_reviewer_logger.debug("Building scratchpad HTML")
         cols_value = "20"  # Default size
-        if self.cloze_answer is not None:
-            cols_value = str(len(self.cloze_answer))
+        if cloze_answer is not None:
+            cols_value = str(len(cloze_answer))
+            # The cloze hint is shown inside the empty scratchpad
+            placeholder = f" placeholder='{html.escape(hint)}'" if hint else ""
             return f"""<div id='scratchpad-container' style='display: inline-block; justify-content: center; align-items: center;'>
-                <textarea id='scratchpad' dir='rtl' cols='{cols_value}' style='font-size: 24px; background-color: rgb(245, 245, 245);'></textarea>
+                <textarea id='scratchpad' dir='rtl' cols='{cols_value}'{placeholder} style='font-size: 24px; background-color: rgb(245, 245, 245);'></textarea>
                 </div>"""
         else:
             return SCRACTHPAD_HTML
@@ -172,60 +220,70 @@ class CardReviewer:
     def _find_inline_math(self, text):
         return INLINE_MATH_PATTERN.findall(text)
 
-    def _render_math(self, text):
+    def _render_math(self, text, wait=False):
+        """
+        Replaces inline math with its rendered HTML. Expressions that are not
+        cached yet are shown as raw TeX and rendered in the background; the card
+        is updated in place once they are done. With wait=True they are rendered
+        before returning instead, for callers already off the main thread.
+        """
         # Find all inline math expressions
         inline_math = self._find_inline_math(text)
-        inline_math = [f"\\({expr}\\)" for expr in inline_math]
+        # Each distinct expression is rendered and replaced once
+        inline_math = list(dict.fromkeys(f"\\({expr}\\)" for expr in inline_math))
 
         logging.debug("Inline math expressions: %s", inline_math)
 
         # Check if pandoc exists
-        if os.path.exists(PANDOC_PATH):
-            # Render each inline math expression
-            rendered_inline_math = []
-            for expr in inline_math:
-                # TODO: Handle errors
-                try:
-                    result = subprocess.run(
-                        [PANDOC_PATH, '-f', 'latex', '--mathjax', '-t', 'html', '--webtex'],
-                        input=expr,
-                        text=True,
-                        capture_output=True,
-                        encoding='utf-8'  # handle non-ASCII characters
-                    )
-                    logging.debug("Pandoc result: %s", result)
-                    if result.returncode == 0:
-                        rendered_math = result.stdout.strip().replace("<p>", "").replace("</p>", "")
-                        rendered_inline_math.append(rendered_math)
-                    else:
-                        self.card_reviewer_logger.debug(
-                            "Pandoc failed with error code %d: %s", result.returncode, result.stderr)
-                        return text  # Return original text if error occurs
-                except Exception as e:
-                    self.card_reviewer_logger.debug(
-                        "Error occurred while running pandoc: %s", e)
-                    return text  # Return original text if error occurs
-        else:
+        renderer = self.math_renderer
+        if renderer is None:
             self.card_reviewer_logger.debug("Pandoc path does not exist.")
             return text  # Return original text if pandoc path doesn't exist
 
-        # Replace original inline math expressions with their rendered counterparts
-        for original, rendered in zip(inline_math, rendered_inline_math):
-            text = text.replace(original, rendered)
+        if wait:
+            # Expressions that fail to render stay as raw TeX
+            for expr, rendered in renderer.render(inline_math).items():
+                text = text.replace(expr, rendered)
+            return text
+
+        missing = []
+        for expr in inline_math:
+            rendered = renderer.cached(expr)
+            if rendered is None:
+                missing.append(expr)
+                rendered = self._math_placeholder(expr)
+            text = text.replace(expr, rendered)
+
+        if missing:
+            self.card_reviewer_logger.debug("Rendering %d math expressions in the background", len(missing))
+            renderer.submit(missing, self._on_math_rendered)
+        if renderer.cache is not None:
+            self.card_reviewer_logger.debug("Math render cache: %s", renderer.cache.stats())
 
         return text
 
-    def _inject_card_html(self, front_html, scratchpad_html, back_html):
-
-        if "$$" in back_html or "\\(" in back_html:
-            back_html = self._render_math(back_html)
+    def _math_placeholder(self, expr):
+        # The escaped backslashes keep the raw TeX from matching INLINE_MATH_PATTERN
+        # again, and from being eaten by the template literal in _inject_card_html
+        escaped = expr.replace("\\", "&#92;")
+        return f"<span class='math-pending' data-math='{placeholder_id(expr)}'>{escaped}</span>"
 
-        if "$$" in scratchpad_html or "\\(" in scratchpad_html:
-            scratchpad_html = self._render_math(scratchpad_html)
+    def _on_math_rendered(self, rendered):
+        """
+        Called on a render worker thread; swaps the placeholders on the main thread.
+        """
+        mw.taskman.run_on_main(lambda: self._replace_math_placeholders(rendered))
 
-        if "$$" in front_html or "\\(" in front_html:
-            front_html = self._render_math(front_html)
+    def _replace_math_placeholders(self, rendered):
+        # Placeholders only exist on the card that asked for them, so a card
+        # that was answered in the meantime is left alone
+        script = "".join(
+            f"document.querySelectorAll('[data-math=\"{placeholder_id(expr)}\"]')"
+            f".forEach(function (e) {{ e.outerHTML = {json.dumps(rendered_html)}; }});"
+            for expr, rendered_html in rendered.items())
+        mw.reviewer.web.eval(script)
 
+    def _inject_card_html(self, front_html, scratchpad_html, back_html):
         self.card_reviewer_logger.debug(
             "Injecting card HTML (font is): %s", front_html)
 
@@ -307,4 +365,3 @@ class CardReviewer:
 
 # TODO:: Implement MathHandler class to accordint to SRP and OCP
 
-# TODO:: Implement ClozeHandler class to accordint to SRP and OCP
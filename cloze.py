@@ -0,0 +1,149 @@
+"""
+This module parses cloze deletions ({{c1::answer::hint}}) in note fields.
+
+A field is tokenized once into a compact segment list: plain text strings and
+Cloze tuples, whose content is itself a segment list so nested clozes are
+kept. Rendering the front of any sibling card (c1, c2, ...) is then a single
+linear pass over the segments. Parses are cached per note id and mod time, so
+all the cards of a note share one parse.
+"""
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# Stands in for the current cloze; the reviewer puts the scratchpad there
+BLANK = "{}"
+CACHE_ENTRIES = 256
+
+TOKEN_PATTERN = re.compile(r"""
+    {{c(\d+)::  # Opens a cloze and captures its number
+    | ::        # Separates the content of a cloze from its hint
+    | }}        # Closes the innermost open cloze
+""", re.VERBOSE)
+
+Cloze = namedtuple("Cloze", ["ordinal", "content", "hint"])
+RenderedCloze = namedtuple("RenderedCloze", ["text", "answer", "hint"])
+
+
+def parse(text):
+    """
+    Tokenizes a field into a tuple of strings and Cloze segments. Markup that
+    is not part of a well-formed cloze is kept as plain text.
+    """
+    root = []
+    # Where text goes: the root, or the content or hint of the innermost open cloze
+    target = root
+    # Open clozes: [ordinal, content, hint or None, opening markup]
+    stack = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        start = match.start()
+        if start > position:
+            target.append(text[position:start])
+        position = match.end()
+        token = match.group()
+        if match.group(1) is not None:
+            target = []
+            stack.append([int(match.group(1)), target, None, token])
+        elif not stack:
+            target.append(token)
+        elif token == "::":
+            frame = stack[-1]
+            if frame[2] is None:
+                target = frame[2] = []
+            else:
+                target.append(token)  # A second "::" is part of the hint
+        else:
+            ordinal, content, hint, _ = stack.pop()
+            target = _innermost(stack, root)
+            target.append(Cloze(ordinal, tuple(content), _flatten(hint) if hint is not None else None))
+    if len(text) > position:
+        target.append(text[position:])
+
+    # Clozes left open were not clozes after all
+    while stack:
+        _, content, hint, opening = stack.pop()
+        target = _innermost(stack, root)
+        target.append(opening)
+        target.extend(content)
+        if hint is not None:
+            target.append("::")
+            target.extend(hint)
+    return tuple(root)
+
+
+def _innermost(stack, root):
+    if not stack:
+        return root
+    frame = stack[-1]
+    return frame[2] if frame[2] is not None else frame[1]
+
+
+def _flatten(segments):
+    """
+    Text of segments with every cloze revealed.
+    """
+    return "".join(segment if isinstance(segment, str) else _flatten(segment.content) for segment in segments)
+
+
+def render(segments, ordinal):
+    """
+    Renders the front of cloze card `ordinal`: its clozes become BLANK, the
+    others show their content. Returns the text, the answer (None if the field
+    has no such cloze) and the hint of the current cloze.
+    """
+    parts = []
+    answers = []
+    hints = []
+
+    def walk(segments):
+        for segment in segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            elif segment.ordinal == ordinal:
+                parts.append(BLANK)
+                answers.append(_flatten(segment.content))
+                if segment.hint:
+                    hints.append(segment.hint)
+            else:
+                walk(segment.content)
+
+    walk(segments)
+    return RenderedCloze("".join(parts), ", ".join(answers) if answers else None,
+                         ", ".join(hints) if hints else None)
+
+
+class ClozeCache:
+    """
+    Bounded LRU of parsed fields keyed by (note id, mod time). Safe to use from several threads.
+    """
+
+    def __init__(self, entries=CACHE_ENTRIES):
+        self.entries = entries
+        self._parses = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, note_id, note_mod, text):
+        """
+        Returns the parse of a note's field, parsing it on first use.
+        """
+        key = (note_id, note_mod)
+        with self._lock:
+            parsed = self._parses.get(key)
+            if parsed is not None:
+                self._parses.move_to_end(key)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+        parsed = parse(text)
+        with self._lock:
+            self._parses[key] = parsed
+            while len(self._parses) > self.entries:
+                self._parses.popitem(last=False)
+        return parsed
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._parses)}
@@ -0,0 +1,63 @@
+"""
+Non-blocking access to FlashcardManager for the Qt UI.
+
+AsyncFlashcardManager runs manager calls on a single worker thread and hands
+the results back on the GUI thread through a queued Qt signal, so slow queries
+on big decks never freeze the window. The wrapped manager is opened in
+concurrent mode, which makes its database connections safe to use from the
+worker next to the GUI thread. Calls run one at a time in submission order.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from flashcardmanager import FlashcardManager
+from loggers import db_logger
+
+
+class AsyncFlashcardManager(QObject):
+    # (callback, errback, future) of a finished call, emitted from the worker
+    _finished = pyqtSignal(object, object, object)
+
+    def __init__(self, manager=None, parent=None):
+        super().__init__(parent)
+        self.manager = manager or FlashcardManager(concurrent=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ui-db")
+        # The receiver lives on the GUI thread, so the connection is queued
+        self._finished.connect(self._deliver)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` on the worker thread. `on_done(result)` or
+        `on_error(exception)` is then called on the GUI thread. Returns the
+        concurrent.futures.Future of the call.
+        """
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda f: self._finished.emit(on_done, on_error, f))
+        return future
+
+    def call(self, method, *args, on_done=None, on_error=None, **kwargs):
+        """
+        Run a FlashcardManager method by name, e.g. call("get_deck_stats", on_done=show).
+        """
+        return self.submit(getattr(self.manager, method), *args, on_done=on_done, on_error=on_error, **kwargs)
+
+    def _deliver(self, on_done, on_error, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            if on_done is not None:
+                on_done(future.result())
+        elif on_error is not None:
+            on_error(error)
+        else:
+            db_logger.error(f"Background database call failed: {error!r}")
+
+    def close(self, backup=False):
+        """
+        Drop queued calls, wait for the running one and close the manager,
+        backing up the database first if `backup` is set.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.manager.close(backup)
@@ -0,0 +1,238 @@
+"""
+Online backups of the flashcards database.
+
+Snapshots are taken with the SQLite backup API from a connection of their
+own, copying a few pages per step and sleeping in between, so the app keeps
+reading and writing while a backup runs and never sees a torn file. Every
+snapshot is checked with PRAGMA integrity_check, then compressed on a
+background thread to a timestamped file. Only the newest `keep` backups are
+kept.
+
+Run `python backup.py` to back up from the command line, or
+`python backup.py --verify FILE` to check an existing backup.
+"""
+import argparse
+import glob
+import lzma
+import os
+import sqlite3
+import tempfile
+import threading
+import zlib
+from datetime import datetime
+
+from loggers import db_logger
+
+DEFAULT_KEEP = 10
+DEFAULT_PAGES_PER_STEP = 64
+DEFAULT_STEP_SLEEP = 0.005  # seconds
+CHUNK_SIZE = 1 << 20
+
+# Compression name -> file extension
+COMPRESSIONS = {"lzma": ".xz", "zlib": ".zz", "none": ""}
+
+
+def _compress(src, dst, compression):
+    if compression == "lzma":
+        with open(src, "rb") as f, lzma.open(dst, "wb") as out:
+            while chunk := f.read(CHUNK_SIZE):
+                out.write(chunk)
+    elif compression == "zlib":
+        compressor = zlib.compressobj(9)
+        with open(src, "rb") as f, open(dst, "wb") as out:
+            while chunk := f.read(CHUNK_SIZE):
+                out.write(compressor.compress(chunk))
+            out.write(compressor.flush())
+    else:
+        os.replace(src, dst)
+
+
+def _decompress(src, dst):
+    if src.endswith(COMPRESSIONS["lzma"]):
+        with lzma.open(src, "rb") as f, open(dst, "wb") as out:
+            while chunk := f.read(CHUNK_SIZE):
+                out.write(chunk)
+    elif src.endswith(COMPRESSIONS["zlib"]):
+        decompressor = zlib.decompressobj()
+        with open(src, "rb") as f, open(dst, "wb") as out:
+            while chunk := f.read(CHUNK_SIZE):
+                out.write(decompressor.decompress(chunk))
+            out.write(decompressor.flush())
+    else:
+        with open(src, "rb") as f, open(dst, "wb") as out:
+            while chunk := f.read(CHUNK_SIZE):
+                out.write(chunk)
+
+
+def integrity_check(path):
+    """
+    Return True if PRAGMA integrity_check reports no problems for a database file.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+        return result == [("ok",)]
+    except sqlite3.DatabaseError as e:
+        db_logger.error(f"Integrity check of {path} failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def verify_backup(path):
+    """
+    Decompress a backup to a temporary file and run the integrity check on it.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        _decompress(path, tmp)
+        return integrity_check(tmp)
+    except (OSError, lzma.LZMAError, zlib.error) as e:
+        db_logger.error(f"Failed to read backup {path}: {e}")
+        return False
+    finally:
+        os.remove(tmp)
+
+
+class BackupManager:
+    def __init__(self, db_file, backup_dir=None, keep=DEFAULT_KEEP, compression="lzma",
+                 pages_per_step=DEFAULT_PAGES_PER_STEP, step_sleep=DEFAULT_STEP_SLEEP):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {tuple(COMPRESSIONS)}")
+        if keep < 1:
+            # Rotation would otherwise delete every backup, the new one included
+            raise ValueError(f"keep must be at least 1, got {keep}")
+        self.db_file = db_file
+        self.backup_dir = backup_dir or os.path.join(os.path.dirname(os.path.abspath(db_file)), "backups")
+        self.keep = keep
+        self.compression = compression
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._name = os.path.splitext(os.path.basename(db_file))[0]
+        self._compressors = []
+        self._lock = threading.Lock()
+
+    def backup(self, wait=False):
+        """
+        Snapshot the database, verify the snapshot and compress it in the
+        background. Returns the path the compressed backup is written to, or
+        None if the snapshot failed. With `wait` the call returns once the
+        backup is compressed and old ones are rotated out.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        base = os.path.join(self.backup_dir, f"{self._name}-{stamp}.db")
+        snapshot = base + ".snapshot"
+        if not self._snapshot(snapshot):
+            return None
+        target = base + COMPRESSIONS[self.compression]
+        compressor = threading.Thread(target=self._finish, args=(snapshot, target),
+                                      name="db-backup", daemon=True)
+        with self._lock:
+            self._compressors = [t for t in self._compressors if t.is_alive()] + [compressor]
+        compressor.start()
+        if wait:
+            compressor.join()
+        return target
+
+    def wait(self):
+        """
+        Wait until all started backups are compressed.
+        """
+        with self._lock:
+            compressors = list(self._compressors)
+        for compressor in compressors:
+            compressor.join()
+
+    def list_backups(self):
+        """
+        Return the paths of the finished backups, oldest first.
+        """
+        pattern = os.path.join(self.backup_dir, f"{self._name}-*.db")
+        return sorted(path for ext in set(COMPRESSIONS.values()) for path in glob.glob(pattern + ext))
+
+    def _snapshot(self, snapshot):
+        source = sqlite3.connect(self.db_file)
+        dest = sqlite3.connect(snapshot)
+        try:
+            if source.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+                # Pin one WAL snapshot for the whole copy. Otherwise every commit
+                # made between two steps restarts the backup from the first page,
+                # and a busy writer can keep it from ever finishing
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            # Small steps with a pause in between let writers in without WAL and
+            # keep the copy from saturating the disk while the user reviews
+            source.backup(dest, pages=self.pages_per_step, sleep=self.step_sleep)
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to back up {self.db_file}: {e}")
+            dest.close()
+            os.remove(snapshot)
+            return False
+        finally:
+            source.close()
+        # The copy inherits WAL mode from the source; a single-file backup is wanted
+        dest.execute("PRAGMA journal_mode=DELETE")
+        dest.close()
+        if not integrity_check(snapshot):
+            db_logger.error(f"Backup {snapshot} failed the integrity check, discarding it.")
+            os.remove(snapshot)
+            return False
+        return True
+
+    def _finish(self, snapshot, target):
+        partial = target + ".part"
+        try:
+            _compress(snapshot, partial, self.compression)
+            # Renamed only when complete, so list_backups never sees a partial file
+            os.replace(partial, target)
+        except OSError as e:
+            db_logger.error(f"Failed to compress backup {snapshot}: {e}")
+            return
+        finally:
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+        db_logger.info(f"Backed up {self.db_file} to {target}.")
+        self._rotate()
+
+    def _rotate(self):
+        with self._lock:
+            for path in self.list_backups()[:-self.keep]:
+                os.remove(path)
+                db_logger.info(f"Removed old backup {path}.")
+
+
+def main(argv=None):
+    from db import DatabaseManager, DB_FILE
+
+    parser = argparse.ArgumentParser(description="Back up the flashcards database.")
+    parser.add_argument("--db", default=DB_FILE, help="Database file")
+    parser.add_argument("--dir", help="Backup directory (default: 'backups' next to the database)")
+    parser.add_argument("--keep", type=int, default=DEFAULT_KEEP, help="Number of backups to keep")
+    parser.add_argument("--compression", choices=sorted(COMPRESSIONS), default="lzma")
+    parser.add_argument("--list", action="store_true", help="List existing backups and exit")
+    parser.add_argument("--verify", metavar="FILE", help="Check a backup file and exit")
+    args, _ = parser.parse_known_args(argv)
+    if args.keep < 1:
+        parser.error("--keep must be at least 1")
+
+    if args.verify:
+        ok = verify_backup(args.verify)
+        print(f"{args.verify}: {'ok' if ok else 'CORRUPT'}")
+        return 0 if ok else 1
+    if args.list:
+        for path in BackupManager(args.db, args.dir).list_backups():
+            print(path)
+        return 0
+    with DatabaseManager(args.db) as db:
+        target = db.backup(args.dir, args.keep, args.compression, wait=True)
+    if target is None:
+        print("Backup failed.")
+        return 1
+    print(f"Backup written to {target}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,168 @@
+"""
+Whole-deck rescheduling with NumPy.
+
+FlashcardManager.super_memo reads, updates and writes one card at a time.
+BatchScheduler loads the schedule columns of a deck once into arrays, applies
+the same SM-2 update (or an ease policy change, or a due date shift) to all of
+them with vectorized arithmetic, and writes the result back with a single
+executemany in one transaction.
+"""
+from datetime import datetime
+
+import numpy as np
+
+from dates import to_epoch
+from schedulers import DEFAULT_SCHEDULER, SM2Scheduler
+
+DAY = 86400  # seconds
+
+
+def sm2(repetition, easiness, interval, grades):
+    """
+    Vectorized SM-2 step, identical to schedulers.sm2: returns
+    the new (repetition, easiness factor, interval) arrays for the grades.
+    """
+    grades = np.asarray(grades)
+    correct = grades >= 3
+    grown = np.rint(interval * easiness).astype(np.int64)  # rint rounds half to even, like round()
+    interval = np.where(correct, np.select([repetition == 0, repetition == 1], [1, 6], grown), 1)
+    repetition = np.where(correct, repetition + 1, 0)
+    miss = 5 - grades
+    easiness = np.maximum(easiness + (0.1 - miss * (0.08 + miss * 0.02)), 1.3)
+    return repetition, easiness, interval
+
+
+class DeckSchedules:
+    """
+    Schedule columns of a deck's cards as arrays, in card ID order. Missing
+    next review dates are NaN; last review dates and the FSRS memory state
+    stay plain lists because they are only written back.
+    """
+
+    def __init__(self, rows):
+        (ids, repetition, easiness, interval, next_review, last_reviewed,
+         stability, difficulty) = zip(*rows) if rows else ((),) * 8
+        self.ids = np.array(ids, dtype=np.int64)
+        self.repetition = np.array(repetition, dtype=np.int64)
+        self.easiness = np.array(easiness, dtype=np.float64)
+        self.interval = np.array(interval, dtype=np.int64)
+        self.next_review = np.array([np.nan if d is None else d for d in next_review], dtype=np.float64)
+        self.last_reviewed = list(last_reviewed)
+        self.stability = list(stability)
+        self.difficulty = list(difficulty)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index_of(self, card_ids):
+        """
+        Positions of the given card IDs in the arrays; unknown IDs raise KeyError.
+        """
+        card_ids = np.asarray(card_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, card_ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == card_ids[found]
+        if not found.all():
+            raise KeyError(f"Cards not in this deck: {card_ids[~found].tolist()}")
+        return positions
+
+    def rows(self, positions, last_reviewed=None):
+        """
+        Update rows for DatabaseManager.update_schedules, converted to plain
+        Python numbers since sqlite3 cannot bind NumPy scalars.
+        """
+        next_review = self.next_review[positions]
+        return list(zip(
+            self.repetition[positions].tolist(),
+            self.easiness[positions].tolist(),
+            self.interval[positions].tolist(),
+            [None if np.isnan(d) else int(d) for d in next_review.tolist()],
+            [last_reviewed] * len(positions) if last_reviewed is not None
+            else [self.last_reviewed[i] for i in positions.tolist()],
+            [self.stability[i] for i in positions.tolist()],
+            [self.difficulty[i] for i in positions.tolist()],
+            self.ids[positions].tolist(),
+        ))
+
+
+class BatchScheduler:
+    def __init__(self, db):
+        self.db = db
+
+    def load(self, deck_id):
+        return DeckSchedules(self.db.get_deck_schedules(deck_id))
+
+    def require_sm2(self, deck_id):
+        """
+        Raise ValueError unless the deck is scheduled by SM-2, the only
+        scheduler the vectorized updates implement.
+        """
+        name, _ = self.db.get_deck_scheduler(deck_id)
+        name = name or DEFAULT_SCHEDULER
+        if name != SM2Scheduler.name:
+            raise ValueError(f"Deck {deck_id} uses the {name} scheduler, not {SM2Scheduler.name}")
+
+    def review(self, deck_id, grades, now=None):
+        """
+        Apply an SM-2 review to many cards of a deck at once and log them in
+        the revlog. `grades` is a single grade for every card, a sequence with
+        one grade per card in ID order, or a {card ID: grade} dict.
+        Returns the number of cards rescheduled. Raises ValueError for decks
+        with another scheduler rather than switching them to SM-2.
+        """
+        self.require_sm2(deck_id)
+        schedules = self.load(deck_id)
+        if isinstance(grades, dict):
+            positions = schedules.index_of(list(grades))
+            grades = np.fromiter(grades.values(), dtype=np.int64, count=len(grades))
+        else:
+            positions = np.arange(len(schedules))
+            grades = np.broadcast_to(np.asarray(grades, dtype=np.int64), positions.shape)
+        if not len(positions):
+            return 0
+        now = now if now is not None else datetime.now()
+        reviewed_at = to_epoch(now)
+        previous = schedules.interval[positions]
+        (schedules.repetition[positions], schedules.easiness[positions],
+         schedules.interval[positions]) = sm2(schedules.repetition[positions], schedules.easiness[positions],
+                                              previous, grades)
+        schedules.next_review[positions] = reviewed_at + schedules.interval[positions] * DAY
+        # Left over from a time the deck used FSRS; SM-2 does not keep it up to date
+        for i in positions.tolist():
+            schedules.stability[i] = schedules.difficulty[i] = None
+        reviewed_at_ms = int(now.timestamp() * 1000)
+        revlog = list(zip(schedules.ids[positions].tolist(), [reviewed_at_ms] * len(positions), grades.tolist(),
+                          previous.tolist(), schedules.interval[positions].tolist(),
+                          schedules.easiness[positions].tolist(), [None] * len(positions)))
+        if not self.db.update_schedules(schedules.rows(positions, reviewed_at), revlog):
+            return 0
+        return len(positions)
+
+    def rescale_ease(self, deck_id, factor=1.0, minimum=1.3, maximum=None):
+        """
+        Apply an ease policy change: multiply every easiness factor of the deck
+        by `factor` and clamp it to [minimum, maximum]. Intervals are kept.
+        """
+        schedules = self.load(deck_id)
+        easiness = np.clip(schedules.easiness * factor, minimum, maximum)
+        positions = np.flatnonzero(easiness != schedules.easiness)
+        schedules.easiness = easiness
+        return self._write(schedules, positions)
+
+    def shift(self, deck_id, days, due_before=None):
+        """
+        Move the next review date of the deck's cards by `days` (e.g. after a
+        vacation), optionally only for cards due before a date.
+        """
+        schedules = self.load(deck_id)
+        selected = ~np.isnan(schedules.next_review)
+        if due_before is not None:
+            selected &= schedules.next_review < to_epoch(due_before)
+        positions = np.flatnonzero(selected)
+        schedules.next_review[positions] += days * DAY
+        return self._write(schedules, positions)
+
+    def _write(self, schedules, positions):
+        if not len(positions):
+            return 0
+        return len(positions) if self.db.update_schedules(schedules.rows(positions)) else 0
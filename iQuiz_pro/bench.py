@@ -0,0 +1,223 @@
+"""
+Micro-benchmarks for the iQuiz Pro data layer.
+
+Run a single benchmark with e.g. `python bench.py card-memory --rows 100000`.
+Every benchmark works on a throwaway database and prints a small table.
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from db import DatabaseManager
+from flashcardmanager import FlashcardManager
+from records import card_row_factory
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _print_table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header, *rows]:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def _temp_db():
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    return path
+
+
+def _fill_cards(conn, rows, deck_id=1):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS flashcards (
+            ID TEXT PRIMARY KEY, DeckID INTEGER, Question TEXT, Answer TEXT,
+            NextReviewDate DATETIME, ReviewCount INTEGER)
+        """)
+    conn.executemany(
+        "INSERT INTO flashcards VALUES (?, ?, ?, ?, '2024-01-01 00:00:00', 0)",
+        ((f"{i:08x}-0000-4000-8000-000000000000", deck_id, f"question {i}", f"answer {i}") for i in range(rows)))
+    conn.commit()
+
+
+def bench_card_memory(rows):
+    """
+    Memory held by a deck loaded as per-row dicts (the previous row format)
+    versus slotted Card records.
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    _fill_cards(conn, rows)
+    query = "SELECT ID, Question, Answer, NextReviewDate, ReviewCount FROM flashcards WHERE DeckID = 1"
+
+    def as_dicts():
+        return [{"id": row["ID"], "question": row["Question"], "answer": row["Answer"],
+                 "next_review_date": row["NextReviewDate"], "repetition": row["ReviewCount"]}
+                for row in conn.execute(query)]
+
+    def as_cards():
+        cursor = conn.cursor()
+        cursor.row_factory = card_row_factory
+        return cursor.execute(query).fetchall()
+
+    results = []
+    for name, load in (("dict", as_dicts), ("Card", as_cards)):
+        # Time without tracing, then measure the allocations of a second run
+        _, elapsed = _timed(load)
+        tracemalloc.start()
+        cards = load()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append((name, rows, f"{current / 2**20:.1f}", f"{peak / 2**20:.1f}",
+                        f"{current / rows:.0f}", f"{elapsed * 1000:.0f}"))
+        del cards
+    _print_table(("rows as", "rows", "held MiB", "peak MiB", "B/row", "ms"), results)
+
+
+def bench_random_card(rows, draws=20):
+    """
+    Per-draw latency of ORDER BY RANDOM() versus the rowid probe behind
+    get_random_flashcard and the reusable shuffled order behind sample_cards.
+    """
+    path = _temp_db()
+    try:
+        with DatabaseManager(path) as db:
+            deck_id = db.add_deck("bench")
+            db.add_flashcards_bulk(((f"question {i}", f"answer {i}") for i in range(rows)), deck_id, batch_size=50000)
+
+            def order_by_random():
+                return db.conn.execute(
+                    "SELECT Question, Answer FROM flashcards WHERE DeckID = ? ORDER BY RANDOM() LIMIT 1",
+                    (deck_id,)).fetchone()
+
+            _, first_sample = _timed(lambda: db.sample_cards(deck_id, 1))
+            results = []
+            for name, draw in (("ORDER BY RANDOM()", order_by_random),
+                               ("get_random_flashcard", lambda: db.get_random_flashcard(deck_id)),
+                               ("sample_cards(k=1)", lambda: db.sample_cards(deck_id, 1)),
+                               ("sample_cards(k=20) / card", lambda: db.sample_cards(deck_id, 20))):
+                _, elapsed = _timed(lambda: [draw() for _ in range(draws)])
+                per_draw = elapsed / draws / (20 if "k=20" in name else 1)
+                results.append((name, rows, f"{per_draw * 1000:.3f}"))
+            results.append(("sample_cards first call", rows, f"{first_sample * 1000:.3f}"))
+        _print_table(("method", "rows", "ms/card"), results)
+    finally:
+        os.remove(path)
+
+
+def bench_batch_schedule(rows):
+    """
+    Rescheduling a whole deck with one grade per card: the per-card
+    super_memo loop versus the vectorized BatchScheduler.
+    """
+    path = _temp_db()
+    try:
+        manager = FlashcardManager(db_file=path)
+        deck_id = manager.create_deck("bench")
+        manager.db.add_flashcards_bulk(((f"question {i}", f"answer {i}") for i in range(rows)), deck_id,
+                                       batch_size=50000)
+        card_ids = [row[0] for row in manager.db.get_deck_schedules(deck_id)]
+        grades = dict(zip(card_ids, itertools.cycle((5, 3, 2, 0, 4))))
+
+        def per_card():
+            for card_id, grade in grades.items():
+                manager.super_memo(card_id, grade)
+
+        results = []
+        for name, run in (("super_memo loop", per_card),
+                          ("BatchScheduler.review", lambda: manager.reschedule_deck(grades, deck_id))):
+            _, elapsed = _timed(run)
+            results.append((name, rows, f"{elapsed * 1000:.0f}", f"{elapsed / rows * 1e6:.1f}"))
+        manager.close()
+        _print_table(("method", "rows", "ms", "us/card"), results)
+    finally:
+        os.remove(path)
+
+
+def bench_forecast(rows, days=365):
+    """
+    Forecast time for a deck of `rows` cards with random SM-2 states, by
+    number of Monte Carlo runs, and four scenarios run serially versus in a
+    process pool.
+    """
+    import numpy as np
+    from forecast import simulate, simulate_scenarios
+
+    rng = np.random.default_rng(0)
+    state = (rng.integers(0, 6, rows), rng.uniform(1.3, 3.0, rows), rng.integers(1, 60, rows),
+             rng.integers(-5, 60, rows))
+    results = []
+    for runs in (1, 10):
+        _, elapsed = _timed(lambda: simulate(*state, days=days, runs=runs, seed=0))
+        results.append((f"simulate, {runs} runs", rows, days, f"{elapsed:.2f}"))
+    scenarios = [dict(days=days, runs=5, new_per_day=new, seed=new) for new in (0, 10, 20, 50)]
+    _, elapsed = _timed(lambda: [simulate(*state, **options) for options in scenarios])
+    results.append(("4 scenarios, serial", rows, days, f"{elapsed:.2f}"))
+    _, elapsed = _timed(lambda: simulate_scenarios(state, scenarios))
+    results.append(("4 scenarios, process pool", rows, days, f"{elapsed:.2f}"))
+    _print_table(("method", "cards", "days", "s"), results)
+
+
+def bench_fsrs_fit(rows, reviews_per_card=20):
+    """
+    Time to fit FSRS weights to `rows` review log records of cards whose
+    reviews were drawn from the FSRS model itself, sampled versus full-batch.
+    """
+    import numpy as np
+    from fsrsfit import DAY_MS, ReviewHistory, _first_step, _review_step, fit
+    from schedulers import DEFAULT_WEIGHTS, MAX_INTERVAL
+
+    rng = np.random.default_rng(0)
+    cards = max(rows // reviews_per_card, 1)
+    w = np.array(DEFAULT_WEIGHTS)
+    day = rng.integers(0, 30, cards).astype(np.float64)
+    rating = rng.choice([1, 2, 3, 4], cards, p=[0.2, 0.1, 0.6, 0.1])
+    stability, difficulty = _first_step(w, rating)
+    columns = [(np.arange(cards), day.copy(), rating)]
+    for _ in range(reviews_per_card - 1):
+        elapsed = np.maximum(np.round(stability * rng.uniform(0.7, 1.5, cards)), 1)
+        day += elapsed
+        recalled = rng.random(cards) < (1 + 19 / 81 * elapsed / stability) ** -0.5
+        rating = np.where(recalled, rng.choice([2, 3, 4], cards, p=[0.15, 0.75, 0.1]), 1)
+        step = _review_step(w, stability, difficulty, elapsed, rating)
+        stability = np.clip(step["new_stability"], 0.1, MAX_INTERVAL)
+        difficulty = np.clip(step["new_difficulty"], 1, 10)
+        columns.append((np.arange(cards), day.copy(), rating))
+    card_ids, days, ratings = (np.concatenate(column) for column in zip(*columns))
+
+    history, elapsed = _timed(lambda: ReviewHistory(card_ids, (days * DAY_MS).astype(np.int64), ratings + 1))
+    results = [("build history", len(history), "", f"{elapsed:.2f}")]
+    for name, sample in (("fit, sampled", None), ("fit, all reviews", 0)):
+        options = {} if sample is None else {"sample": sample}
+        (_, loss), elapsed = _timed(lambda: fit(history, **options))
+        results.append((name, len(history), f"{loss:.4f}", f"{elapsed:.2f}"))
+    _print_table(("step", "reviews", "log loss", "s"), results)
+
+
+BENCHMARKS = {
+    "batch-schedule": bench_batch_schedule,
+    "forecast": bench_forecast,
+    "fsrs-fit": bench_fsrs_fit,
+    "card-memory": bench_card_memory,
+    "random-card": bench_random_card,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="iQuiz Pro micro-benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000])
+    args = parser.parse_args(argv)
+    for rows in args.rows:
+        BENCHMARKS[args.benchmark](rows)
+
+
+if __name__ == "__main__":
+    main()
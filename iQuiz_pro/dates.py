@@ -0,0 +1,26 @@
+"""
+Conversions for card dates, which are stored as integer epoch seconds.
+"""
+from datetime import datetime
+
+
+def to_epoch(value):
+    """
+    Convert a datetime, an ISO date string (the format older databases stored)
+    or a number to integer epoch seconds. Naive datetimes are local time.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+def from_epoch(value):
+    return None if value is None else datetime.fromtimestamp(value)
+
+
+def format_epoch(value, fmt="%Y-%m-%d %H:%M"):
+    return "" if value is None else from_epoch(value).strftime(fmt)
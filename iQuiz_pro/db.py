@@ -1,19 +1,88 @@
 import sqlite3
 from datetime import datetime
+import json
 import uuid
 import os
+import threading
+import random
 
 DB_FILE = "flashcards.db"
+# Cards deleted per transaction by delete_cards and delete_deck
+DELETE_CHUNK_SIZE = 500
 from loggers import db_logger  # Ensure your logging setup is correct
+from dates import to_epoch
+from migrations import latest_version, pending_migrations
+from dbpool import ReaderPool, WriterThread, tune_connection, writes
+from records import card_row_factory, schedule_row_factory
+from search import (FTS_BACKFILL, FTS_SCHEMA, FTS_TABLE, build_match_query, fts5_available, nikkud_fold,
+                    register_functions)
+from sampling import DeckShuffle
+from tagquery import TagBitmaps, bitmap_to_ids, ids_to_bitmap, parse_tag_query
+from reviewjournal import ReviewJournal, DEFAULT_FLUSH_EVERY, DEFAULT_FLUSH_INTERVAL
+from backup import BackupManager, DEFAULT_KEEP
+
+REVLOG_INSERT = """
+    INSERT OR IGNORE INTO revlog (CardID, ReviewedAt, Grade, PrevInterval, NewInterval, Ease, LatencyMs)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Schedule fields that may be pending in the review journal
+SCHEDULE_FIELDS = ("repetition", "easiness_factor", "interval", "next_review_date", "last_reviewed_at",
+                   "stability", "difficulty")
 
 class DatabaseManager:
-    def __init__(self, db_file=DB_FILE):
+    def __init__(self, db_file=DB_FILE, concurrent=False, write_behind=False,
+                 flush_every=DEFAULT_FLUSH_EVERY, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        :param db_file: Path of the SQLite database
+        :param concurrent: Use the WAL journal, a per-thread reader connection pool
+            and a single writer thread instead of one shared connection
+        :param write_behind: Keep review results in a ReviewJournal and commit them
+            in batches of `flush_every` reviews or every `flush_interval` seconds
+        """
         self.db_file = db_file
+        self.concurrent = concurrent
+        self._conn = None
+        self._writer = None
+        self._readers = None
+        self._journal = None
+        self._tag_ids = None  # Tag name -> ID, loaded on first use
+        self._tag_lock = threading.Lock()
+        self._tag_bitmaps = None  # TagBitmaps, loaded by the first tag query
+        self._deck_bitmaps = {}  # deck ID (None for all decks) -> card ID bitset, loaded on first use
+        self._deck_bitmaps_version = 0  # Bumped by every change, so a load racing one is not cached
+        self._shuffles = {}  # deck ID -> DeckShuffle, dropped when the deck changes
+        self._backups = []  # BackupManagers that may still be compressing
         if not os.path.exists(self.db_file):
             db_logger.warning("Database file not found. Creating new database file.")
-        self.conn = self._connect_to_db()
+        if concurrent:
+            self._writer = WriterThread(self._connect_to_db)
+            self._writer.start()
+            self._readers = ReaderPool(lambda: self._connect_to_db(readonly=True))
+        else:
+            self._conn = self._connect_to_db()
+        self._migrate()
         self._create_tables()
+        self._ensure_unique_tag_names()
+        self.search_enabled = self._create_search_index()
+        if write_behind:
+            self._journal = ReviewJournal(self._apply_reviews, self.db_file + "-reviews.log",
+                                          flush_every, flush_interval, background=concurrent)
 
+    @property
+    def conn(self):
+        """
+        The connection for the calling thread: the shared connection in the
+        default mode, otherwise the writer's connection on the writer thread and
+        a pooled read-only connection everywhere else.
+        """
+        if self._writer is None:
+            return self._conn
+        if self._writer.is_current():
+            return self._writer.conn
+        return self._readers.get()
+
+    @writes
     def remove_tag(self, card_id, tag):
         try:
             cursor = self.conn.cursor()
@@ -24,33 +93,182 @@ class DatabaseManager:
                 )
                 """, (card_id, tag))
             self.conn.commit()
+            if self._tag_bitmaps is not None:
+                self._tag_bitmaps.remove(card_id, tag)
             db_logger.info(f"Tag '{tag}' removed from flashcard {card_id}")
         except sqlite3.Error as e:
             db_logger.error(f"Failed to remove tag from flashcard: {e}")
         finally:
             cursor.close()
 
-    def _connect_to_db(self):
-        conn = sqlite3.connect(self.db_file)
+    def _connect_to_db(self, readonly=False):
+        conn = sqlite3.connect(self.db_file, check_same_thread=not self.concurrent)
         conn.row_factory = sqlite3.Row  # Enables column access by name
+        # Enforce the ON DELETE CASCADE clauses of the schema
+        conn.execute("PRAGMA foreign_keys=ON")
+        register_functions(conn)
+        if self.concurrent:
+            tune_connection(conn, readonly)
         return conn
 
-    def update_card_data(self, card_id, review_count, easiness_factor, interval, next_review_date):
+    def update_card_data(self, card_id, review_count, easiness_factor, interval, next_review_date,
+                         grade=None, prev_interval=None, latency_ms=None, stability=None, difficulty=None):
+        """
+        Store a card's new schedule. When `grade` is given the review is also
+        appended to the revlog, in the same transaction as the schedule update
+        (or the same journal flush in write-behind mode), so logging costs no
+        extra commit. `stability` and `difficulty` are the FSRS memory state,
+        None for cards scheduled by SM-2.
+        """
+        now = datetime.now()
+        last_reviewed_at = to_epoch(now)
+        next_review_date = to_epoch(next_review_date)
+        revlog = None
+        if grade is not None:
+            revlog = (card_id, int(now.timestamp() * 1000), grade, prev_interval, interval, easiness_factor, latency_ms)
+        if self._journal is not None:
+            self._journal.record(card_id, review_count, easiness_factor, interval, next_review_date, last_reviewed_at, revlog,
+                                 stability, difficulty)
+            return
+        self._update_card_data(card_id, review_count, easiness_factor, interval, next_review_date, last_reviewed_at, revlog,
+                               stability, difficulty)
+
+    @writes
+    def _update_card_data(self, card_id, review_count, easiness_factor, interval, next_review_date, last_reviewed_at, revlog=None,
+                          stability=None, difficulty=None):
         try:
-            last_reviewed_at = datetime.now()
             cursor = self.conn.cursor()
             cursor.execute("""
                 UPDATE flashcards
                 SET ReviewCount = ?, EasinessFactor = ?, Interval = ?,
-                    NextReviewDate = ?, LastReviewedAt = ?
+                    NextReviewDate = ?, LastReviewedAt = ?, Stability = ?, Difficulty = ?
                 WHERE ID = ?
-                """, (review_count, easiness_factor, interval, next_review_date, last_reviewed_at, card_id))
+                """, (review_count, easiness_factor, interval, next_review_date, last_reviewed_at, stability, difficulty,
+                      card_id))
+            if revlog is not None:
+                cursor.execute(REVLOG_INSERT, revlog)
             self.conn.commit()
             db_logger.info(f"Card {card_id} updated with new data.")
         except sqlite3.Error as e:
             db_logger.error(f"Failed to update card data: {e}")
         finally:
             cursor.close()
+
+    @writes
+    def _apply_reviews(self, rows, revlog_rows=()):
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany("""
+                UPDATE flashcards
+                SET ReviewCount = ?, EasinessFactor = ?, Interval = ?,
+                    NextReviewDate = ?, LastReviewedAt = ?, Stability = ?, Difficulty = ?
+                WHERE ID = ?
+                """, [row for row in rows if not isinstance(row[-1], str)])
+            # Crash logs written before the integer key migration refer to UUIDs
+            cursor.executemany("""
+                UPDATE flashcards
+                SET ReviewCount = ?, EasinessFactor = ?, Interval = ?,
+                    NextReviewDate = ?, LastReviewedAt = ?, Stability = ?, Difficulty = ?
+                WHERE UUID = ?
+                """, [row for row in rows if isinstance(row[-1], str)])
+            cursor.executemany(REVLOG_INSERT, revlog_rows)
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            db_logger.error(f"Failed to apply journaled reviews: {e}")
+            return False
+        finally:
+            cursor.close()
+
+    def flush_reviews(self):
+        if self._journal is not None:
+            self._journal.flush()
+
+    def update_schedules(self, rows, revlog_rows=()):
+        """
+        Write many card schedules, as (repetition, easiness factor, interval,
+        next review date, last reviewed at, stability, difficulty, card ID)
+        rows, and their review log rows with one executemany each in a single
+        transaction.
+        """
+        return self._apply_reviews(rows, revlog_rows)
+
+    def get_deck_schedules(self, deck_id):
+        """
+        Return (ID, ReviewCount, EasinessFactor, Interval, NextReviewDate,
+        LastReviewedAt, Stability, Difficulty) of every card of a deck in ID
+        order, for batch rescheduling. Pending write-behind reviews are
+        flushed first.
+        """
+        self.flush_reviews()
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = None
+            cursor.execute("""
+                SELECT ID, COALESCE(ReviewCount, 0), COALESCE(EasinessFactor, 2.5), COALESCE(Interval, 1),
+                       NextReviewDate, LastReviewedAt, Stability, Difficulty
+                FROM flashcards WHERE DeckID = ?
+                ORDER BY ID
+                """, (deck_id,))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch schedules of deck {deck_id}: {e}")
+            return []
+        finally:
+            cursor.close()
+
+    def _with_pending(self, card_id, card):
+        """
+        Overlay the unflushed schedule of a card on a card dict read from the table.
+        """
+        if self._journal is None or card is None:
+            return card
+        entry = self._journal.get(card_id)
+        if entry:
+            for field in SCHEDULE_FIELDS:
+                if field in card:
+                    card[field] = entry[field]
+        return card
+
+    @writes
+    def _migrate(self):
+        """
+        Bring an existing database up to the latest schema version, running all
+        pending migration steps and the version bump in one transaction. A new
+        database is created at the latest version by _create_tables. Foreign
+        keys are off while the steps run, so rebuilding a table does not cascade
+        into its children.
+        """
+        try:
+            cursor = self.conn.cursor()
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'flashcards'")
+            if cursor.fetchone() is None:
+                cursor.execute(f"PRAGMA user_version = {latest_version()}")
+                return
+            steps = pending_migrations(version)
+            if not steps:
+                return
+            cursor.execute("PRAGMA foreign_keys=OFF")
+            cursor.execute("BEGIN")
+            for step_version, step in steps:
+                db_logger.warning(f"Migrating database to version {step_version}: {step.__name__}")
+                step(cursor)
+            violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                db_logger.warning(f"{len(violations)} rows reference missing parents after migration.")
+            cursor.execute(f"PRAGMA user_version = {steps[-1][0]}")
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            db_logger.error(f"Database migration failed, schema left at version {version}: {e}")
+            raise
+        finally:
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+    @writes
     def _create_tables(self):
         try:
             cursor = self.conn.cursor()
@@ -58,19 +276,26 @@ class DatabaseManager:
                 CREATE TABLE IF NOT EXISTS decks (
                     ID INTEGER PRIMARY KEY AUTOINCREMENT,
                     Name TEXT NOT NULL,
-                    CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+                    CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    Scheduler TEXT NOT NULL DEFAULT 'sm2',
+                    SchedulerParams TEXT  -- JSON
                 );
                 CREATE TABLE IF NOT EXISTS flashcards (
-                    ID TEXT PRIMARY KEY,
+                    ID INTEGER PRIMARY KEY,
+                    UUID TEXT NOT NULL UNIQUE,
                     DeckID INTEGER NOT NULL,
                     Question TEXT NOT NULL,
                     Answer TEXT NOT NULL,
                     ReviewCount INTEGER DEFAULT 0,
-                    LastReviewedAt DATETIME,
+                    LastReviewedAt INTEGER,
                     EasinessFactor REAL DEFAULT 2.5,
                     Interval INTEGER DEFAULT 1,
-                    NextReviewDate DATETIME,
-                    CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    NextReviewDate INTEGER,
+                    CreatedAt INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                    Stability REAL,  -- FSRS memory state, NULL when scheduled by SM-2
+                    Difficulty REAL,
+                    QuestionPlain TEXT,  -- Question and Answer folded by search.nikkud_fold
+                    AnswerPlain TEXT,
                     FOREIGN KEY (DeckID) REFERENCES decks(ID) ON DELETE CASCADE
                 );
                 CREATE TABLE IF NOT EXISTS tags (
@@ -78,12 +303,40 @@ class DatabaseManager:
                     Name TEXT NOT NULL
                 );
                 CREATE TABLE IF NOT EXISTS flashcard_tags (
-                    FlashcardID TEXT NOT NULL,
+                    FlashcardID INTEGER NOT NULL,
                     TagID INTEGER NOT NULL,
                     PRIMARY KEY (FlashcardID, TagID),
                     FOREIGN KEY (FlashcardID) REFERENCES flashcards(ID) ON DELETE CASCADE,
                     FOREIGN KEY (TagID) REFERENCES tags(ID) ON DELETE CASCADE
                 );
+                CREATE INDEX IF NOT EXISTS idx_flashcards_deck_due
+                    ON flashcards (DeckID, NextReviewDate);
+                CREATE INDEX IF NOT EXISTS idx_flashcards_deck
+                    ON flashcards (DeckID);
+                CREATE INDEX IF NOT EXISTS idx_flashcards_deck_new
+                    ON flashcards (DeckID) WHERE LastReviewedAt IS NULL;
+                -- Cascading a tag deletion looks links up by TagID
+                CREATE INDEX IF NOT EXISTS idx_flashcard_tags_tag
+                    ON flashcard_tags (TagID, FlashcardID);
+                CREATE TABLE IF NOT EXISTS revlog (
+                    CardID INTEGER NOT NULL,
+                    ReviewedAt INTEGER NOT NULL,  -- epoch milliseconds
+                    Grade INTEGER NOT NULL,
+                    PrevInterval INTEGER,
+                    NewInterval INTEGER,
+                    Ease REAL,
+                    LatencyMs INTEGER,
+                    PRIMARY KEY (CardID, ReviewedAt)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_revlog_reviewed_at
+                    ON revlog (ReviewedAt);
+                CREATE TABLE IF NOT EXISTS imports (
+                    Source TEXT NOT NULL,
+                    DeckID INTEGER NOT NULL,
+                    RowsCommitted INTEGER NOT NULL DEFAULT 0,
+                    UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (Source, DeckID)
+                );
             """)
             self.conn.commit()
         except sqlite3.Error as e:
@@ -91,40 +344,119 @@ class DatabaseManager:
         finally:
             cursor.close()
 
-    def get_tag_ids(self, tag_names):
+    @writes
+    def _ensure_unique_tag_names(self):
+        """
+        Merge duplicate tag names left by older versions and back tags.Name with a
+        UNIQUE index, so tag lookups are index seeks and INSERT ... ON CONFLICT works.
+        """
         try:
             cursor = self.conn.cursor()
-            tag_ids = []
-            for tag_name in tag_names:
-                cursor.execute("SELECT ID FROM tags WHERE Name = ?", (tag_name))
-                row = cursor.fetchone()
-                if row:
-                    tag_ids.append(row["ID"])
-                else:
-                    tag_id = self.add_new_tag(tag_name)
-                    if tag_id:
-                        tag_ids.append(tag_id)
-            return tag_ids
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_tags_name'")
+            if cursor.fetchone():
+                return
+            cursor.executescript("""
+                BEGIN;
+                UPDATE OR IGNORE flashcard_tags
+                SET TagID = (SELECT MIN(t2.ID) FROM tags t1 JOIN tags t2 ON t1.Name = t2.Name
+                             WHERE t1.ID = flashcard_tags.TagID);
+                DELETE FROM flashcard_tags WHERE TagID NOT IN (SELECT MIN(ID) FROM tags GROUP BY Name);
+                DELETE FROM tags WHERE ID NOT IN (SELECT MIN(ID) FROM tags GROUP BY Name);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_tags_name ON tags (Name);
+                COMMIT;
+            """)
+            db_logger.info("Created unique index on tag names.")
         except sqlite3.Error as e:
-            db_logger.error(f"Failed to fetch tag IDs: {e}")
-            return []
+            self.conn.rollback()
+            db_logger.error(f"Failed to create unique tag index: {e}")
         finally:
             cursor.close()
 
+    @writes
+    def _create_search_index(self):
+        """
+        Create the FTS5 search table and its sync triggers, indexing existing
+        cards the first time. Returns False if SQLite was built without FTS5.
+        """
+        if not fts5_available(self.conn):
+            db_logger.warning("SQLite has no FTS5 support, card search falls back to LIKE.")
+            return False
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,))
+            exists = cursor.fetchone() is not None
+            cursor.executescript(FTS_SCHEMA)
+            if not exists:
+                cursor.execute(FTS_BACKFILL)
+                db_logger.info(f"Indexed {cursor.rowcount} cards for search.")
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            db_logger.error(f"Failed to create search index: {e}")
+            return False
+        finally:
+            cursor.close()
+
+    def _tag_cache(self):
+        if self._tag_ids is None:
+            with self._tag_lock:
+                if self._tag_ids is None:
+                    self._tag_ids = self._load_tag_ids()
+        return self._tag_ids
+
+    def _load_tag_ids(self):
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT ID, Name FROM tags ORDER BY ID")
+            return {row["Name"]: row["ID"] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to load tags: {e}")
+            return {}
+        finally:
+            cursor.close()
+
+    def _resolve_tag_ids(self, cursor, tag_names):
+        """
+        Return the IDs of the given tags and a name -> ID dict of the tags that
+        were inserted on `cursor`. The caller commits and then adds those to the cache.
+        """
+        cache = self._tag_cache()
+        missing = [name for name in dict.fromkeys(tag_names) if name not in cache]
+        new_ids = {}
+        if missing:
+            cursor.executemany("INSERT INTO tags (Name) VALUES (?) ON CONFLICT (Name) DO NOTHING",
+                               [(name,) for name in missing])
+            cursor.execute(f"SELECT ID, Name FROM tags WHERE Name IN ({','.join('?' * len(missing))})", missing)
+            new_ids = {row["Name"]: row["ID"] for row in cursor.fetchall()}
+        return [cache.get(name) or new_ids[name] for name in tag_names], new_ids
+
+    def get_tag_ids(self, tag_names):
+        cache = self._tag_cache()
+        tag_ids = []
+        for tag_name in tag_names:
+            tag_id = cache.get(tag_name) or self.add_new_tag(tag_name)
+            if tag_id:
+                tag_ids.append(tag_id)
+        return tag_ids
+
+    @writes
     def add_new_tag(self, tag_name):
         try:
             cursor = self.conn.cursor()
-            cursor.execute("INSERT INTO tags (Name) VALUES (?)", (tag_name))
-            tag_id = cursor.lastrowid
+            (tag_id,), new_ids = self._resolve_tag_ids(cursor, [tag_name])
             self.conn.commit()
+            self._tag_cache().update(new_ids)
             db_logger.info(f"Tag '{tag_name}' added with ID {tag_id}")
             return tag_id
         except sqlite3.Error as e:
+            self.conn.rollback()
             db_logger.error(f"Failed to add tag: {e}")
             return None
         finally:
             cursor.close()
 
+    @writes
     def add_tag_to_flashcard(self, flashcard_id, tag_id):
         try:
             cursor = self.conn.cursor()
@@ -156,6 +488,7 @@ class DatabaseManager:
     def get_flashcards_with_tag(self, tag_name):
         try:
             cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
             cursor.execute("""
                 SELECT f.ID, f.Question, f.Answer
                 FROM flashcards f
@@ -163,8 +496,7 @@ class DatabaseManager:
                 JOIN tags t ON ft.TagID = t.ID
                 WHERE t.Name = ?
                 """, (tag_name,))
-            flashcards = [{"id": row["ID"], "question": row["Question"], "answer": row["Answer"]} for row in cursor.fetchall()]
-            return flashcards
+            return cursor.fetchall()
         except sqlite3.Error as e:
             db_logger.error(f"Failed to fetch flashcards with tag: {e}")
             return []
@@ -188,46 +520,144 @@ class DatabaseManager:
                 return []
             finally:
                 cursor.close()
+        return list(self._tag_cache())
+
+    def set_tag(self, card_id, tag):
+        self.set_tags(card_id, tag if isinstance(tag, list) else [tag])
+
+    def _set_tag(self, card_id, tag):
+        self.set_tags(card_id, [tag])
+
+    @writes
+    def set_tags(self, card_id, tag_names):
+        """
+        Attach several tags to a card in one transaction, creating missing tags.
+        Tags the card already has are left untouched.
+        """
+        if not tag_names:
+            return
         try:
             cursor = self.conn.cursor()
-            cursor.execute("SELECT Name FROM tags")
-            tags = [row["Name"] for row in cursor.fetchall()]
-            return tags
+            tag_ids, new_ids = self._resolve_tag_ids(cursor, tag_names)
+            cursor.executemany("INSERT OR IGNORE INTO flashcard_tags (FlashcardID, TagID) VALUES (?, ?)",
+                               [(card_id, tag_id) for tag_id in tag_ids])
+            self.conn.commit()
+            self._tag_cache().update(new_ids)
+            if self._tag_bitmaps is not None:
+                self._tag_bitmaps.add(card_id, tag_names)
+            db_logger.info(f"Tags {tag_names} set for flashcard {card_id}")
         except sqlite3.Error as e:
-            db_logger.error(f"Failed to fetch tags: {e}")
-            return []
+            self.conn.rollback()
+            db_logger.error(f"Failed to set tags for flashcard: {e}")
         finally:
             cursor.close()
 
-    def set_tag(self, card_id, tag):
-        if isinstance(tag, list):
-            for t in tag:
-                self._set_tag(card_id, t)
-        else:
-            self._set_tag(card_id, tag)
+    def _tag_bitmap_index(self):
+        if self._tag_bitmaps is None:
+            with self._tag_lock:
+                if self._tag_bitmaps is None:
+                    self._tag_bitmaps = self._load_tag_bitmaps()
+        return self._tag_bitmaps
 
-    def _set_tag(self, card_id, tag):
+    def _load_tag_bitmaps(self):
         try:
             cursor = self.conn.cursor()
-            cursor.execute("SELECT ID FROM tags WHERE Name = ?", (tag,))
-            row = cursor.fetchone()
-            if row:
-                tag_id = row["ID"]
+            cursor.execute("SELECT t.Name, ft.FlashcardID FROM flashcard_tags ft JOIN tags t ON t.ID = ft.TagID")
+            return TagBitmaps(cursor)
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to load tag bitmaps: {e}")
+            return TagBitmaps(())
+        finally:
+            cursor.close()
+
+    def _card_id_bitmap(self, deck_id):
+        """
+        The IDs of the cards of a deck (or all cards) as a bitset, cached and
+        kept up to date by the methods adding and deleting cards.
+        """
+        with self._tag_lock:
+            bitmap = self._deck_bitmaps.get(deck_id)
+            version = self._deck_bitmaps_version
+        if bitmap is not None:
+            return bitmap
+        try:
+            cursor = self.conn.cursor()
+            if deck_id is None:
+                cursor.execute("SELECT ID FROM flashcards")
             else:
-                cursor.execute("INSERT INTO tags (Name) VALUES (?)", (tag,))
-                tag_id = cursor.lastrowid
-            cursor.execute("INSERT INTO flashcard_tags (FlashcardID, TagID) VALUES (?, ?)", (card_id, tag_id))
-            self.conn.commit()
-            db_logger.info(f"Tag '{tag}' set for flashcard {card_id}")
+                cursor.execute("SELECT ID FROM flashcards WHERE DeckID = ?", (deck_id,))
+            bitmap = ids_to_bitmap(row[0] for row in cursor)
         except sqlite3.Error as e:
-            db_logger.error(f"Failed to set tag for flashcard: {e}")
+            db_logger.error(f"Failed to fetch card IDs of deck {deck_id}: {e}")
+            return 0
         finally:
             cursor.close()
+        with self._tag_lock:
+            if version == self._deck_bitmaps_version:
+                self._deck_bitmaps[deck_id] = bitmap
+        return bitmap
+
+    def _card_ids_added(self, deck_id, card_id):
+        with self._tag_lock:
+            self._deck_bitmaps_version += 1
+            for key in (deck_id, None):
+                if key in self._deck_bitmaps:
+                    self._deck_bitmaps[key] |= 1 << card_id
+
+    def _card_ids_removed(self, card_ids):
+        mask = ids_to_bitmap(card_ids)
+        with self._tag_lock:
+            self._deck_bitmaps_version += 1
+            for key in self._deck_bitmaps:
+                self._deck_bitmaps[key] &= ~mask
+
+    def match_tags(self, expression, deck_id=None):
+        """
+        Return the IDs of the cards (of a deck, or all) matching a boolean tag
+        expression such as "verbs AND NOT mastered", ascending. See tagquery for
+        the syntax; raises ValueError if the expression does not parse.
+        """
+        node = parse_tag_query(expression)
+        return bitmap_to_ids(self._tag_bitmap_index().evaluate(node, self._card_id_bitmap(deck_id)))
+
+    def iter_cards_by_tags(self, expression, deck_id=None, page_size=500):
+        """
+        Stream the cards matching a tag expression in ID order. The expression
+        is evaluated on the in-memory bitmaps; only matching rows are read.
+        """
+        card_ids = self.match_tags(expression, deck_id)
+        for start in range(0, len(card_ids), page_size):
+            chunk = card_ids[start:start + page_size]
+            try:
+                cursor = self.conn.cursor()
+                cursor.row_factory = card_row_factory
+                cursor.execute(f"""
+                    SELECT ID, Question, Answer, NextReviewDate, ReviewCount
+                    FROM flashcards
+                    WHERE ID IN ({",".join("?" * len(chunk))})
+                    ORDER BY ID
+                    """, chunk)
+                cards = [self._with_pending(card.id, card) for card in cursor.fetchall()]
+            except sqlite3.Error as e:
+                db_logger.error(f"Failed to fetch cards for tag query {expression!r}: {e}")
+                return
+            finally:
+                cursor.close()
+            yield from cards
+
+    def filter_cards_by_tags(self, cards, expression):
+        """
+        Keep the cards of an already loaded list that match a tag expression.
+        """
+        bitmap = self._tag_bitmap_index().evaluate(
+            parse_tag_query(expression), ids_to_bitmap(card["id"] for card in cards))
+        return [card for card in cards if bitmap >> card["id"] & 1]
 
     def get_cards_from_deck(self, deck_id, tag=None):
         if tag:
             try:
                 cursor = self.conn.cursor()
+                cursor.row_factory = card_row_factory
                 cursor.execute("""
                     SELECT f.ID, f.Question, f.Answer, f.NextReviewDate, f.ReviewCount
                     FROM flashcards f
@@ -235,8 +665,7 @@ class DatabaseManager:
                     JOIN tags t ON ft.TagID = t.ID
                     WHERE f.DeckID = ? AND t.Name = ?
                     """, (deck_id, tag))
-                cards = [{"id": row["ID"], "question": row["Question"], "answer": row["Answer"], "next_review_date": row["NextReviewDate"], "repetition": row["ReviewCount"]} for row in cursor.fetchall()]
-                return cards
+                return [self._with_pending(card.id, card) for card in cursor.fetchall()]
             except sqlite3.Error as e:
                 db_logger.error(f"Failed to fetch cards from deck {deck_id} with tag {tag}: {e}")
                 return []
@@ -244,15 +673,387 @@ class DatabaseManager:
                 cursor.close()
         try:
             cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
             cursor.execute("SELECT ID, Question, Answer, NextReviewDate, ReviewCount FROM flashcards WHERE DeckID = ?", (deck_id,))
-            cards = [{"id": row["ID"], "question": row["Question"], "answer": row["Answer"], "next_review_date": row["NextReviewDate"], "repetition": row["ReviewCount"]} for row in cursor.fetchall()]
-            return cards
+            return [self._with_pending(card.id, card) for card in cursor.fetchall()]
         except sqlite3.Error as e:
             db_logger.error(f"Failed to fetch cards from deck {deck_id}: {e}")
             return []
         finally:
             cursor.close()
 
+    def get_cards_page(self, deck_id=None, tag=None, after=None, page_size=500):
+        """
+        Return one keyset-paginated page of cards ordered by ID, optionally limited
+        to a deck and/or a tag, together with the key to pass as `after` for the
+        next page (None once the last page was returned).
+        """
+        conditions, params, join = [], [], ""
+        if tag is not None:
+            tag_id = self._tag_cache().get(tag)
+            if tag_id is None:
+                return [], None
+            join = "JOIN flashcard_tags ft ON ft.FlashcardID = f.ID AND ft.TagID = ?"
+            params.append(tag_id)
+        if deck_id is not None:
+            conditions.append("f.DeckID = ?")
+            params.append(deck_id)
+        if after is not None:
+            conditions.append("f.ID > ?")
+            params.append(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
+            cursor.execute(f"""
+                SELECT f.ID, f.Question, f.Answer, f.NextReviewDate, f.ReviewCount
+                FROM flashcards f {join}
+                {where}
+                ORDER BY f.ID
+                LIMIT ?
+                """, (*params, page_size))
+            cards = [self._with_pending(card.id, card) for card in cursor]
+            return cards, (cards[-1].id if len(cards) == page_size else None)
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch cards page from deck {deck_id}: {e}")
+            return [], None
+        finally:
+            cursor.close()
+
+    def iter_cards(self, deck_id=None, tag=None, after=None, page_size=500):
+        """
+        Stream cards page by page in stable ID order with memory bounded by
+        `page_size`. No cursor is kept open between pages, so the caller may
+        write to the database while iterating.
+        """
+        while True:
+            cards, after = self.get_cards_page(deck_id, tag, after, page_size)
+            yield from cards
+            if after is None:
+                return
+
+    def search_cards(self, query, deck_id=None, limit=50):
+        """
+        Full-text search over questions and answers, best matches first. Pointed
+        and unpointed Hebrew match each other.
+        """
+        match = build_match_query(query)
+        if not match:
+            return []
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
+            if self.search_enabled:
+                cursor.execute(f"""
+                    SELECT f.ID, f.Question, f.Answer, f.NextReviewDate, f.ReviewCount
+                    FROM {FTS_TABLE} s
+                    JOIN flashcards f ON f.rowid = s.rowid
+                    WHERE {FTS_TABLE} MATCH ? AND (? IS NULL OR f.DeckID = ?)
+                    ORDER BY s.rank
+                    LIMIT ?
+                    """, (match, deck_id, deck_id, limit))
+            else:
+                pattern = f"%{query.strip()}%"
+                cursor.execute("""
+                    SELECT ID, Question, Answer, NextReviewDate, ReviewCount
+                    FROM flashcards
+                    WHERE (Question LIKE ? OR Answer LIKE ?) AND (? IS NULL OR DeckID = ?)
+                    LIMIT ?
+                    """, (pattern, pattern, deck_id, deck_id, limit))
+            return [self._with_pending(card.id, card) for card in cursor.fetchall()]
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to search cards for '{query}': {e}")
+            return []
+        finally:
+            cursor.close()
+
+    def get_due_cards(self, deck_id, now=None, limit=1):
+        """
+        Return up to `limit` cards of the deck ordered by NextReviewDate, served
+        from the (DeckID, NextReviewDate) index. When `now` is given only cards
+        due at or before it are returned.
+        """
+        pending = self._journal.pending() if self._journal is not None else {}
+        if not pending:
+            return self._query_due_cards(deck_id, now, limit)
+        # Pending reviews may have moved cards in or out of the window: over-fetch
+        # by the number of pending cards and re-rank them with their new dates
+        cards = [card for card in self._query_due_cards(deck_id, now, limit + len(pending))
+                 if card.id not in pending]
+        cards += [self._with_pending(card.id, card) for card in self._get_cards_by_ids(deck_id, list(pending))]
+        if now is not None:
+            cutoff = to_epoch(now)
+            cards = [card for card in cards if card.next_review_date is not None and card.next_review_date <= cutoff]
+        cards.sort(key=lambda card: (card.next_review_date is not None, card.next_review_date or ""))
+        return cards[:limit]
+
+    def iter_due_reviews(self, deck_id, now=None, page_size=100):
+        """
+        Stream the already reviewed cards of a deck that are due at `now`
+        (default: now), earliest first, a page at a time along the
+        (DeckID, NextReviewDate) index.
+        """
+        now = to_epoch(now if now is not None else datetime.now())
+        after = (-1, -1)
+        while True:
+            try:
+                cursor = self.conn.cursor()
+                cursor.row_factory = card_row_factory
+                cursor.execute("""
+                    SELECT ID, DeckID, Question, Answer, NextReviewDate, ReviewCount
+                    FROM flashcards
+                    WHERE DeckID = ? AND NextReviewDate <= ? AND LastReviewedAt IS NOT NULL
+                      AND (NextReviewDate, ID) > (?, ?)
+                    ORDER BY NextReviewDate, ID
+                    LIMIT ?
+                    """, (deck_id, now, *after, page_size))
+                cards = cursor.fetchall()
+            except sqlite3.Error as e:
+                db_logger.error(f"Failed to fetch due reviews from deck {deck_id}: {e}")
+                return
+            finally:
+                cursor.close()
+            yield from cards
+            if len(cards) < page_size:
+                return
+            after = (cards[-1].next_review_date, cards[-1].id)
+
+    def iter_new_cards(self, deck_id, page_size=100):
+        """
+        Stream the never reviewed cards of a deck in the order they were added.
+        """
+        after = 0
+        while True:
+            try:
+                cursor = self.conn.cursor()
+                cursor.row_factory = card_row_factory
+                cursor.execute("""
+                    SELECT ID, DeckID, Question, Answer, NextReviewDate, ReviewCount
+                    FROM flashcards
+                    WHERE DeckID = ? AND LastReviewedAt IS NULL AND ID > ?
+                    ORDER BY ID
+                    LIMIT ?
+                    """, (deck_id, after, page_size))
+                cards = cursor.fetchall()
+            except sqlite3.Error as e:
+                db_logger.error(f"Failed to fetch new cards from deck {deck_id}: {e}")
+                return
+            finally:
+                cursor.close()
+            yield from cards
+            if len(cards) < page_size:
+                return
+            after = cards[-1].id
+
+    def get_session_cards(self, deck_id, now=None):
+        """
+        Return every card of a deck due at `now` (default: now) with its
+        schedule columns, to preload a review session. Pending write-behind
+        reviews are flushed first.
+        """
+        self.flush_reviews()
+        now = to_epoch(now if now is not None else datetime.now())
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
+            cursor.execute("""
+                SELECT ID, DeckID, Question, Answer, NextReviewDate, LastReviewedAt,
+                       COALESCE(ReviewCount, 0) AS ReviewCount, COALESCE(EasinessFactor, 2.5) AS EasinessFactor,
+                       COALESCE(Interval, 1) AS Interval, Stability, Difficulty
+                FROM flashcards
+                WHERE DeckID = ? AND (NextReviewDate <= ? OR NextReviewDate IS NULL)
+                """, (deck_id, now))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch the due cards of deck {deck_id}: {e}")
+            return []
+        finally:
+            cursor.close()
+
+    def _get_cards_by_ids(self, deck_id, card_ids):
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
+            cursor.execute(f"""
+                SELECT ID, Question, Answer, NextReviewDate, ReviewCount
+                FROM flashcards
+                WHERE DeckID = ? AND ID IN ({",".join("?" * len(card_ids))})
+                """, (deck_id, *card_ids))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch cards by ID from deck {deck_id}: {e}")
+            return []
+        finally:
+            cursor.close()
+
+    def _query_due_cards(self, deck_id, now, limit):
+        now = to_epoch(now)
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
+            if now is None:
+                cursor.execute("""
+                    SELECT ID, Question, Answer, NextReviewDate, ReviewCount
+                    FROM flashcards
+                    WHERE DeckID = ?
+                    ORDER BY NextReviewDate
+                    LIMIT ?
+                    """, (deck_id, limit))
+            else:
+                cursor.execute("""
+                    SELECT ID, Question, Answer, NextReviewDate, ReviewCount
+                    FROM flashcards
+                    WHERE DeckID = ? AND NextReviewDate <= ?
+                    ORDER BY NextReviewDate
+                    LIMIT ?
+                    """, (deck_id, now, limit))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch due cards from deck {deck_id}: {e}")
+            return []
+        finally:
+            cursor.close()
+
+    def get_deck_stats(self, deck_id):
+        """
+        Return total, due-now, new and reviewed-today card counts of a deck from a
+        single aggregate query.
+        """
+        self.flush_reviews()
+        now = datetime.now()
+        today = to_epoch(now.replace(hour=0, minute=0, second=0, microsecond=0))
+        now = to_epoch(now)
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*) AS Total,
+                       COALESCE(SUM(NextReviewDate <= ?), 0) AS Due,
+                       COALESCE(SUM(LastReviewedAt IS NULL), 0) AS New,
+                       COALESCE(SUM(LastReviewedAt >= ?), 0) AS ReviewedToday
+                FROM flashcards WHERE DeckID = ?
+                """, (now, today, deck_id))
+            row = cursor.fetchone()
+            return {"total": row["Total"], "due": row["Due"], "new": row["New"], "reviewed_today": row["ReviewedToday"]}
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch stats for deck {deck_id}: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    def iter_revlog(self, card_id=None, since=None, until=None, page_size=1000):
+        """
+        Stream review log entries in (ReviewedAt, CardID) order, optionally for a
+        single card (served by the primary key) and/or a time window (served by
+        the ReviewedAt index). `since` and `until` accept datetimes or epoch
+        seconds. Pending write-behind reviews are flushed first.
+        """
+        self.flush_reviews()
+        conditions, params = [], []
+        if card_id is not None:
+            conditions.append("CardID = ?")
+            params.append(card_id)
+        if since is not None:
+            conditions.append("ReviewedAt >= ?")
+            params.append(to_epoch(since) * 1000)
+        if until is not None:
+            conditions.append("ReviewedAt < ?")
+            params.append(to_epoch(until) * 1000)
+        after = None
+        while True:
+            keyset = ["(ReviewedAt, CardID) > (?, ?)"] if after else []
+            where = " AND ".join(conditions + keyset) or "1"
+            try:
+                cursor = self.conn.cursor()
+                cursor.execute(f"""
+                    SELECT CardID, ReviewedAt, Grade, PrevInterval, NewInterval, Ease, LatencyMs
+                    FROM revlog WHERE {where}
+                    ORDER BY ReviewedAt, CardID
+                    LIMIT ?
+                    """, (*params, *(after or ()), page_size))
+                rows = cursor.fetchall()
+            except sqlite3.Error as e:
+                db_logger.error(f"Failed to read review log: {e}")
+                return
+            finally:
+                cursor.close()
+            for row in rows:
+                yield {"card_id": row["CardID"], "reviewed_at": row["ReviewedAt"], "grade": row["Grade"],
+                       "prev_interval": row["PrevInterval"], "new_interval": row["NewInterval"],
+                       "ease": row["Ease"], "latency_ms": row["LatencyMs"]}
+            if len(rows) < page_size:
+                return
+            after = (rows[-1]["ReviewedAt"], rows[-1]["CardID"])
+
+    def get_grade_counts(self, deck_id=None):
+        """
+        Return {grade: number of reviews} from the review log, for the cards of
+        a deck or all cards.
+        """
+        self.flush_reviews()
+        try:
+            cursor = self.conn.cursor()
+            if deck_id is None:
+                cursor.execute("SELECT Grade, COUNT(*) AS Reviews FROM revlog GROUP BY Grade")
+            else:
+                cursor.execute("""
+                    SELECT r.Grade, COUNT(*) AS Reviews
+                    FROM revlog r JOIN flashcards f ON f.ID = r.CardID
+                    WHERE f.DeckID = ?
+                    GROUP BY r.Grade
+                    """, (deck_id,))
+            return {row["Grade"]: row["Reviews"] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to count review grades: {e}")
+            return {}
+        finally:
+            cursor.close()
+
+    def get_review_history(self, deck_id):
+        """
+        Return the review log of a deck's cards as (card IDs, reviewed at in
+        epoch milliseconds, grades) columns, in (card, time) order, to fit a
+        scheduler to.
+        """
+        self.flush_reviews()
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = None
+            cursor.execute("""
+                SELECT r.CardID, r.ReviewedAt, r.Grade
+                FROM flashcards f JOIN revlog r ON r.CardID = f.ID
+                WHERE f.DeckID = ?
+                ORDER BY r.CardID, r.ReviewedAt
+                """, (deck_id,))
+            rows = cursor.fetchall()
+            return tuple(map(list, zip(*rows))) if rows else ([], [], [])
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch the review history of deck {deck_id}: {e}")
+            return [], [], []
+        finally:
+            cursor.close()
+
+    def get_daily_review_counts(self, since, until=None):
+        """
+        Return {date: number of reviews} per local day, for reviews from `since`
+        up to (not including) `until`, or up to now.
+        """
+        self.flush_reviews()
+        bounds = "ReviewedAt >= ?" + (" AND ReviewedAt < ?" if until is not None else "")
+        params = (to_epoch(since) * 1000,) + ((to_epoch(until) * 1000,) if until is not None else ())
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f"""
+                SELECT date(ReviewedAt / 1000, 'unixepoch', 'localtime') AS Day, COUNT(*) AS Reviews
+                FROM revlog WHERE {bounds}
+                GROUP BY Day ORDER BY Day
+                """, params)
+            return {row["Day"]: row["Reviews"] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to count daily reviews: {e}")
+            return {}
+        finally:
+            cursor.close()
+
     def get_latest_deck_id(self):
         try:
             cursor = self.conn.cursor()
@@ -266,16 +1067,124 @@ class DatabaseManager:
             cursor.close()
 
     def delete_card(self, card_id):
+        if self.delete_cards([card_id]):
+            db_logger.info(f"Card {card_id} deleted.")
+
+    def delete_cards(self, card_ids, chunk_size=DELETE_CHUNK_SIZE):
+        """
+        Delete cards with their tag links (by cascade) and search index rows (by
+        trigger), one transaction per `chunk_size` cards so reviews can commit in
+        between. Returns the number of cards deleted.
+        """
+        card_ids = list(card_ids)
+        deleted = 0
+        for start in range(0, len(card_ids), chunk_size):
+            chunk = card_ids[start:start + chunk_size]
+            if self._journal is not None:
+                for card_id in chunk:
+                    self._journal.discard(card_id)
+            count = self._delete_cards_chunk(
+                f"DELETE FROM flashcards WHERE ID IN ({','.join('?' * len(chunk))})", chunk)
+            if count is None:
+                break
+            deleted += count
+            self._card_ids_removed(chunk)
+        self._shuffles.clear()
+        # Reload the tag bitmaps rather than keep bits of IDs SQLite may reuse
+        self._tag_bitmaps = None
+        return deleted
+
+    def delete_deck(self, deck_id, chunk_size=DELETE_CHUNK_SIZE):
+        """
+        Delete a deck and all its cards. Cards go in chunks of `chunk_size` per
+        transaction before the deck row itself. The review log is history and
+        is kept. Returns the number of cards deleted, or None on failure.
+        """
+        deleted = 0
+        while True:
+            count = self._delete_cards_chunk("""
+                DELETE FROM flashcards WHERE ID IN (
+                    SELECT ID FROM flashcards WHERE DeckID = ? LIMIT ?)
+                """, (deck_id, chunk_size))
+            if count is None:
+                return None
+            deleted += count
+            if count < chunk_size:
+                break
+        if not self._delete_deck_row(deck_id):
+            return None
+        self._shuffles.pop(deck_id, None)
+        self._tag_bitmaps = None
+        with self._tag_lock:
+            self._deck_bitmaps_version += 1
+            self._deck_bitmaps.pop(deck_id, None)
+            self._deck_bitmaps.pop(None, None)
+        db_logger.info(f"Deck {deck_id} deleted with {deleted} cards.")
+        return deleted
+
+    @writes
+    def _delete_cards_chunk(self, sql, params):
         try:
             cursor = self.conn.cursor()
-            cursor.execute("DELETE FROM flashcards WHERE ID = ?", (card_id,))
+            cursor.execute(sql, params)
             self.conn.commit()
-            db_logger.info(f"Card {card_id} deleted.")
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            db_logger.error(f"Failed to delete cards: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    @writes
+    def _delete_deck_row(self, deck_id):
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("DELETE FROM imports WHERE DeckID = ?", (deck_id,))
+            cursor.execute("DELETE FROM decks WHERE ID = ?", (deck_id,))
+            self.conn.commit()
+            return True
         except sqlite3.Error as e:
-            db_logger.error(f"Failed to delete card: {e}")
+            self.conn.rollback()
+            db_logger.error(f"Failed to delete deck {deck_id}: {e}")
+            return False
         finally:
             cursor.close()
 
+    @writes
+    def optimize(self):
+        """
+        Refresh the query planner statistics where SQLite considers them stale.
+        Cheap enough to run after every large change and on close.
+        """
+        try:
+            self.conn.execute("PRAGMA optimize")
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to optimize database: {e}")
+
+    def vacuum(self):
+        """
+        Rebuild the database file to return the space freed by deletions to the
+        file system, then refresh the planner statistics. Blocks all writes
+        while it runs.
+        """
+        # Flushed before taking the writer thread, which the flush itself needs
+        self.flush_reviews()
+        return self._vacuum()
+
+    @writes
+    def _vacuum(self):
+        try:
+            size = os.path.getsize(self.db_file)
+            self.conn.execute("VACUUM")
+            self.conn.execute("ANALYZE")
+            db_logger.info(f"Vacuumed {self.db_file}: {size} -> {os.path.getsize(self.db_file)} bytes.")
+            return True
+        except (sqlite3.Error, OSError) as e:
+            db_logger.error(f"Failed to vacuum database: {e}")
+            return False
+
+    @writes
     def update_card_review_data(self, card_id, review_count, next_review_date):
         try:
             cursor = self.conn.cursor()
@@ -283,7 +1192,7 @@ class DatabaseManager:
                 UPDATE flashcards
                 SET ReviewCount = ?, NextReviewDate = ?
                 WHERE ID = ?
-                """, (review_count, next_review_date, card_id))
+                """, (review_count, to_epoch(next_review_date), card_id))
             self.conn.commit()
             db_logger.info(f"Card {card_id} review data updated.")
         except sqlite3.Error as e:
@@ -291,14 +1200,15 @@ class DatabaseManager:
         finally:
             cursor.close()
 
+    @writes
     def update_card(self, card_id, question, answer):
         try:
             cursor = self.conn.cursor()
             cursor.execute("""
                 UPDATE flashcards
-                SET Question = ?, Answer = ?
+                SET Question = ?, Answer = ?, QuestionPlain = ?, AnswerPlain = ?
                 WHERE ID = ?
-                """, (question, answer, card_id))
+                """, (question, answer, nikkud_fold(question), nikkud_fold(answer), card_id))
             self.conn.commit()
             db_logger.info(f"Card {card_id} updated.")
         except sqlite3.Error as e:
@@ -309,12 +1219,13 @@ class DatabaseManager:
     def get_card_data(self, card_id):
         try:
             cursor = self.conn.cursor()
+            cursor.row_factory = schedule_row_factory
             cursor.execute("""
-                SELECT ReviewCount AS repetition, EasinessFactor, Interval
+                SELECT DeckID, ReviewCount AS repetition, EasinessFactor, Interval, LastReviewedAt,
+                       Stability, Difficulty
                 FROM flashcards WHERE ID = ?
                 """, (card_id,))
-            row = cursor.fetchone()
-            return {"repetition": row["repetition"], "easiness_factor": row["EasinessFactor"], "interval": row["Interval"]}
+            return self._with_pending(card_id, cursor.fetchone())
         except sqlite3.Error as e:
             db_logger.error(f"Failed to fetch card data: {e}")
             return None
@@ -324,18 +1235,17 @@ class DatabaseManager:
     def get_full_card_data(self, card_id):
         try:
             cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
             cursor.execute("""
                 SELECT ReviewCount AS repetition, EasinessFactor, Interval, NextReviewDate, LastReviewedAt, CreatedAt, Question, Answer
                 FROM flashcards WHERE ID = ?
                 """, (card_id,))
-            row = cursor.fetchone()
-            return {"repetition": row["repetition"], "easiness_factor": row["EasinessFactor"], "interval": row["Interval"],
-                    "next_review_date": row["NextReviewDate"], "last_reviewed_at": row["LastReviewedAt"],
-                    "created_at": row["CreatedAt"], "question": row["Question"], "answer": row["Answer"]}
+            return self._with_pending(card_id, cursor.fetchone())
         except sqlite3.Error as e:
             db_logger.error(f"Failed to fetch full card data: {e}")
             return None
 
+    @writes
     def add_deck(self, name):
         try:
             cursor = self.conn.cursor()
@@ -348,36 +1258,189 @@ class DatabaseManager:
             db_logger.error(f"Failed to add deck: {e}")
             return None
 
+    @writes
     def add_flashcard(self, question, answer, deck_id):
-        flashcard_id = str(uuid.uuid4())
-        next_review_date = datetime.now()  # Set the next review date to the current date and time
+        now = to_epoch(datetime.now())  # The new card is due right away
         try:
             cursor = self.conn.cursor()
             cursor.execute("""
-                INSERT INTO flashcards (ID, DeckID, Question, Answer, LastReviewedAt, CreatedAt, EasinessFactor, Interval, NextReviewDate)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (flashcard_id, deck_id, question, answer, None, datetime.now(), 2.5, 1, next_review_date))
+                INSERT INTO flashcards (UUID, DeckID, Question, Answer, QuestionPlain, AnswerPlain, LastReviewedAt, CreatedAt,
+                                        EasinessFactor, Interval, NextReviewDate)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (str(uuid.uuid4()), deck_id, question, answer, nikkud_fold(question), nikkud_fold(answer),
+                      None, now, 2.5, 1, now))
+            flashcard_id = cursor.lastrowid
             self.conn.commit()
+            self._shuffles.pop(deck_id, None)
+            self._card_ids_added(deck_id, flashcard_id)
             db_logger.info(f"Flashcard {flashcard_id} added to deck {deck_id}.")
+            return flashcard_id
         except sqlite3.Error as e:
             db_logger.error(f"Failed to add flashcard: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    def add_flashcards_bulk(self, cards, deck_id, batch_size=1000, source=None, start=0, progress=None):
+        """
+        Insert (question, answer) pairs from any iterable, one transaction and one
+        executemany per batch. When `source` is given the number of committed rows
+        (offset by `start`) is checkpointed in the same transaction so an
+        interrupted import can be resumed with get_import_progress().
+        :return: Number of cards inserted by this call
+        """
+        inserted = 0
+        batch = []
+        for question, answer in cards:
+            batch.append((question, answer))
+            if len(batch) >= batch_size:
+                if not self._insert_flashcard_batch(batch, deck_id, source, start + inserted + len(batch)):
+                    return inserted
+                inserted += len(batch)
+                batch = []
+                if progress:
+                    progress(start + inserted)
+        if batch:
+            if not self._insert_flashcard_batch(batch, deck_id, source, start + inserted + len(batch)):
+                return inserted
+            inserted += len(batch)
+            if progress:
+                progress(start + inserted)
+        db_logger.info(f"{inserted} flashcards bulk added to deck {deck_id}.")
+        return inserted
+
+    @writes
+    def _insert_flashcard_batch(self, batch, deck_id, source, committed):
+        now = to_epoch(datetime.now())
+        rows = [(str(uuid.uuid4()), deck_id, question, answer, nikkud_fold(question), nikkud_fold(answer),
+                 None, now, 2.5, 1, now)
+                for question, answer in batch]
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany("""
+                INSERT INTO flashcards (UUID, DeckID, Question, Answer, QuestionPlain, AnswerPlain, LastReviewedAt, CreatedAt,
+                                        EasinessFactor, Interval, NextReviewDate)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+            if source is not None:
+                cursor.execute("""
+                    INSERT INTO imports (Source, DeckID, RowsCommitted, UpdatedAt)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (Source, DeckID) DO UPDATE
+                    SET RowsCommitted = excluded.RowsCommitted, UpdatedAt = excluded.UpdatedAt
+                    """, (source, deck_id, committed, now))
+            self.conn.commit()
+            self._shuffles.pop(deck_id, None)
+            # executemany does not report the new IDs; these are rebuilt on next use
+            with self._tag_lock:
+                self._deck_bitmaps_version += 1
+                self._deck_bitmaps.pop(deck_id, None)
+                self._deck_bitmaps.pop(None, None)
+            return True
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            db_logger.error(f"Failed to bulk add flashcards: {e}")
+            return False
+        finally:
+            cursor.close()
+
+    def get_import_progress(self, source, deck_id):
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT RowsCommitted FROM imports WHERE Source = ? AND DeckID = ?", (source, deck_id))
+            row = cursor.fetchone()
+            return row["RowsCommitted"] if row else 0
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to fetch import progress for {source}: {e}")
+            return 0
+        finally:
+            cursor.close()
+
+    @writes
+    def reset_import_progress(self, source, deck_id):
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("DELETE FROM imports WHERE Source = ? AND DeckID = ?", (source, deck_id))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to reset import progress for {source}: {e}")
         finally:
             cursor.close()
+
     def get_random_flashcard(self, deck_id):
+        """
+        Pick a random card with two index seeks instead of sorting the deck by
+        RANDOM(): a random rowid is drawn between the deck's lowest and highest
+        rowid and the first card at or after it is returned. Cards that follow
+        gaps in the rowid range are slightly more likely; use sample_cards for
+        uniform draws.
+        """
         try:
             cursor = self.conn.cursor()
             cursor.execute("""
-                SELECT Question, Answer FROM flashcards
-                WHERE DeckID = ? ORDER BY RANDOM() LIMIT 1
-                """, (deck_id,))
-            flashcard = cursor.fetchone()
-            return {"question": flashcard["Question"], "answer": flashcard["Answer"]} if flashcard else None
+                SELECT (SELECT rowid FROM flashcards WHERE DeckID = ? ORDER BY rowid LIMIT 1) AS Low,
+                       (SELECT rowid FROM flashcards WHERE DeckID = ? ORDER BY rowid DESC LIMIT 1) AS High
+                """, (deck_id, deck_id))
+            low, high = cursor.fetchone()
+            if low is None:
+                return None
+            cursor.row_factory = card_row_factory
+            cursor.execute("""
+                SELECT ID, Question, Answer, NextReviewDate, ReviewCount FROM flashcards
+                WHERE DeckID = ? AND rowid >= ? ORDER BY rowid LIMIT 1
+                """, (deck_id, random.randint(low, high)))
+            card = cursor.fetchone()
+            return self._with_pending(card.id, card)
         except sqlite3.Error as e:
             db_logger.error(f"Failed to fetch a random flashcard from deck {deck_id}: {e}")
             return None
         finally:
             cursor.close()
 
+    def sample_cards(self, deck_id, k, without_replacement=True):
+        """
+        Draw `k` random cards of a deck for shuffle-mode sessions. The deck's
+        rowids are shuffled once and reused across calls, so without replacement
+        every card is drawn once before any card repeats.
+        """
+        shuffle = self._deck_shuffle(deck_id)
+        if shuffle is None:
+            return []
+        rowids = shuffle.take(k) if without_replacement else shuffle.choices(k)
+        if not rowids:
+            return []
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = card_row_factory
+            unique = list(dict.fromkeys(rowids))
+            cursor.execute(f"""
+                SELECT rowid AS RowID, ID, Question, Answer, NextReviewDate, ReviewCount FROM flashcards
+                WHERE rowid IN ({",".join("?" * len(unique))})
+                """, unique)
+            by_rowid = {}
+            for card in cursor:
+                by_rowid[card.rowid] = self._with_pending(card.id, card)
+            return [by_rowid[rowid] for rowid in rowids if rowid in by_rowid]
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to sample cards from deck {deck_id}: {e}")
+            return []
+        finally:
+            cursor.close()
+
+    def _deck_shuffle(self, deck_id):
+        shuffle = self._shuffles.get(deck_id)
+        if shuffle is None:
+            try:
+                cursor = self.conn.cursor()
+                cursor.execute("SELECT rowid FROM flashcards WHERE DeckID = ?", (deck_id,))
+                shuffle = self._shuffles[deck_id] = DeckShuffle(row[0] for row in cursor)
+            except sqlite3.Error as e:
+                db_logger.error(f"Failed to load card order of deck {deck_id}: {e}")
+                return None
+            finally:
+                cursor.close()
+        return shuffle
+
     def get_decks(self):
         try:
             cursor = self.conn.cursor()
@@ -402,9 +1465,66 @@ class DatabaseManager:
         finally:
             cursor.close()
 
+    def get_deck_scheduler(self, deck_id):
+        """
+        Return the scheduler name of a deck and the parameters stored for it,
+        as {scheduler name: parameters}.
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT Scheduler, SchedulerParams FROM decks WHERE ID = ?", (deck_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None, None
+            return row["Scheduler"], json.loads(row["SchedulerParams"]) if row["SchedulerParams"] else None
+        except (sqlite3.Error, ValueError) as e:
+            db_logger.error(f"Failed to fetch the scheduler of deck {deck_id}: {e}")
+            return None, None
+        finally:
+            cursor.close()
+
+    @writes
+    def set_deck_scheduler(self, deck_id, name, params=None):
+        """
+        Set the scheduler of a deck; `params` replaces all stored parameters.
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("UPDATE decks SET Scheduler = ?, SchedulerParams = ? WHERE ID = ?",
+                           (name, json.dumps(params) if params is not None else None, deck_id))
+            self.conn.commit()
+            db_logger.info(f"Deck {deck_id} now uses the {name} scheduler.")
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            db_logger.error(f"Failed to set the scheduler of deck {deck_id}: {e}")
+            return False
+        finally:
+            cursor.close()
+
+    def backup(self, backup_dir=None, keep=DEFAULT_KEEP, compression="lzma", wait=False):
+        """
+        Take an online backup of the database (see backup.BackupManager) and
+        return the path of the compressed file, or None on failure. Unless
+        `wait` is set, compression runs in the background; close() waits for it.
+        """
+        self.flush_reviews()
+        backups = BackupManager(self.db_file, backup_dir, keep, compression)
+        self._backups.append(backups)
+        return backups.backup(wait)
+
     def close(self):
-        if self.conn:
-            self.conn.close()
+        for backups in self._backups:
+            backups.wait()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self.optimize()
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+            self._readers.close()
+        elif self._conn:
+            self._conn.close()
 
     def __enter__(self):
         return self
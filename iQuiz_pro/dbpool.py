@@ -0,0 +1,125 @@
+"""
+Connection helpers for running DatabaseManager in concurrent (WAL) mode.
+
+All mutating calls are funnelled through a single WriterThread that owns the
+only write connection, while every other thread reads through its own
+connection from a ReaderPool. With the WAL journal readers never block on the
+writer, so background work (prefetch, statistics, ...) can run next to reviews.
+"""
+import functools
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from loggers import db_logger
+
+# Pragmas applied to every connection in concurrent mode
+WAL_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+    "PRAGMA cache_size=-65536",    # 64 MiB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def tune_connection(conn, readonly=False):
+    for pragma in WAL_PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def writes(method):
+    """
+    Mark a DatabaseManager method as mutating. In concurrent mode the call is
+    executed on the writer thread and the caller waits for its result; calls
+    made from the writer thread itself (nested writes) run inline.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        writer = self._writer
+        if writer is None or writer.is_current():
+            return method(self, *args, **kwargs)
+        return writer.submit(method, self, *args, **kwargs).result()
+    return wrapper
+
+
+class WriterThread(threading.Thread):
+    """
+    Dedicated thread owning the single write connection. Work items are
+    executed in submission order.
+    """
+
+    def __init__(self, connect):
+        super().__init__(name="db-writer", daemon=True)
+        self._connect = connect
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self.conn = None
+
+    def start(self):
+        super().start()
+        self._ready.wait()
+
+    def is_current(self):
+        return threading.current_thread() is self
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def run(self):
+        self.conn = self._connect()
+        self._ready.set()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        self.conn.close()
+
+    def stop(self):
+        self._queue.put(None)
+        self.join()
+
+
+class ReaderPool:
+    """
+    Hands out one read-only connection per thread, created on first use.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    db_logger.error(f"Failed to close reader connection: {e}")
+            self._connections.clear()
+        self._local = threading.local()
@@ -1,19 +1,35 @@
 """
 This file contains the main application logic for the flashcard app.
 """
+import math
+import time
+
 from PyQt5.QtCore import Qt, QTimer, QPropertyAnimation, QEasingCurve, QSize
 from PyQt5.QtGui import QFont, QKeySequence, QColor
 from PyQt5.QtWidgets import (QMainWindow, QLabel, QLineEdit, QPushButton, QMessageBox, QVBoxLayout,
                              QWidget, QSizePolicy, QHBoxLayout, QInputDialog, QScrollArea, QTableWidget, QHeaderView,
                              QTableWidgetItem, QStyle, QGraphicsDropShadowEffect, QListWidget, QListWidgetItem, QComboBox)
-from flashcardmanager import FlashcardManager
+from asyncmanager import AsyncFlashcardManager
+from dates import format_epoch
+from tagquery import parse_tag_query
+
+# Rows added to the card table per event loop pass
+TABLE_CHUNK_SIZE = 50
+# Take a database backup when the window is closed
+BACKUP_ON_CLOSE = True
 
 
 class FlashcardApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("iQuiz Pro")
-        self.manager = FlashcardManager()
+        # Slow queries run on a worker thread; self.manager stays available for
+        # quick calls made directly from the GUI thread
+        self.async_manager = AsyncFlashcardManager(parent=self)
+        self.manager = self.async_manager.manager
+        self.view_id = 0  # Bumped whenever the layout is cleared
+        self.table_load = None
+        self.question_shown_at = time.monotonic()
         self.decks = self.manager.db.get_decks()
         self.main_widget = QWidget(self)
         self.setCentralWidget(self.main_widget)
@@ -34,24 +50,27 @@ class FlashcardApp(QMainWindow):
         self.animation.setEasingCurve(QEasingCurve.InOutQuad)
         self.animation.start()
 
+    def closeEvent(self, event):
+        # Flush pending reviews, back up and stop the database threads
+        self.async_manager.close(backup=BACKUP_ON_CLOSE)
+        super().closeEvent(event)
+
     def load_stylesheet(self):
         with open('style.css', 'r') as f:
             return f.read()
 
     def create_main_menu(self):
         self.clear_layout(self.main_layout)
-        self.deck_label = QLabel(
-            "Current Deck: No deck selected" if not self.manager.current_deck_id else "Current Deck: " + self.manager.get_deck_info()['name'])
+        self.deck_label = QLabel("Current Deck: Loading...")
         self.deck_label.setAlignment(Qt.AlignCenter)
         self.drop_shadow(self.deck_label)
         self.main_layout.addWidget(self.deck_label)
-        # Display the number of cards in the deck
-        num_cards = len(self.manager.db.get_cards_from_deck(
-            self.manager.current_deck_id))
-        num_cards_label = QLabel(f"Number of cards in deck: {num_cards}")
-        num_cards_label.setAlignment(Qt.AlignCenter)
-        self.drop_shadow(num_cards_label)
-        self.main_layout.addWidget(num_cards_label)
+        # Display the card counts of the deck, filled in by update_deck_label
+        self.num_cards_label = QLabel("Loading card counts...")
+        self.num_cards_label.setAlignment(Qt.AlignCenter)
+        self.drop_shadow(self.num_cards_label)
+        self.main_layout.addWidget(self.num_cards_label)
+        self.update_deck_label()
         # Create a horizontal layout for the buttons
         button_layout = QHBoxLayout()
 
@@ -76,9 +95,14 @@ class FlashcardApp(QMainWindow):
         button_layout.addWidget(add_flashcard_button)
 
         review_flashcards_button = self.create_button(
-            "Review", self.review_flashcards)
+            "Review", self.review_deck)
         review_flashcards_button.setShortcut(QKeySequence("5"))
         button_layout.addWidget(review_flashcards_button)
+
+        review_all_button = self.create_button(
+            "Review All", self.review_all_decks)
+        review_all_button.setShortcut(QKeySequence("6"))
+        button_layout.addWidget(review_all_button)
         button_layout.setSpacing(0)
 
         # Add the button layout to the main layout
@@ -88,13 +112,26 @@ class FlashcardApp(QMainWindow):
         self.clear_layout(self.main_layout)
 
         # Create a combo box for the tags
+        # Pick a tag or type a tag expression such as: verbs AND NOT mastered
         self.tag_combo = QComboBox()
+        self.tag_combo.setEditable(True)
+        self.tag_combo.setInsertPolicy(QComboBox.NoInsert)
         self.tag_combo.addItem("All")
         self.tag_combo.addItems(self.manager.get_tags())
-        self.tag_combo.currentTextChanged.connect(self.update_table)
 
         self.main_layout.addWidget(self.tag_combo)
 
+        # Create a search box, searching once typing pauses
+        self.search_entry = QLineEdit()
+        self.search_entry.setPlaceholderText("Search questions and answers")
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.update_table)
+        self.search_entry.textChanged.connect(self.search_timer.start)
+        self.tag_combo.currentTextChanged.connect(self.search_timer.start)
+        self.main_layout.addWidget(self.search_entry)
+
         # Create a table widget with columns for each attribute of a card
         self.table = QTableWidget()
         self.table.setColumnCount(4)
@@ -128,18 +165,98 @@ class FlashcardApp(QMainWindow):
         effect.setColor(QColor(0, 0, 0, 50))
         widget.setGraphicsEffect(effect)
 
+    def for_view(self, callback):
+        """
+        Wrap a callback of a background call so it is dropped if the user has
+        left the view (and its widgets were deleted) before the result arrived.
+        """
+        view_id = self.view_id
+
+        def wrapper(*args):
+            if view_id == self.view_id:
+                callback(*args)
+        return wrapper
+
+    def show_error(self, error):
+        QMessageBox.critical(self, "Error", f"Database error: {error}")
+
+    def load_table_cards(self, deck_id, tag, query):
+        # Runs on the worker thread. A tag picked from the list is matched by
+        # name, anything else typed into the box is a boolean tag expression
+        known_tag = tag in self.manager.get_tags()
+        if query:
+            cards = self.manager.db.search_cards(query, deck_id, limit=500)
+            if tag:
+                cards = self.manager.db.filter_cards_by_tags(
+                    cards, f'"{tag}"' if known_tag else tag)
+            return cards
+        if tag and not known_tag:
+            return list(self.manager.db.iter_cards_by_tags(tag, deck_id))
+        return list(self.manager.db.iter_cards(deck_id, tag))
+
     def update_table(self):
-        tag = self.tag_combo.currentText()
-        if tag == "All":
+        tag = self.tag_combo.currentText().strip()
+        if tag in ("All", ""):
             tag = None
-        cards = self.manager.db.get_cards_from_deck(
-            self.manager.current_deck_id, tag)
-        self.table.setRowCount(len(cards))
-        for i, card in enumerate(cards):
+        query = self.search_entry.text().strip()
+        # The box is searched while typing, so an expression such as "verbs AND"
+        # is usually just unfinished: say so in place rather than in a dialog
+        if tag and self.tag_combo.findText(tag) < 0:
+            try:
+                parse_tag_query(tag)
+            except ValueError as e:
+                self.show_tag_error(e)
+                return
+        self.tag_combo.setStyleSheet("")
+        self.tag_combo.setToolTip("")
+        # Show a placeholder row until the cards arrive
+        self.show_table_message("Loading cards...")
+        future = self.async_manager.submit(
+            self.load_table_cards, self.manager.current_deck_id, tag, query,
+            on_done=self.for_view(lambda cards: self.fill_table(future, cards)),
+            on_error=self.for_view(self.show_table_error))
+        self.table_load = future
+
+    def show_table_message(self, message):
+        self.table_load = None  # Drops the result of a load still running
+        self.table.clearSpans()
+        self.table.setRowCount(0)
+        self.table.insertRow(0)
+        self.table.setItem(0, 0, QTableWidgetItem(message))
+        self.table.setSpan(0, 0, 1, 4)
+
+    def show_tag_error(self, error):
+        self.tag_combo.setStyleSheet("QComboBox { border: 1px solid red; }")
+        self.tag_combo.setToolTip(str(error))
+        self.show_table_message(f"Incomplete tag expression: {error}")
+
+    def show_table_error(self, error):
+        # A tag added since the expression was checked can still fail to parse
+        if isinstance(error, ValueError):
+            self.show_tag_error(error)
+        else:
+            self.show_error(error)
+
+    def fill_table(self, load, cards, start=0):
+        """
+        Add the loaded cards to the table a chunk at a time, yielding to the
+        event loop in between so big decks do not freeze the window.
+        """
+        if load is not self.table_load:
+            # A newer search or tag filter replaced this load
+            return
+        if start == 0:
+            self.table.clearSpans()
+            self.table.setRowCount(0)
+        edit_icon = self.style().standardIcon(QStyle.SP_FileDialogDetailedView)
+        delete_icon = self.style().standardIcon(QStyle.SP_TrashIcon)
+        for i in range(start, min(start + TABLE_CHUNK_SIZE, len(cards))):
+            card = cards[i]
+            self.table.insertRow(i)
             self.table.setItem(i, 0, QTableWidgetItem(card['question']))
             self.table.setItem(i, 1, QTableWidgetItem(card['answer']))
             self.table.setItem(i, 2, QTableWidgetItem(
-                str(card['next_review_date'])))
+                format_epoch(card['next_review_date'])))
 
             # Set the row height
             self.table.setRowHeight(i, 50)  # Adjust the number as needed
@@ -147,18 +264,18 @@ class FlashcardApp(QMainWindow):
             # Add buttons for editing and deleting
             # Add buttons for editing and deleting
             edit_button = QPushButton()
-            edit_button.setIcon(self.style().standardIcon(
-                QStyle.SP_FileDialogDetailedView))  # Set the "Edit" icon
+            edit_button.setIcon(edit_icon)  # Set the "Edit" icon
             edit_button.setIconSize(QSize(50, 50))  # Set the icon size
             edit_button.setFixedSize(QSize(50, 50))  # Set the button size
-            edit_button.clicked.connect(lambda: self.edit_card(card['id']))
+            edit_button.clicked.connect(
+                lambda _=False, card_id=card['id']: self.edit_card(card_id))
 
             delete_button = QPushButton()
-            delete_button.setIcon(self.style().standardIcon(
-                QStyle.SP_TrashIcon))  # Set the "Delete" icon
+            delete_button.setIcon(delete_icon)  # Set the "Delete" icon
             delete_button.setIconSize(QSize(50, 50))  # Set the icon size
             delete_button.setFixedSize(QSize(50, 50))  # Set the button size
-            delete_button.clicked.connect(lambda: self.delete_card(card['id']))
+            delete_button.clicked.connect(
+                lambda _=False, card_id=card['id']: self.delete_card(card_id))
             # Create a layout to hold both buttons
             button_layout = QHBoxLayout()
             button_layout.addWidget(edit_button)
@@ -170,9 +287,14 @@ class FlashcardApp(QMainWindow):
             # Set the widget as the cell widget
             self.table.setCellWidget(i, 3, button_widget)
 
-            self.table.setColumnWidth(0, 200)  # Adjust the number as needed
-            self.table.setColumnWidth(1, 200)  # Adjust the number as needed
-            self.table.setColumnWidth(3, 10)  # Adjust the number as needed
+        # Column widths once per chunk; each call re-lays out every row
+        self.table.setColumnWidth(0, 200)  # Adjust the number as needed
+        self.table.setColumnWidth(1, 200)  # Adjust the number as needed
+        self.table.setColumnWidth(3, 10)  # Adjust the number as needed
+
+        if start + TABLE_CHUNK_SIZE < len(cards):
+            QTimer.singleShot(0, self.for_view(
+                lambda: self.fill_table(load, cards, start + TABLE_CHUNK_SIZE)))
 
     def edit_card(self, card_id):
         self.clear_layout(self.main_layout)
@@ -294,6 +416,8 @@ class FlashcardApp(QMainWindow):
         return button
 
     def clear_layout(self, layout):
+        if layout is self.main_layout:
+            self.view_id += 1
         while layout.count():
             child = layout.takeAt(0)
             if child.widget():
@@ -437,11 +561,40 @@ class FlashcardApp(QMainWindow):
             QMessageBox.critical(
                 self, "Error", "Question and answer cannot be empty.")
 
+    def review_all_decks(self):
+        # Runs before the first get_next_flashcard, the worker keeps call order
+        self.async_manager.call("start_mixed_review", on_error=self.show_error)
+        self.review_flashcards()
+
+    def review_deck(self):
+        # The due cards are loaded once; the session then serves them from memory
+        self.async_manager.call("start_review_session", on_error=self.show_error)
+        self.review_flashcards()
+
+    def end_review(self):
+        self.async_manager.call("stop_mixed_review")
+        self.async_manager.call("stop_review_session")
+        self.create_main_menu()
+
+    def skip_flashcard(self, card_id):
+        self.async_manager.call("skip_flashcard", card_id, on_error=self.show_error)
+        self.review_flashcards()
+
     def review_flashcards(self):
         self.clear_layout(self.main_layout)
-        card = self.manager.get_next_flashcard()
+        label = QLabel("Loading next card...")
+        label.setAlignment(Qt.AlignCenter)
+        self.main_layout.addWidget(label)
+        self.async_manager.call("get_next_flashcard",
+                                on_done=self.for_view(self.show_question),
+                                on_error=self.for_view(self.show_error))
+
+    def show_question(self, card):
+        self.clear_layout(self.main_layout)
 
         if card:
+            # Answer latency is measured from here and stored in the review log
+            self.question_shown_at = time.monotonic()
             label = QLabel(card['question'])
             label.setFont(QFont('Helvetica', 18, QFont.Bold))
             label.setAlignment(Qt.AlignCenter)
@@ -454,19 +607,40 @@ class FlashcardApp(QMainWindow):
             show_answer_button.setShortcut(Qt.Key_Space)
             self.main_layout.addWidget(show_answer_button)
             skip_button = QPushButton("Skip")
-            skip_button.clicked.connect(self.review_flashcards)
+            skip_button.clicked.connect(lambda: self.skip_flashcard(card['id']))
             self.main_layout.addWidget(skip_button)
             # bind to enter key as well
             skip_button.setShortcut(Qt.Key_Return)
 
             return_button = QPushButton("Return to Main Menu")
-            return_button.clicked.connect(self.create_main_menu)
+            return_button.clicked.connect(self.end_review)
             self.main_layout.addWidget(return_button)
 
         else:
+            # Failed cards may still come back once their learning step has passed
+            self.async_manager.call("next_review_due",
+                                    on_done=self.for_view(self.wait_for_next_card),
+                                    on_error=self.for_view(self.show_error))
+
+    def wait_for_next_card(self, due):
+        if due is None:
             QMessageBox.information(
-                self, "Info", "No flashcards available in the current deck. Please add some first.")
-            self.create_main_menu()
+                self, "Info", "No flashcards are due in the current deck.")
+            self.end_review()
+            return
+
+        wait = max(0, math.ceil(due - time.time()))
+        minutes, seconds = divmod(wait, 60)
+        label = QLabel(f"Learning cards come back in {minutes}:{seconds:02d}.")
+        label.setAlignment(Qt.AlignCenter)
+        self.main_layout.addWidget(label)
+
+        return_button = QPushButton("Return to Main Menu")
+        return_button.clicked.connect(self.end_review)
+        self.main_layout.addWidget(return_button)
+
+        # Dropped if the user leaves the review before the card is due
+        QTimer.singleShot(wait * 1000, self.for_view(self.review_flashcards))
 
     def show_answer(self, card):
         self.clear_layout(self.main_layout)
@@ -513,7 +687,10 @@ class FlashcardApp(QMainWindow):
             QSizePolicy.Minimum, QSizePolicy.Fixed))
 
     def update_card_schedule(self, card_id, difficulty):
-        self.manager.update_card_schedule(card_id, difficulty)
+        latency_ms = int((time.monotonic() - self.question_shown_at) * 1000)
+        # The worker runs calls in order, so the next card is picked after this update
+        self.async_manager.call("update_card_schedule", card_id, difficulty, latency_ms,
+                                on_error=self.show_error)
         self.review_flashcards()
 
     def update_decks(self):
@@ -546,8 +723,22 @@ class FlashcardApp(QMainWindow):
                     self, "Success", f"Deck '{selected_deck_name}' selected.")
 
     def update_deck_label(self):
-        deck_info = self.manager.get_deck_info()
+        self.deck_label.setText("Current Deck: Loading...")
+        self.async_manager.submit(self.load_deck_summary,
+                                  on_done=self.for_view(self.show_deck_summary),
+                                  on_error=self.for_view(self.show_error))
+
+    def load_deck_summary(self):
+        # Runs on the worker thread
+        return self.manager.get_deck_info(), self.manager.get_deck_stats()
+
+    def show_deck_summary(self, summary):
+        deck_info, stats = summary
         if deck_info:
             self.deck_label.setText(f"Current Deck: {deck_info['name']}")
         else:
             self.deck_label.setText("Current Deck: No deck selected")
+        stats = stats or {"total": 0, "due": 0, "new": 0, "reviewed_today": 0}
+        self.num_cards_label.setText(
+            f"Number of cards in deck: {stats['total']} | Due: {stats['due']} | "
+            f"New: {stats['new']} | Reviewed today: {stats['reviewed_today']}")
@@ -1,11 +1,24 @@
-from db import DatabaseManager
+from db import DatabaseManager, DB_FILE
+from mixedqueue import MixedReviewQueue, DUE_FIRST
+from reviewsession import ReviewSession, DEFAULT_LEARNING_STEPS
+from schedulers import make_scheduler
 from datetime import datetime, timedelta
 from tkinter import messagebox
+import time
+
+# Seconds before cached deck stats are recomputed even without writes,
+# so cards that became due in the meantime show up
+DECK_STATS_TTL = 60
 
 class FlashcardManager:
-    def __init__(self):
-        self.db = DatabaseManager()
+    def __init__(self, concurrent=False, write_behind=False, db_file=DB_FILE):
+        self.db = DatabaseManager(db_file, concurrent=concurrent, write_behind=write_behind)
         self.current_deck_id = self.db.get_latest_deck_id()
+        self._deck_stats = {}  # deck ID -> (computed at, stats)
+        self.mixed_queue = None  # Set while reviewing several decks at once
+        self.review_session = None  # Set while reviewing the current deck
+        self._batch = None
+        self._schedulers = {}  # deck ID -> Scheduler
 
     def create_deck(self, name):
         deck_id = self.db.add_deck(name)
@@ -13,12 +26,20 @@ class FlashcardManager:
         return deck_id
     def set_tag(self, card_id, tags):
         if self.current_deck_id is not None:
-            for tag in tags:
-                self.db.set_tag(card_id, tag)
+            self.db.set_tags(card_id, tags)
 
     def get_tags(self, card_id=None):
         return self.db.get_tags(card_id)
 
+    def get_cards_by_tags(self, expression):
+        """
+        Cards of the current deck matching a boolean tag expression, e.g.
+        "verbs AND NOT mastered"
+        """
+        if self.current_deck_id is None:
+            return []
+        return list(self.db.iter_cards_by_tags(expression, self.current_deck_id))
+
     def remove_tag(self, card_id, tag):
         self.db.remove_tag(card_id, tag)
 
@@ -31,6 +52,7 @@ class FlashcardManager:
     def add_flashcard(self, question, answer):
         if self.current_deck_id is not None:
             self.db.add_flashcard(question, answer, self.current_deck_id)
+            self.invalidate_deck_stats(self.current_deck_id)
         else:
             messagebox.showerror("Error", "No deck selected. Please create or select a deck first.")
 
@@ -40,24 +62,91 @@ class FlashcardManager:
         else:
             return None
 
+    def sample_flashcards(self, k, without_replacement=True):
+        if self.current_deck_id is not None:
+            return self.db.sample_cards(self.current_deck_id, k, without_replacement)
+        return []
+
+    def start_mixed_review(self, deck_ids=None, mode=DUE_FIRST, reviews_per_deck=None, new_per_deck=None):
+        """
+        Review several decks (all of them by default) as one merged queue until
+        stop_mixed_review is called
+        """
+        if deck_ids is None:
+            deck_ids = [deck['id'] for deck in self.db.get_decks()]
+        self.mixed_queue = MixedReviewQueue(self.db, deck_ids, mode, reviews_per_deck, new_per_deck)
+
+    def stop_mixed_review(self):
+        self.mixed_queue = None
+
+    def start_review_session(self, learning_steps=DEFAULT_LEARNING_STEPS):
+        """
+        Load the due cards of the current deck once; until stop_review_session
+        is called, cards are picked and answered in memory
+        """
+        if self.current_deck_id is None:
+            self.review_session = None
+            return 0
+        self.review_session = ReviewSession(self.db, self.current_deck_id, self.scheduler_for(), learning_steps)
+        return len(self.review_session)
+
+    def stop_review_session(self):
+        self.review_session = None
+
+    def next_review_due(self):
+        """
+        Epoch time at which the next card of the review session is due, when
+        only learning cards waiting for their step are left; None once the
+        session is finished
+        """
+        if self.mixed_queue is None and self.review_session is not None:
+            return self.review_session.next_due()
+        return None
+
+    def skip_flashcard(self, card_id):
+        if self.review_session is not None:
+            self.review_session.skip(card_id)
+
     def get_next_flashcard(self):
         """
         Get the next flashcard to review from the current deck based on the spaced repetition algorithm
         """
+        if self.mixed_queue is not None:
+            return self.mixed_queue.next_card()
+        if self.review_session is not None:
+            return self.review_session.next_card()
         if self.current_deck_id is None:
             return None
 
-        # Fetch all cards from the current deck
-        cards = self.db.get_cards_from_deck(self.current_deck_id)  # Assuming this method returns a list of cards
+        # Only the earliest scheduled card is needed, let the index do the ordering
+        cards = self.db.get_due_cards(self.current_deck_id, limit=1)
 
         if not cards:
             return None
 
-        # Sort the cards based on the next review date and pick the first one
-        cards.sort(key=lambda card: card['next_review_date'])
-        next_card = cards[0]
+        return cards[0]
 
-        return next_card
+    def get_deck_stats(self, deck_id=None):
+        """
+        Get the card counts of a deck (the current one by default), cached until
+        cards of the deck are added, deleted or reviewed
+        """
+        deck_id = self.current_deck_id if deck_id is None else deck_id
+        if deck_id is None:
+            return None
+        cached = self._deck_stats.get(deck_id)
+        if cached and time.monotonic() - cached[0] < DECK_STATS_TTL:
+            return cached[1]
+        stats = self.db.get_deck_stats(deck_id)
+        if stats is not None:
+            self._deck_stats[deck_id] = (time.monotonic(), stats)
+        return stats
+
+    def invalidate_deck_stats(self, deck_id=None):
+        if deck_id is None:
+            self._deck_stats.clear()
+        else:
+            self._deck_stats.pop(deck_id, None)
 
     def set_current_deck(self, deck_id):
         self.current_deck_id = deck_id
@@ -73,60 +162,183 @@ class FlashcardManager:
             return None
         return self.db.get_full_card_data(card_id)
 
-    def super_memo(self, card_id, q):
+    def scheduler_for(self, deck_id=None):
+        """
+        The Scheduler of a deck (the current one by default), as set with set_scheduler
         """
-        SuperMemo 2 algorithm for spaced repetition learning
+        deck_id = self.current_deck_id if deck_id is None else deck_id
+        scheduler = self._schedulers.get(deck_id)
+        if scheduler is None:
+            name, params = self.db.get_deck_scheduler(deck_id) if deck_id is not None else (None, None)
+            scheduler = make_scheduler(name, (params or {}).get(name))
+            self._schedulers[deck_id] = scheduler
+        return scheduler
+
+    def set_scheduler(self, name, deck_id=None, params=None):
+        """
+        Schedule the reviews of a deck with the scheduler registered as `name`
+        ("sm2" or "fsrs"). Parameters fitted earlier are kept unless `params`
+        replaces them.
+        """
+        deck_id = self.current_deck_id if deck_id is None else deck_id
+        make_scheduler(name, params)  # Rejects unknown names and bad parameters
+        _, stored = self.db.get_deck_scheduler(deck_id)
+        stored = stored or {}
+        if params is not None:
+            stored[name] = params
+        self._schedulers.pop(deck_id, None)
+        return self.db.set_deck_scheduler(deck_id, name, stored)
+
+    def fit_fsrs(self, deck_ids=None, processes=None):
+        """
+        Fit the FSRS weights of decks (the current one by default) to their
+        review logs and store them with the decks, several decks in a process
+        pool. The scheduler of the decks is left as it is. Returns
+        {deck ID: log loss of the fitted weights}.
+        """
+        from fsrsfit import ReviewHistory, fit, fit_decks
+        deck_ids = [self.current_deck_id] if deck_ids is None else list(deck_ids)
+        columns = [self.db.get_review_history(deck_id) for deck_id in deck_ids]
+        if len(deck_ids) == 1:
+            results = [fit(ReviewHistory(*columns[0]))]
+        else:
+            results = fit_decks(columns, processes)
+        losses = {}
+        for deck_id, (weights, loss) in zip(deck_ids, results):
+            name, stored = self.db.get_deck_scheduler(deck_id)
+            stored = stored or {}
+            stored["fsrs"] = dict(stored.get("fsrs") or {}, weights=list(weights))
+            self.db.set_deck_scheduler(deck_id, name, stored)
+            self._schedulers.pop(deck_id, None)
+            losses[deck_id] = loss
+        return losses
+
+    def super_memo(self, card_id, q, latency_ms=None):
+        """
+        Schedule a card after a review with the scheduler of its deck (SuperMemo 2
+        unless set otherwise)
         :param card_id: ID of the flashcard
         :param q: User grade
+        :param latency_ms: Time the user took to answer, stored in the review log
         """
+        if self.review_session is not None and card_id in self.review_session:
+            # Cards of the session are scheduled in memory, without reading them back
+            result = self.review_session.answer(card_id, q, latency_ms)
+            self.invalidate_deck_stats(self.review_session.deck_id)
+            return result
+
         # Fetch card data from the database
         card_data = self.db.get_card_data(card_id)  # Assuming this method returns a dict with card data
 
-        n = card_data['repetition']
-        EF = card_data['easiness_factor']
-        I = card_data['interval']
-
-        if q >= 3:  # Correct response
-            if n == 0:
-                I = 1
-            elif n == 1:
-                I = 6
-            else:
-                I = round(I * EF)
-            n += 1
-        else:  # Incorrect response
-            n = 0
-            I = 1
-
-        EF = EF + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
-        if EF < 1.3:
-            EF = 1.3
+        prev_interval = card_data['interval']
+        now = datetime.now()
+        n, EF, I, stability, difficulty = self.scheduler_for(card_data['deck_id']).review(card_data, q, now.timestamp())
 
         # Calculate the next review date
-        next_review_date = datetime.now() + timedelta(days=I)
+        next_review_date = now + timedelta(days=I)
 
         # Update the card data in the database
-        self.db.update_card_data(card_id, n, EF, I, next_review_date)  # Assuming this method updates the card data in the database
+        self.db.update_card_data(card_id, n, EF, I, next_review_date,
+                                 grade=q, prev_interval=prev_interval, latency_ms=latency_ms,
+                                 stability=stability, difficulty=difficulty)
+        # A mixed review may have answered a card of any deck
+        self.invalidate_deck_stats(None if self.mixed_queue is not None else self.current_deck_id)
 
         return n, EF, I, next_review_date
 
-    def update_card_schedule(self, card_id, difficulty):
+    @property
+    def batch(self):
+        """
+        BatchScheduler for whole-deck changes, created on first use so NumPy is
+        only imported when needed
+        """
+        if self._batch is None:
+            from batchscheduler import BatchScheduler
+            self._batch = BatchScheduler(self.db)
+        return self._batch
+
+    def reschedule_deck(self, grades, deck_id=None):
+        """
+        Apply SM-2 reviews to many cards of an SM-2 deck at once, see
+        BatchScheduler.review
+        """
+        deck_id = self.current_deck_id if deck_id is None else deck_id
+        count = self.batch.review(deck_id, grades)
+        self.invalidate_deck_stats(deck_id)
+        return count
+
+    def shift_deck(self, days, due_before=None, deck_id=None):
+        """
+        Postpone (or advance, with negative days) the reviews of a deck
+        """
+        deck_id = self.current_deck_id if deck_id is None else deck_id
+        count = self.batch.shift(deck_id, days, due_before)
+        self.invalidate_deck_stats(deck_id)
+        return count
+
+    def forecast_workload(self, days=90, runs=50, new_per_day=0, deck_id=None):
+        """
+        Monte Carlo forecast of the reviews due per day, using the grade mix
+        measured in the review log. Returns a forecast.ForecastResult.
+        Raises ValueError for decks not scheduled by SM-2, which is the only
+        rule the simulation implements.
+        """
+        from forecast import deck_state, grade_probabilities, simulate
+        deck_id = self.current_deck_id if deck_id is None else deck_id
+        self.batch.require_sm2(deck_id)
+        state = deck_state(self.batch.load(deck_id))
+        grades = grade_probabilities(self.db.get_grade_counts(deck_id))
+        return simulate(*state, days=days, runs=runs, grades=grades, new_per_day=new_per_day)
+
+    def update_card_schedule(self, card_id, difficulty, latency_ms=None):
         """
         Update the card schedule based on the user's response
         :param card_id: ID of the flashcard
         :param difficulty: User's response difficulty level
+        :param latency_ms: Time the user took to answer
         """
-        difficulty_map = {
-            'easy': 5,
-            'hard': 3,
-            'very hard': 2,
-            'again': 0
-        }
-        q = difficulty_map.get(difficulty, 0)
-        self.super_memo(card_id, q)
+        if self.review_session is not None and card_id in self.review_session:
+            deck_id = self.review_session.deck_id
+        else:
+            # A mixed review shows cards of any deck; the buttons mean what the
+            # scheduler of the card's own deck makes of them, as in super_memo
+            card_data = self.db.get_card_data(card_id)
+            deck_id = card_data['deck_id'] if card_data is not None else None
+        q = self.scheduler_for(deck_id).grades.get(difficulty, 0)
+        self.super_memo(card_id, q, latency_ms)
 
     def delete_card(self, card_id):
         self.db.delete_card(card_id)
+        if self.review_session is not None:
+            self.review_session.discard(card_id)
+        self.invalidate_deck_stats(self.current_deck_id)
+
+    def delete_cards(self, card_ids):
+        deleted = self.db.delete_cards(card_ids)
+        self.invalidate_deck_stats()
+        return deleted
+
+    def delete_deck(self, deck_id):
+        """
+        Delete a deck with all its cards, switching to the latest remaining deck
+        if it was the current one
+        """
+        deleted = self.db.delete_deck(deck_id)
+        self.invalidate_deck_stats(deck_id)
+        self._schedulers.pop(deck_id, None)
+        if deleted is not None:
+            # Many rows may have gone; let SQLite refresh its statistics
+            self.db.optimize()
+            if deck_id == self.current_deck_id:
+                self.set_current_deck(self.db.get_latest_deck_id())
+        return deleted
 
     def update_card(self, card_id, question, answer):
         self.db.update_card(card_id, question, answer)
+        if self.review_session is not None:
+            self.review_session.edit(card_id, question, answer)
+
+    def close(self, backup=False):
+        if backup:
+            self.db.backup()
+        self.db.close()
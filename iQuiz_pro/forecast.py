@@ -0,0 +1,170 @@
+"""
+Monte Carlo forecast of the daily review workload of a deck.
+
+Every card is simulated forward under the SM-2 rule of
+FlashcardManager.super_memo, drawing its grade at each review from per-grade
+probabilities (assumed, or measured from the review log). Only decks
+scheduled by SM-2 can be forecast: FSRS decks follow another rule and log
+other grades for the same buttons. Cards and runs live in flat NumPy arrays;
+instead of scanning all of them every day, cards are kept in per-day buckets
+and each day only touches the cards due on it, so the cost grows with the
+number of reviews rather than cards x days.
+Several scenarios (e.g. different numbers of new cards per day) can be run
+in a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from batchscheduler import DAY, sm2
+from schedulers import SM2Scheduler
+
+# Share of reviews per button when the review log has too few reviews, as
+# grade probabilities through the SM-2 button grades
+ASSUMED_BUTTONS = {'easy': 0.60, 'hard': 0.25, 'very hard': 0.05, 'again': 0.10}
+ASSUMED_GRADES = {SM2Scheduler.grades[button]: share for button, share in ASSUMED_BUTTONS.items()}
+MIN_MEASURED_REVIEWS = 100
+NEW_EASINESS = 2.5
+
+
+def grade_probabilities(grade_counts, minimum=MIN_MEASURED_REVIEWS):
+    """
+    Turn {grade: count} from the review log into probabilities, falling back
+    to ASSUMED_GRADES when there are fewer than `minimum` reviews.
+    """
+    total = sum(grade_counts.values())
+    if total < minimum:
+        return dict(ASSUMED_GRADES)
+    return {grade: count / total for grade, count in grade_counts.items()}
+
+
+class ForecastResult:
+    """
+    Due counts of every simulated run and day (`counts[run, day]`), with
+    summary statistics per day.
+    """
+
+    def __init__(self, start, counts):
+        self.start = start
+        self.counts = counts
+
+    @property
+    def days(self):
+        return [self.start + timedelta(days=day) for day in range(self.counts.shape[1])]
+
+    def mean(self):
+        return self.counts.mean(axis=0)
+
+    def percentile(self, q):
+        return np.percentile(self.counts, q, axis=0)
+
+    def bands(self, confidence=90):
+        """
+        Return {"mean", "median", "low", "high"} per-day arrays, with low/high
+        bounding the central `confidence` percent of the runs.
+        """
+        tail = (100 - confidence) / 2
+        low, median, high = self.percentile([tail, 50, 100 - tail])
+        return {"mean": self.mean(), "median": median, "low": low, "high": high}
+
+    def rows(self, confidence=90):
+        """
+        (date, mean, low, high) per day, for printing.
+        """
+        bands = self.bands(confidence)
+        return list(zip(self.days, bands["mean"].tolist(), bands["low"].tolist(), bands["high"].tolist()))
+
+
+def simulate(repetition, easiness, interval, due_day, days=90, runs=50, grades=None,
+             new_per_day=0, seed=None):
+    """
+    Simulate `runs` futures of a deck over `days` days.
+
+    :param repetition, easiness, interval: Current SM-2 state per card
+    :param due_day: Day index (0 = today) each card is next due; overdue cards are 0
+    :param grades: {grade: probability}, ASSUMED_GRADES by default
+    :param new_per_day: New cards added (and first reviewed) every day
+    :return: ForecastResult
+    """
+    grades = grades or ASSUMED_GRADES
+    grade_values = np.array(list(grades), dtype=np.int64)
+    cumulative = np.cumsum(np.array(list(grades.values()), dtype=np.float64))
+    cumulative /= cumulative[-1]
+    rng = np.random.default_rng(seed)
+
+    cards = len(repetition)
+    slots = cards + new_per_day * days  # cards per run, including the ones added later
+    size = runs * slots
+    rep = np.zeros(size, dtype=np.int64)
+    ease = np.full(size, NEW_EASINESS)
+    ivl = np.ones(size, dtype=np.int64)
+    for run in range(runs):
+        offset = run * slots
+        rep[offset:offset + cards] = repetition
+        ease[offset:offset + cards] = easiness
+        ivl[offset:offset + cards] = interval
+
+    # buckets[day] holds arrays of the flat indices due that day
+    buckets = [[] for _ in range(days)]
+    due_day = np.maximum(np.asarray(due_day, dtype=np.int64), 0)
+    existing = (np.arange(runs)[:, None] * slots + np.arange(cards)).ravel()
+    _distribute(buckets, existing, np.tile(due_day, runs))
+    for day in range(days):
+        if new_per_day:
+            first = cards + day * new_per_day
+            buckets[day].append((np.arange(runs)[:, None] * slots + np.arange(first, first + new_per_day)).ravel())
+
+    counts = np.zeros((runs, days), dtype=np.int64)
+    for day in range(days):
+        if not buckets[day]:
+            continue
+        due = np.concatenate(buckets[day])
+        buckets[day] = None
+        counts[:, day] = np.bincount(due // slots, minlength=runs)
+        drawn = grade_values[np.searchsorted(cumulative, rng.random(len(due)), side="right").clip(max=len(cumulative) - 1)]
+        new_rep, new_ease, new_ivl = sm2(rep[due], ease[due], ivl[due], drawn)
+        rep[due], ease[due], ivl[due] = new_rep, new_ease, new_ivl
+        _distribute(buckets, due, day + new_ivl)
+    return ForecastResult(date.today(), counts)
+
+
+def _distribute(buckets, indices, due_day):
+    # Group the indices by due day with one sort instead of a mask per day
+    keep = due_day < len(buckets)  # horizons stay well below 2**15 days
+    indices, due_day = indices[keep], due_day[keep]
+    if not len(indices):
+        return
+    # A stable sort of 16-bit keys is a radix sort, linear in the number of cards
+    order = np.argsort(due_day.astype(np.int16), kind="stable")
+    indices, due_day = indices[order], due_day[order]
+    days, starts = np.unique(due_day, return_index=True)
+    for day, chunk in zip(days.tolist(), np.split(indices, starts[1:])):
+        buckets[day].append(chunk)
+
+
+def deck_state(schedules, now=None):
+    """
+    Convert batchscheduler.DeckSchedules to the (repetition, easiness,
+    interval, due day) arrays taken by simulate. Cards without a next review
+    date count as due today.
+    """
+    now = now or datetime.now()
+    today = datetime(now.year, now.month, now.day).timestamp()
+    next_review = np.nan_to_num(schedules.next_review, nan=today)
+    due_day = np.floor((next_review - today) / DAY).astype(np.int64)
+    return schedules.repetition, schedules.easiness, schedules.interval, due_day
+
+
+def _run_scenario(args):
+    state, options = args
+    return simulate(*state, **options)
+
+
+def simulate_scenarios(state, scenarios, processes=None):
+    """
+    Run one simulation per dict of simulate() options in `scenarios`, in a
+    process pool. Returns the ForecastResults in the same order.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_run_scenario, [(state, options) for options in scenarios]))
@@ -0,0 +1,317 @@
+"""
+Fit the FSRS weights of schedulers.FSRSScheduler to a deck's review log.
+
+The review history is turned into one sequence of (elapsed days, rating) per
+card, keeping the first review of each day only, as same-day learning steps
+say little about long-term memory. Every review after the first is a
+prediction: the model's recall probability at that time against whether the
+card was actually recalled. The weights minimize the mean log loss of these
+predictions with Adam.
+
+Everything is vectorized over cards. Cards are ranked by sequence length and
+the reviews stored step-major, so the cards still active at step k are the
+first n_k ranks and every step works on contiguous slices. Gradients come
+from a hand-written backward pass over the same steps, so an iteration costs
+about three forward passes whatever the number of weights. Long histories
+are fitted on a random sample of whole cards, which is as good as all of
+them for 17 weights. Decks can be fitted in parallel with fit_decks.
+
+Run `python fsrsfit.py --deck ID ...` to fit decks from the command line, and
+add --use to also switch them to the FSRS scheduler.
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from schedulers import DECAY, DEFAULT_WEIGHTS, FACTOR, MAX_INTERVAL
+
+DAY_MS = 86400 * 1000
+MIN_PREDICTIONS = 1000  # fewer reviews than this keep the default weights
+SAMPLE_REVIEWS = 200000  # longer histories are fitted on a sample of their cards
+EPSILON = 1e-6
+
+# Bounds the weights are clipped to after every step, as in FSRS-4.5
+LOWER = np.array([0.1, 0.1, 0.1, 0.1, 1, 0.1, 0.1, 0, 0, 0.1, 0.01, 0.5, 0.01, 0.01, 0.01, 0, 1])
+UPPER = np.array([100, 100, 100, 100, 10, 5, 5, 0.5, 3, 0.8, 2.5, 5, 0.2, 0.9, 2, 1, 4])
+
+
+class ReviewHistory:
+    """
+    Review sequences of many cards, stored step-major: reviews at step k are
+    ratings[starts[k]:starts[k] + counts[k]], one per card still active.
+    """
+
+    def __init__(self, card_ids, reviewed_at, grades):
+        """
+        :param card_ids, reviewed_at, grades: Review log columns (epoch
+            milliseconds, SM-2 grades), in any order
+        """
+        card_ids = np.asarray(card_ids, dtype=np.int64)
+        day = np.asarray(reviewed_at, dtype=np.int64) // DAY_MS
+        grades = np.asarray(grades, dtype=np.int64)
+        order = np.lexsort((reviewed_at, card_ids))
+        card_ids, day, grades = card_ids[order], day[order], grades[order]
+
+        first_today = np.ones(len(card_ids), dtype=bool)
+        first_today[1:] = (card_ids[1:] != card_ids[:-1]) | (day[1:] != day[:-1])
+        card_ids, day, grades = card_ids[first_today], day[first_today], grades[first_today]
+
+        new_card = np.ones(len(card_ids), dtype=bool)
+        new_card[1:] = card_ids[1:] != card_ids[:-1]
+        card = np.cumsum(new_card) - 1
+        first = np.flatnonzero(new_card)
+        step = np.arange(len(card_ids)) - first[card]
+        elapsed = np.zeros(len(card_ids), dtype=np.float64)
+        elapsed[1:] = day[1:] - day[:-1]
+        lengths = np.bincount(card, minlength=len(first))
+
+        # Cards reviewed on a single day predict nothing
+        keep = lengths[card] >= 2
+        card, step, elapsed, grades = card[keep], step[keep], elapsed[keep], grades[keep]
+        rank = np.empty(len(lengths), dtype=np.int64)
+        rank[np.argsort(-lengths, kind="stable")] = np.arange(len(lengths))
+        order = np.lexsort((rank[card], step))
+
+        # schedulers.fsrs_rating, vectorized: the grades FSRSScheduler.grades logs map back to its buttons
+        self._set(np.clip(grades[order] - 1, 1, 4), elapsed[order], rank[card][order], step[order])
+
+    def _set(self, ratings, elapsed, ranks, steps):
+        self.ratings, self.elapsed, self.ranks, self.steps = ratings, elapsed, ranks, steps
+        self.counts = np.bincount(steps) if len(steps) else np.zeros(0, dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+
+    def sample(self, reviews, seed=0):
+        """
+        Return a history of randomly chosen cards with about `reviews` reviews.
+        """
+        cards = self.counts[0] if len(self.counts) else 0
+        chosen = np.random.default_rng(seed).random(cards) < reviews / max(len(self), 1)
+        # Keeping whole cards keeps the step-major order and the length ranking
+        keep = chosen[self.ranks]
+        subset = ReviewHistory.__new__(ReviewHistory)
+        subset._set(self.ratings[keep], self.elapsed[keep], (np.cumsum(chosen) - 1)[self.ranks[keep]],
+                    self.steps[keep])
+        return subset
+
+    @property
+    def predictions(self):
+        return int(self.counts[1:].sum())
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def step(self, k):
+        window = slice(self.starts[k], self.starts[k] + self.counts[k])
+        return self.elapsed[window], self.ratings[window]
+
+
+def _first_step(w, rating):
+    stability = w[rating - 1]
+    difficulty = w[4] - (rating - 3) * w[5]
+    return np.clip(stability, 0.1, MAX_INTERVAL), np.clip(difficulty, 1, 10)
+
+
+def _review_step(w, stability, difficulty, elapsed, rating):
+    """
+    One review of every active card: the recall probability before it and
+    the intermediates of the new stability and difficulty, kept for the
+    backward pass.
+    """
+    s, d = stability, difficulty
+    base = 1 + FACTOR * elapsed / s
+    recall = base ** DECAY
+    recalled = rating > 1
+    grow = np.exp(w[10] * (1 - recall))
+    # Stability after a successful review, without the hard/easy factors
+    core = np.exp(w[8]) * (11 - d) * s ** -w[9]
+    bonus = np.where(rating == 2, w[15], 1) * np.where(rating == 4, w[16], 1)
+    success = s * (1 + core * bonus * (grow - 1))
+    # Stability after a lapse
+    lapse_base = d ** -w[12] * ((s + 1) ** w[13] - 1) * np.exp(w[14] * (1 - recall))
+    lapse = w[11] * lapse_base
+    new_stability = np.where(recalled, success, lapse)
+    reverted = d - w[6] * (rating - 3)
+    new_difficulty = w[7] * w[4] + (1 - w[7]) * reverted
+    return dict(base=base, recall=recall, recalled=recalled, grow=grow, core=core, bonus=bonus,
+                lapse_base=lapse_base, lapse=lapse, new_stability=new_stability, reverted=reverted,
+                new_difficulty=new_difficulty)
+
+
+def forward(w, history):
+    """
+    Run the model over the history; returns the mean log loss and the
+    stability and difficulty of the active cards before every step.
+    """
+    w = np.asarray(w, dtype=np.float64)
+    states = []
+    loss = 0.0
+    stability = difficulty = None
+    for k in range(len(history.counts)):
+        elapsed, rating = history.step(k)
+        n = len(rating)
+        if k == 0:
+            stability, difficulty = _first_step(w, rating)
+            continue
+        stability, difficulty = stability[:n], difficulty[:n]
+        states.append((stability, difficulty))
+        step = _review_step(w, stability, difficulty, elapsed, rating)
+        recall = np.clip(step["recall"], EPSILON, 1 - EPSILON)
+        loss -= np.where(step["recalled"], np.log(recall), np.log(1 - recall)).sum()
+        stability = np.clip(step["new_stability"], 0.1, MAX_INTERVAL)
+        difficulty = np.clip(step["new_difficulty"], 1, 10)
+    return loss / max(history.predictions, 1), states
+
+
+def loss_and_gradient(w, history):
+    """
+    Mean log loss of the history under weights `w` and its gradient.
+    """
+    w = np.asarray(w, dtype=np.float64)
+    loss, states = forward(w, history)
+    total = max(history.predictions, 1)
+    grad = np.zeros_like(w)
+    grad_s = grad_d = np.zeros(0)
+    for k in range(len(history.counts) - 1, 0, -1):
+        elapsed, rating = history.step(k)
+        n = len(rating)
+        s, d = states[k - 1]
+        # Adjoints of the state after this step; cards that ended have none
+        grad_s = np.pad(grad_s, (0, n - len(grad_s)))
+        grad_d = np.pad(grad_d, (0, n - len(grad_d)))
+        step = _review_step(w, s, d, elapsed, rating)
+        recalled, recall, grow, core, bonus = (step[name] for name in ("recalled", "recall", "grow", "core", "bonus"))
+        lapse, lapse_base = step["lapse"], step["lapse_base"]
+
+        clipped = np.clip(recall, EPSILON, 1 - EPSILON)
+        grad_recall = np.where(recalled, -1 / clipped, 1 / (1 - clipped)) / total
+        d_recall_d_s = -DECAY * step["base"] ** (DECAY - 1) * FACTOR * elapsed / s ** 2
+
+        new_s = step["new_stability"]
+        g = grad_s * ((new_s > 0.1) & (new_s < MAX_INTERVAL))
+        g_success = np.where(recalled, g, 0)
+        g_lapse = np.where(recalled, 0, g)
+        increase = core * bonus * (grow - 1)
+
+        grad[8] += np.sum(g_success * s * increase)
+        grad[9] -= np.sum(g_success * s * increase * np.log(s))
+        grad[10] += np.sum(g_success * s * core * bonus * grow * (1 - recall))
+        grad[15] += np.sum(np.where(rating == 2, g_success * s * core * (grow - 1), 0))
+        grad[16] += np.sum(np.where(rating == 4, g_success * s * core * (grow - 1), 0))
+        grad[11] += np.sum(g_lapse * lapse_base)
+        grad[12] -= np.sum(g_lapse * lapse * np.log(d))
+        grad[13] += np.sum(g_lapse * w[11] * d ** -w[12] * (s + 1) ** w[13] * np.log(s + 1)
+                           * np.exp(w[14] * (1 - recall)))
+        grad[14] += np.sum(g_lapse * lapse * (1 - recall))
+
+        grad_recall = grad_recall + g_success * s * core * bonus * grow * -w[10] + g_lapse * lapse * -w[14]
+        new_grad_s = (g_success * (1 + increase * (1 - w[9]))
+                      + g_lapse * w[11] * d ** -w[12] * w[13] * (s + 1) ** (w[13] - 1) * np.exp(w[14] * (1 - recall))
+                      + grad_recall * d_recall_d_s)
+
+        new_d = step["new_difficulty"]
+        g_d = grad_d * ((new_d > 1) & (new_d < 10))
+        grad[4] += np.sum(g_d) * w[7]
+        grad[6] -= np.sum(g_d * (rating - 3)) * (1 - w[7])
+        grad[7] += np.sum(g_d * (w[4] - step["reverted"]))
+        new_grad_d = (g_success * -s * core * bonus * (grow - 1) / (11 - d)
+                      + g_lapse * -w[12] * lapse / d
+                      + g_d * (1 - w[7]))
+        grad_s, grad_d = new_grad_s, new_grad_d
+
+    if len(history.counts):
+        _, rating = history.step(0)
+        grad_s = np.pad(grad_s, (0, len(rating) - len(grad_s)))
+        grad_d = np.pad(grad_d, (0, len(rating) - len(grad_d)))
+        initial_s = w[rating - 1]
+        initial_d = w[4] - (rating - 3) * w[5]
+        g = grad_s * ((initial_s > 0.1) & (initial_s < MAX_INTERVAL))
+        grad[:4] += np.bincount(rating - 1, weights=g, minlength=4)
+        g_d = grad_d * ((initial_d > 1) & (initial_d < 10))
+        grad[4] += np.sum(g_d)
+        grad[5] -= np.sum(g_d * (rating - 3))
+    return loss, grad
+
+
+def fit(history, weights=DEFAULT_WEIGHTS, iterations=200, learning_rate=0.05, tolerance=1e-6,
+        sample=SAMPLE_REVIEWS):
+    """
+    Fit FSRS weights to a ReviewHistory with full-batch Adam, starting from
+    `weights`. Histories longer than `sample` reviews are fitted on a random
+    sample of their cards. Returns (weights, loss over the whole history);
+    histories with fewer than MIN_PREDICTIONS predictions keep the starting
+    weights.
+    """
+    w = np.clip(np.asarray(weights, dtype=np.float64), LOWER, UPPER)
+    if history.predictions < MIN_PREDICTIONS:
+        return tuple(w.tolist()), forward(w, history)[0]
+    if sample and len(history) > sample:
+        w, _ = _adam(w, history.sample(sample), iterations, learning_rate, tolerance)
+        return tuple(w.tolist()), forward(w, history)[0]
+    w, loss = _adam(w, history, iterations, learning_rate, tolerance)
+    return tuple(w.tolist()), loss
+
+
+def _adam(w, history, iterations, learning_rate, tolerance):
+    beta1, beta2 = 0.9, 0.999
+    m, v = np.zeros_like(w), np.zeros_like(w)
+    best_w, best_loss = w, np.inf
+    previous = np.inf
+    for t in range(1, iterations + 1):
+        loss, grad = loss_and_gradient(w, history)
+        if loss < best_loss:
+            best_w, best_loss = w, loss
+        if abs(previous - loss) < tolerance:
+            break
+        previous = loss
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad ** 2
+        step = learning_rate * (m / (1 - beta1 ** t)) / (np.sqrt(v / (1 - beta2 ** t)) + 1e-8)
+        w = np.clip(w - step, LOWER, UPPER)
+    return best_w, float(best_loss)
+
+
+def _fit_one(args):
+    columns, options = args
+    return fit(ReviewHistory(*columns), **options)
+
+
+def fit_decks(columns, processes=None, **options):
+    """
+    Fit several decks in a process pool. `columns` is a list of (card IDs,
+    reviewed at, grades) tuples, one per deck; returns their (weights, loss)
+    in the same order.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_fit_one, [(deck, options) for deck in columns]))
+
+
+def main(argv=None):
+    from db import DB_FILE
+    from flashcardmanager import FlashcardManager
+
+    parser = argparse.ArgumentParser(description="Fit the FSRS weights of decks to their review logs.")
+    parser.add_argument("--db", default=DB_FILE, help="Database file")
+    parser.add_argument("--deck", type=int, action="append", help="Deck ID (default: all decks)")
+    parser.add_argument("--processes", type=int, help="Worker processes when fitting several decks")
+    parser.add_argument("--use", action="store_true", help="Schedule the decks with FSRS from now on")
+    args, _ = parser.parse_known_args(argv)
+
+    manager = FlashcardManager(db_file=args.db)
+    try:
+        deck_ids = args.deck or [deck["id"] for deck in manager.db.get_decks()]
+        start = time.perf_counter()
+        losses = manager.fit_fsrs(deck_ids, args.processes)
+        for deck_id, loss in losses.items():
+            print(f"Deck {deck_id}: log loss {loss:.4f}")
+            if args.use:
+                manager.set_scheduler("fsrs", deck_id)
+        print(f"Fitted {len(losses)} decks in {time.perf_counter() - start:.1f} s.")
+    finally:
+        manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
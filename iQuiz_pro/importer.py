@@ -0,0 +1,88 @@
+"""
+Streaming CSV/TSV importer for iQuiz Pro decks.
+
+The file is read lazily row by row and written with
+DatabaseManager.add_flashcards_bulk, so memory stays flat and every batch is
+a single transaction. Progress is checkpointed per batch and an interrupted
+import continues from the last committed batch when run again.
+"""
+import argparse
+import csv
+import os
+import sys
+from itertools import islice
+
+from db import DatabaseManager, DB_FILE
+from loggers import db_logger
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def detect_delimiter(path):
+    return "\t" if os.path.splitext(path)[1].lower() in (".tsv", ".tab", ".txt") else ","
+
+
+def read_cards(path, delimiter=None, skip_header=False):
+    """
+    Lazily yield (question, answer) pairs from a delimited file.
+    Rows with fewer than two non-empty columns are skipped.
+    """
+    delimiter = delimiter or detect_delimiter(path)
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        if skip_header:
+            next(reader, None)
+        for line_no, row in enumerate(reader, start=2 if skip_header else 1):
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                db_logger.warning(f"Skipping malformed row {line_no} in {path}")
+                continue
+            yield row[0].strip(), row[1].strip()
+
+
+def import_cards(db, path, deck_id, batch_size=DEFAULT_BATCH_SIZE, delimiter=None,
+                 skip_header=False, resume=True, progress=None):
+    """
+    Import a CSV/TSV file into a deck.
+    :param db: DatabaseManager to write to
+    :param path: Path of the file to import
+    :param deck_id: ID of the target deck
+    :param resume: Continue after the last committed batch of a previous run
+    :param progress: Optional callable receiving the total number of committed rows
+    :return: Number of cards inserted by this run
+    """
+    source = os.path.abspath(path)
+    if not resume:
+        db.reset_import_progress(source, deck_id)
+    done = db.get_import_progress(source, deck_id)
+    if done:
+        db_logger.info(f"Resuming import of {path} after {done} rows.")
+    cards = islice(read_cards(path, delimiter, skip_header), done, None)
+    return db.add_flashcards_bulk(cards, deck_id, batch_size, source=source, start=done, progress=progress)
+
+
+def _print_progress(total):
+    sys.stdout.write(f"\rImported {total} cards")
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import flashcards from a CSV/TSV file.")
+    parser.add_argument("path", help="CSV or TSV file with question and answer columns")
+    parser.add_argument("--deck", required=True, help="Name of the deck to import into (created if missing)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--delimiter", help="Column delimiter (default: by file extension)")
+    parser.add_argument("--skip-header", action="store_true", help="Ignore the first row")
+    parser.add_argument("--restart", action="store_true", help="Ignore any saved progress and import from the start")
+    parser.add_argument("--db", default=DB_FILE, help="Database file")
+    args, _ = parser.parse_known_args(argv)
+
+    with DatabaseManager(args.db) as db:
+        deck = next((d for d in db.get_decks() if d["name"] == args.deck), None)
+        deck_id = deck["id"] if deck else db.add_deck(args.deck)
+        inserted = import_cards(db, args.path, deck_id, args.batch_size, args.delimiter,
+                                args.skip_header, resume=not args.restart, progress=_print_progress)
+    print(f"\nDone: {inserted} new cards in deck '{args.deck}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,7 @@ parser = argparse.ArgumentParser(
     description="Run the server with optional debug mode.")
 parser.add_argument("--debug", action="store_true", help="Run in debug mode")
 parser.add_argument("--encrypt", action="store_true", help="Encrypt the files")
-args = parser.parse_args()
+args, _ = parser.parse_known_args()
 
 if args.debug:
     db_logger.setLevel(logging.DEBUG)
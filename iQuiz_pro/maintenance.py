@@ -0,0 +1,27 @@
+"""
+Database maintenance for iQuiz Pro.
+
+`python maintenance.py` refreshes the query planner statistics; add --vacuum
+to also rebuild the file and reclaim the space left by large deletions (e.g.
+after delete_deck). Close the app first when vacuuming: it blocks all writes.
+"""
+import argparse
+
+from db import DatabaseManager, DB_FILE
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimize or vacuum the flashcards database.")
+    parser.add_argument("--db", default=DB_FILE, help="Database file")
+    parser.add_argument("--vacuum", action="store_true", help="Rebuild the file to reclaim free pages")
+    args, _ = parser.parse_known_args(argv)
+
+    with DatabaseManager(args.db) as db:
+        if args.vacuum:
+            return 0 if db.vacuum() else 1
+        db.optimize()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,133 @@
+"""
+Versioned schema migrations for the iQuiz Pro database.
+
+The schema version is kept in SQLite's `PRAGMA user_version`. Each step is a
+function registered with @migration(version) that receives a cursor inside the
+upgrade transaction; DatabaseManager runs all pending steps and the version
+bump in a single transaction, so a failed upgrade leaves the file untouched.
+"""
+from dates import to_epoch
+from search import FTS_LEGACY_TRIGGERS, nikkud_fold
+
+MIGRATIONS = {}
+
+
+def migration(version):
+    def register(step):
+        MIGRATIONS[version] = step
+        return step
+    return register
+
+
+def latest_version():
+    return max(MIGRATIONS, default=0)
+
+
+def pending_migrations(current):
+    return [(version, MIGRATIONS[version]) for version in sorted(MIGRATIONS) if version > current]
+
+
+def _epoch_or_null(value):
+    # An unparsable legacy date must not abort the whole upgrade
+    try:
+        return to_epoch(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@migration(1)
+def integer_card_keys(cursor):
+    """
+    Move flashcards from TEXT uuid keys to INTEGER rowid keys (keeping the uuid
+    in a UNIQUE column) and store card dates as integer epoch seconds. New IDs
+    reuse the old rowids, so the search index stays aligned.
+    """
+    cursor.connection.create_function("to_epoch", 1, _epoch_or_null, deterministic=True)
+    cursor.execute("""
+        CREATE TABLE flashcards_v1 (
+            ID INTEGER PRIMARY KEY,
+            UUID TEXT NOT NULL UNIQUE,
+            DeckID INTEGER NOT NULL,
+            Question TEXT NOT NULL,
+            Answer TEXT NOT NULL,
+            ReviewCount INTEGER DEFAULT 0,
+            LastReviewedAt INTEGER,
+            EasinessFactor REAL DEFAULT 2.5,
+            Interval INTEGER DEFAULT 1,
+            NextReviewDate INTEGER,
+            CreatedAt INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            FOREIGN KEY (DeckID) REFERENCES decks(ID) ON DELETE CASCADE
+        )
+        """)
+    cursor.execute("""
+        INSERT INTO flashcards_v1 (ID, UUID, DeckID, Question, Answer, ReviewCount, LastReviewedAt,
+                                   EasinessFactor, Interval, NextReviewDate, CreatedAt)
+        SELECT rowid, ID, DeckID, Question, Answer, ReviewCount, to_epoch(LastReviewedAt),
+               EasinessFactor, Interval, to_epoch(NextReviewDate), to_epoch(CreatedAt)
+        FROM flashcards
+        """)
+    cursor.execute("""
+        CREATE TABLE flashcard_tags_v1 (
+            FlashcardID INTEGER NOT NULL,
+            TagID INTEGER NOT NULL,
+            PRIMARY KEY (FlashcardID, TagID),
+            FOREIGN KEY (FlashcardID) REFERENCES flashcards_v1(ID) ON DELETE CASCADE,
+            FOREIGN KEY (TagID) REFERENCES tags(ID) ON DELETE CASCADE
+        )
+        """)
+    # Orphaned associations of deleted cards are dropped on the way
+    cursor.execute("""
+        INSERT INTO flashcard_tags_v1 (FlashcardID, TagID)
+        SELECT f.rowid, ft.TagID
+        FROM flashcard_tags ft JOIN flashcards f ON f.ID = ft.FlashcardID
+        """)
+    cursor.execute("DROP TABLE flashcard_tags")
+    cursor.execute("DROP TABLE flashcards")
+    # Renaming also rewrites the foreign key of flashcard_tags_v1
+    cursor.execute("ALTER TABLE flashcards_v1 RENAME TO flashcards")
+    cursor.execute("ALTER TABLE flashcard_tags_v1 RENAME TO flashcard_tags")
+
+
+@migration(2)
+def drop_orphaned_tag_links(cursor):
+    """
+    Foreign keys are enforced from this version on. Remove the tag links that
+    deletions made while they were off left behind.
+    """
+    cursor.execute("""
+        DELETE FROM flashcard_tags
+        WHERE FlashcardID NOT IN (SELECT ID FROM flashcards)
+           OR TagID NOT IN (SELECT ID FROM tags)
+        """)
+
+
+@migration(3)
+def scheduler_columns(cursor):
+    """
+    Add the FSRS memory state of cards and the per-deck scheduler setting.
+    """
+    for table, column, definition in (("flashcards", "Stability", "REAL"),
+                                      ("flashcards", "Difficulty", "REAL"),
+                                      ("decks", "Scheduler", "TEXT NOT NULL DEFAULT 'sm2'"),
+                                      ("decks", "SchedulerParams", "TEXT")):
+        # ALTER TABLE has no IF NOT EXISTS
+        if column not in [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+@migration(4)
+def plain_text_columns(cursor):
+    """
+    Store the nikkud-folded question and answer on the card, so the search
+    triggers copy them instead of calling a Python function from SQL. The
+    old triggers are dropped; the search index setup recreates them.
+    """
+    if "QuestionPlain" not in [row[1] for row in cursor.execute("PRAGMA table_info(flashcards)")]:
+        cursor.execute("ALTER TABLE flashcards ADD COLUMN QuestionPlain TEXT")
+        cursor.execute("ALTER TABLE flashcards ADD COLUMN AnswerPlain TEXT")
+    # The index already holds the folded text; dropping the triggers first keeps the backfill from rewriting it
+    for trigger in FTS_LEGACY_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    rows = cursor.execute("SELECT ID, Question, Answer FROM flashcards").fetchall()
+    cursor.executemany("UPDATE flashcards SET QuestionPlain = ?, AnswerPlain = ? WHERE ID = ?",
+                       ((nikkud_fold(question), nikkud_fold(answer), card_id) for card_id, question, answer in rows))
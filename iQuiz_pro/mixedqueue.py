@@ -0,0 +1,90 @@
+"""
+Review queue spanning several decks.
+
+Every deck contributes a lazy stream of its due reviews (earliest first, read
+page by page from the due index) followed by its new cards. The streams are
+merged with a heap holding only the head card of each deck, so a session over
+dozens of decks never loads more than a page per deck. The interleaving mode
+decides the heap key:
+
+- "due-first": all due reviews across decks by due date, then new cards taken
+  from the decks in turn
+- "round-robin": one card from each deck in turn, reviews before new cards
+  within a deck
+
+Per-deck caps limit the reviews and new cards taken from each deck.
+"""
+import heapq
+import itertools
+from datetime import datetime
+
+DUE_FIRST = "due-first"
+ROUND_ROBIN = "round-robin"
+MODES = (DUE_FIRST, ROUND_ROBIN)
+
+REVIEW = 0
+NEW = 1
+
+
+class MixedReviewQueue:
+    def __init__(self, db, deck_ids, mode=DUE_FIRST, reviews_per_deck=None, new_per_deck=None,
+                 now=None, page_size=50):
+        """
+        :param db: DatabaseManager to read the cards from
+        :param deck_ids: Decks to review, in the order used to break ties
+        :param reviews_per_deck: Maximum due reviews taken from each deck, or None
+        :param new_per_deck: Maximum new cards taken from each deck, or None
+        :param now: Reviews due at this time are included (default: now)
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown interleaving mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        # Reviews made during the session must be visible to the due streams
+        db.flush_reviews()
+        now = now if now is not None else datetime.now()
+        self._served = {}  # deck ID -> cards handed out, per kind
+        self._seen = set()
+        self._heap = []
+        for position, deck_id in enumerate(deck_ids):
+            reviews = itertools.islice(db.iter_due_reviews(deck_id, now, page_size), reviews_per_deck)
+            new = itertools.islice(db.iter_new_cards(deck_id, page_size), new_per_deck)
+            self._served[deck_id] = [0, 0]
+            stream = itertools.chain(zip(itertools.repeat(REVIEW), reviews), zip(itertools.repeat(NEW), new))
+            self._push(position, deck_id, stream)
+
+    def _key(self, position, deck_id, kind, card):
+        served = self._served[deck_id]
+        if self.mode == DUE_FIRST:
+            if kind == REVIEW:
+                return REVIEW, card.next_review_date, card.id
+            return NEW, served[NEW], position
+        return sum(served), position
+
+    def _push(self, position, deck_id, stream):
+        # Only the head card of every deck sits in the heap
+        for kind, card in stream:
+            if card.id not in self._seen:
+                key = self._key(position, deck_id, kind, card)
+                heapq.heappush(self._heap, (key, position, deck_id, kind, card, stream))
+                return
+
+    def next_card(self):
+        """
+        Return the next card of the session, or None when every deck is done.
+        """
+        if not self._heap:
+            return None
+        _, position, deck_id, kind, card, stream = heapq.heappop(self._heap)
+        self._seen.add(card.id)
+        self._served[deck_id][kind] += 1
+        self._push(position, deck_id, stream)
+        return card
+
+    def __iter__(self):
+        return iter(self.next_card, None)
+
+    def served(self, deck_id):
+        """
+        Return (reviews, new cards) handed out from a deck so far.
+        """
+        return tuple(self._served[deck_id])
@@ -0,0 +1,189 @@
+"""
+Write-behind journal for review results.
+
+Schedule updates are kept in memory and appended to a small crash log instead
+of being committed one by one. The journal is flushed to the flashcards table
+in a single transaction every `flush_every` reviews, every `flush_interval`
+seconds, or on close. Entries left in the crash log by a crash are replayed
+the next time the database is opened.
+"""
+import json
+import os
+import threading
+import time
+
+from dates import to_epoch
+from loggers import db_logger
+
+DEFAULT_FLUSH_EVERY = 50
+DEFAULT_FLUSH_INTERVAL = 30  # seconds
+
+
+class ReviewJournal:
+    def __init__(self, apply, log_file, flush_every=DEFAULT_FLUSH_EVERY,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, background=False):
+        """
+        :param apply: Callable writing a list of update rows and a list of review
+            log rows in one transaction, returning True on success
+        :param log_file: Path of the append-only crash log
+        :param background: Flush on a timer thread; otherwise the interval is
+            checked whenever a review is recorded
+        """
+        self._apply = apply
+        self.log_file = log_file
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._revlog = []
+        # Crash log lines of the pending reviews
+        self._lines = []
+        # Reviews being applied by the flush under way, still visible to readers until they commit
+        self._in_flight = {}
+        self._lock = threading.RLock()
+        # Serializes flushes, so batches are applied in the order they were recorded
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._timer = None
+        self._log = None
+        self.recover()
+        self._log = open(self.log_file, "a", encoding="utf-8")
+        if background:
+            self._timer = threading.Thread(target=self._run_timer, name="review-journal", daemon=True)
+            self._timer.start()
+
+    def record(self, card_id, review_count, easiness_factor, interval, next_review_date, last_reviewed_at, revlog=None,
+               stability=None, difficulty=None):
+        """
+        :param revlog: Optional review log row written together with the schedule
+        """
+        entry = {
+            "id": card_id,
+            "repetition": review_count,
+            "easiness_factor": easiness_factor,
+            "interval": interval,
+            "next_review_date": to_epoch(next_review_date),
+            "last_reviewed_at": to_epoch(last_reviewed_at),
+            "stability": stability,
+            "difficulty": difficulty,
+        }
+        line = json.dumps(dict(entry, revlog=revlog)) + "\n"
+        with self._lock:
+            self._log.write(line)
+            self._log.flush()
+            self._lines.append(line)
+            self._pending[card_id] = entry
+            if revlog is not None:
+                # Every review is logged, not only the latest one per card
+                self._revlog.append(tuple(revlog))
+            due = (len(self._pending) >= self.flush_every or
+                   (self._timer is None and time.monotonic() - self._last_flush >= self.flush_interval))
+        if due:
+            self.flush()
+
+    def get(self, card_id):
+        """
+        Return the pending schedule of a card, or None if it has no unflushed review.
+        """
+        with self._lock:
+            entry = self._pending.get(card_id)
+            return entry if entry is not None else self._in_flight.get(card_id)
+
+    def pending(self):
+        with self._lock:
+            return {**self._in_flight, **self._pending}
+
+    def discard(self, card_id):
+        with self._lock:
+            self._pending.pop(card_id, None)
+            self._in_flight.pop(card_id, None)
+
+    def flush(self):
+        """
+        Write the pending reviews. Flushes run one at a time. The lock is not
+        held while the reviews are applied: in concurrent mode applying waits
+        for the writer thread, which may itself be waiting for the journal
+        (e.g. delete_card discarding a card). Until they commit, get() and
+        pending() keep returning them. Must not be called on the writer thread.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._last_flush = time.monotonic()
+                if not self._pending:
+                    return True
+                pending, revlog, lines = self._pending, self._revlog, self._lines
+                self._pending, self._revlog, self._lines = {}, [], []
+                self._in_flight = dict(pending)
+            applied = self._apply(self._rows(pending.values()), revlog)
+            with self._lock:
+                in_flight = self._in_flight
+                self._in_flight = {}
+                if not applied:
+                    # Reviews recorded meanwhile are newer than the ones put back;
+                    # cards discarded meanwhile are not put back
+                    for card_id, entry in in_flight.items():
+                        self._pending.setdefault(card_id, entry)
+                    self._revlog = revlog + self._revlog
+                    self._lines = lines + self._lines
+                    return False
+                db_logger.info(f"Flushed {len(pending)} reviews from the journal.")
+                # Keep only what is still unapplied in the crash log
+                self._log.seek(0)
+                self._log.truncate()
+                self._log.writelines(self._lines)
+                self._log.flush()
+                return True
+
+    def recover(self):
+        """
+        Replay reviews left in the crash log by a previous session.
+        """
+        if not os.path.exists(self.log_file):
+            return
+        entries = {}
+        revlog = []
+        lines = []
+        with open(self.log_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+                entries[entry["id"]] = entry
+                if entry.get("revlog"):
+                    revlog.append(tuple(entry["revlog"]))
+                lines.append(line if line.endswith("\n") else line + "\n")
+        if not entries:
+            return
+        if self._apply(self._rows(entries.values()), revlog):
+            db_logger.warning(f"Recovered {len(entries)} reviews from {self.log_file}.")
+            open(self.log_file, "w").close()
+            return
+        # Keep them pending, so the next flush retries them before the log is truncated
+        db_logger.error(f"Could not replay {len(entries)} reviews from {self.log_file}; will retry on the next flush.")
+        for entry in entries.values():
+            entry.pop("revlog", None)
+        self._pending.update(entries)
+        self._revlog.extend(revlog)
+        self._lines.extend(lines)
+        # A torn last line must not run into the next record
+        with open(self.log_file, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def close(self):
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+        self._log.close()
+
+    def _run_timer(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    @staticmethod
+    def _rows(entries):
+        # to_epoch also upgrades dates logged as text by older versions
+        return [(e["repetition"], e["easiness_factor"], e["interval"], to_epoch(e["next_review_date"]),
+                 to_epoch(e["last_reviewed_at"]), e.get("stability"), e.get("difficulty"), e["id"]) for e in entries]
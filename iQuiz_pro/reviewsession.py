@@ -0,0 +1,160 @@
+"""
+In-memory review session of one deck.
+
+The cards due when the session starts are read once, with their schedules,
+into a heap keyed by due time. Picking the next card looks at the top of the
+heap, and answering a card pushes it back with its new due time, so neither
+touches the database; only the new schedule of each answered card is
+written (through DatabaseManager.update_card_data, so write-behind mode
+batches those writes too).
+
+Failed cards go through intra-day learning steps: a card answered below 3
+comes back after each step (1, then 10 minutes by default) and leaves the
+session once it is passed at the last one; failing it again restarts the
+steps. Skipped cards go behind every card that is already due.
+
+By default a learning card is never shown before its step has passed, even
+when nothing else is due. Passing `learn_ahead` lets it come early instead,
+like Anki's learn-ahead limit. Keep that below the first learning step, or a
+failed card can come back right away.
+"""
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+
+from dates import from_epoch, to_epoch
+
+DEFAULT_LEARNING_STEPS = (1, 10)  # minutes
+DEFAULT_LEARN_AHEAD = None  # seconds a learning card may be shown early when nothing else is due
+PASSING_GRADE = 3
+
+
+class ReviewSession:
+    def __init__(self, db, deck_id, scheduler, learning_steps=DEFAULT_LEARNING_STEPS,
+                 learn_ahead=DEFAULT_LEARN_AHEAD, now=None):
+        """
+        :param db: DatabaseManager the cards are read from and written to
+        :param scheduler: schedulers.Scheduler giving a card's next schedule
+        :param learning_steps: Minutes until a failed card is shown again, per step
+        :param learn_ahead: Seconds a learning card may be shown before it is
+            due when no other card is due; None to never show cards early
+        """
+        self.db = db
+        self.deck_id = deck_id
+        self.scheduler = scheduler
+        self.learning_steps = tuple(learning_steps)
+        self.learn_ahead = learn_ahead
+        now = time.time() if now is None else now
+        self._cards = {}  # card ID -> Card with its current schedule
+        self._steps = {}  # card ID -> index of its learning step, for learning cards
+        self._entries = {}  # card ID -> sequence number of its live heap entry
+        self._counter = itertools.count()
+        self._heap = []
+        for card in db.get_session_cards(deck_id, datetime.fromtimestamp(now)):
+            self._cards[card.id] = card
+            due = card.next_review_date if card.next_review_date is not None else now
+            self._heap.append(self._entry(card.id, due))
+        heapq.heapify(self._heap)
+        self.reviewed = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, card_id):
+        return card_id in self._entries
+
+    def _entry(self, card_id, due):
+        sequence = next(self._counter)
+        self._entries[card_id] = sequence
+        return due, sequence, card_id
+
+    def _push(self, card_id, due):
+        heapq.heappush(self._heap, self._entry(card_id, due))
+
+    def _top(self):
+        # Entries replaced by a later push are dropped lazily
+        while self._heap and self._entries.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def next_card(self, now=None):
+        """
+        Return the card to show next, or None when no card is due (see
+        next_due for learning cards still to come).
+        """
+        top = self._top()
+        if top is None:
+            return None
+        now = time.time() if now is None else now
+        due, _, card_id = top
+        if due > now and (self.learn_ahead is None or card_id not in self._steps or due > now + self.learn_ahead):
+            return None
+        return self._cards[card_id]
+
+    def next_due(self):
+        """
+        Epoch time at which the next card of the session is due, or None when
+        the session is finished.
+        """
+        top = self._top()
+        return top[0] if top is not None else None
+
+    def skip(self, card_id, now=None):
+        """
+        Put a card behind every card that is due now.
+        """
+        if card_id in self._entries:
+            self._push(card_id, time.time() if now is None else now)
+
+    def answer(self, card_id, grade, latency_ms=None, now=None):
+        """
+        Grade a card of the session and store its new schedule. Returns the
+        new (repetition, easiness factor, interval, next review date).
+        """
+        card = self._cards[card_id]
+        now = time.time() if now is None else now
+        prev_interval = card.interval
+        if card_id in self._steps:
+            # The day-scale schedule was set by the first answer; learning steps
+            # only decide when the card comes back within the session
+            step = self._steps[card_id] + 1 if grade >= PASSING_GRADE else 0
+        else:
+            (card.repetition, card.easiness_factor, card.interval,
+             card.stability, card.difficulty) = self.scheduler.review(card, grade, now)
+            card.next_review_date = to_epoch(datetime.fromtimestamp(now) + timedelta(days=card.interval))
+            card.last_reviewed_at = int(now)
+            step = 0 if grade < PASSING_GRADE else None
+        next_review_date = from_epoch(card.next_review_date)
+        self.db.update_card_data(card_id, card.repetition, card.easiness_factor, card.interval, next_review_date,
+                                 grade=grade, prev_interval=prev_interval, latency_ms=latency_ms,
+                                 stability=card.stability, difficulty=card.difficulty)
+        self.reviewed += 1
+
+        if step is not None and step < len(self.learning_steps):
+            self._steps[card_id] = step
+            self._push(card_id, now + self.learning_steps[step] * 60)
+        else:
+            # Graduated, or passed on the first answer: done for today
+            self._steps.pop(card_id, None)
+            del self._entries[card_id]
+        return card.repetition, card.easiness_factor, card.interval, next_review_date
+
+    def discard(self, card_id):
+        """
+        Drop a card from the session, e.g. after it was deleted.
+        """
+        self._entries.pop(card_id, None)
+        self._steps.pop(card_id, None)
+        self._cards.pop(card_id, None)
+
+    def edit(self, card_id, question, answer):
+        card = self._cards.get(card_id)
+        if card is not None:
+            card.question, card.answer = question, answer
+
+    def learning(self):
+        """
+        Number of cards currently in learning steps.
+        """
+        return len(self._steps)
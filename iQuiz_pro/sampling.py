@@ -0,0 +1,50 @@
+"""
+Per-deck shuffled card order used for random sampling.
+
+Instead of sorting the deck by RANDOM() on every draw, the card rowids of a
+deck are loaded once through an index, shuffled, and handed out in order
+across calls. When the order runs out it is reshuffled, so every card is seen
+once per pass.
+"""
+import random
+import threading
+
+
+class DeckShuffle:
+    def __init__(self, rowids, rng=random):
+        self._rng = rng
+        self._rowids = list(rowids)
+        self._rng.shuffle(self._rowids)
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rowids)
+
+    def take(self, k):
+        """
+        Return the next `k` rowids of the shuffled order, without repeats as long
+        as k does not exceed the deck size.
+        """
+        with self._lock:
+            k = min(k, len(self._rowids))
+            if self._position + k > len(self._rowids):
+                # Start a new pass with the unseen rest of this one in front,
+                # so a batch never repeats a card
+                rest = self._rowids[self._position:]
+                seen = self._rowids[:self._position]
+                self._rng.shuffle(seen)
+                self._rowids = rest + seen
+                self._position = 0
+            return self._take_locked(k)
+
+    def _take_locked(self, k):
+        taken = self._rowids[self._position:self._position + k]
+        self._position += k
+        return taken
+
+    def choices(self, k):
+        """
+        Return `k` rowids drawn with replacement.
+        """
+        return self._rng.choices(self._rowids, k=k) if self._rowids else []
@@ -0,0 +1,189 @@
+"""
+Pluggable review schedulers.
+
+A scheduler turns a card's current schedule and a grade into its next one.
+Grades are on the SM-2 scale (0-5) everywhere, which is also what the review
+log stores; each scheduler's `grades` maps the review buttons to them, so
+that every button reaches a distinct step of that scheduler. Every deck picks its
+scheduler by name (see SCHEDULERS), stored with the deck together with the
+scheduler's parameters.
+
+- "sm2": SuperMemo 2, driven by the easiness factor.
+- "fsrs": a memory model in the style of FSRS-4.5. Every card has a
+  stability (days until its recall probability drops to 90%) and a
+  difficulty (1-10), updated after each review from the grade and the recall
+  probability at the time of the review. Its 17 weights can be fitted per
+  deck from the review log with fsrsfit.fit.
+"""
+import math
+from collections import namedtuple
+
+DAY = 86400  # seconds
+
+# New schedule of a card; stability and difficulty are None for SM-2
+Schedule = namedtuple("Schedule", "repetition easiness_factor interval stability difficulty")
+
+# FSRS-4.5 defaults, fitted by its authors on a large collection of reviews
+DEFAULT_WEIGHTS = (0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474, 0.1367,
+                   1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755)
+DECAY = -0.5
+FACTOR = 19 / 81  # makes the recall probability 90% after `stability` days
+DEFAULT_RETENTION = 0.9
+MAX_INTERVAL = 36500  # days
+
+
+def sm2(n, EF, I, q):
+    """
+    One SuperMemo 2 step: the new repetition count, easiness factor and
+    interval of a card after grade q.
+    """
+    if q >= 3:  # Correct response
+        if n == 0:
+            I = 1
+        elif n == 1:
+            I = 6
+        else:
+            I = round(I * EF)
+        n += 1
+    else:  # Incorrect response
+        n = 0
+        I = 1
+
+    EF = EF + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+    if EF < 1.3:
+        EF = 1.3
+    return n, EF, I
+
+
+def fsrs_rating(q):
+    """
+    FSRS rating (1 again, 2 hard, 3 good, 4 easy) of an SM-2 grade: grades
+    below 3 are lapses, 3 is a correct answer recalled with difficulty, 4 a
+    correct one and 5 a perfect one. fsrsfit reads the review log the same way.
+    """
+    return max(1, min(4, q - 1))
+
+
+def retrievability(elapsed_days, stability):
+    return (1 + FACTOR * elapsed_days / stability) ** DECAY
+
+
+class Scheduler:
+    name = None
+    # Review button -> grade
+    grades = {
+        'easy': 5,
+        'hard': 3,
+        'very hard': 2,
+        'again': 0
+    }
+
+    def review(self, card, grade, now):
+        """
+        Return the Schedule of a card after a review.
+        :param card: Record with the card's repetition, easiness_factor,
+            interval, stability, difficulty and last_reviewed_at
+        :param grade: SM-2 grade, 0-5
+        :param now: Review time in epoch seconds
+        """
+        raise NotImplementedError
+
+    def params(self):
+        """
+        Parameters stored with the deck, or None.
+        """
+        return None
+
+
+class SM2Scheduler(Scheduler):
+    name = "sm2"
+
+    def __init__(self, params=None):
+        pass
+
+    def review(self, card, grade, now):
+        return Schedule(*sm2(card['repetition'], card['easiness_factor'], card['interval'], grade), None, None)
+
+
+class FSRSScheduler(Scheduler):
+    name = "fsrs"
+    # The SM-2 buttons would make "hard" FSRS Hard and "very hard" Again,
+    # leaving Good unreachable; these grades give easy -> Easy, hard -> Good,
+    # very hard -> Hard and again -> Again through fsrs_rating
+    grades = {
+        'easy': 5,
+        'hard': 4,
+        'very hard': 3,
+        'again': 0
+    }
+
+    def __init__(self, params=None):
+        """
+        :param params: {"weights": [17 floats], "retention": desired recall
+            probability at the next review}, either may be missing
+        """
+        params = params or {}
+        self.weights = tuple(params.get("weights") or DEFAULT_WEIGHTS)
+        self.retention = params.get("retention", DEFAULT_RETENTION)
+        if len(self.weights) != len(DEFAULT_WEIGHTS):
+            raise ValueError(f"FSRS needs {len(DEFAULT_WEIGHTS)} weights, got {len(self.weights)}")
+
+    def params(self):
+        return {"weights": list(self.weights), "retention": self.retention}
+
+    def initial_difficulty(self, rating):
+        w = self.weights
+        return min(max(w[4] - (rating - 3) * w[5], 1), 10)
+
+    def next_difficulty(self, difficulty, rating):
+        w = self.weights
+        # Mean reversion towards the difficulty of a first "good" answer
+        difficulty = w[7] * w[4] + (1 - w[7]) * (difficulty - w[6] * (rating - 3))
+        return min(max(difficulty, 1), 10)
+
+    def next_stability(self, stability, difficulty, recall, rating):
+        w = self.weights
+        if rating == 1:
+            return (w[11] * difficulty ** -w[12] * ((stability + 1) ** w[13] - 1)
+                    * math.exp(w[14] * (1 - recall)))
+        hard_penalty = w[15] if rating == 2 else 1
+        easy_bonus = w[16] if rating == 4 else 1
+        return stability * (1 + math.exp(w[8]) * (11 - difficulty) * stability ** -w[9]
+                            * (math.exp(w[10] * (1 - recall)) - 1) * hard_penalty * easy_bonus)
+
+    def interval(self, stability):
+        days = stability / FACTOR * (self.retention ** (1 / DECAY) - 1)
+        return min(max(round(days), 1), MAX_INTERVAL)
+
+    def review(self, card, grade, now):
+        rating = fsrs_rating(grade)
+        stability, difficulty = card.get('stability'), card.get('difficulty')
+        last_reviewed_at = card.get('last_reviewed_at')
+        if last_reviewed_at is None:
+            stability = self.weights[rating - 1]
+            difficulty = self.initial_difficulty(rating)
+        else:
+            if stability is None:
+                # Last scheduled by SM-2: start from its interval
+                stability, difficulty = float(card['interval'] or 1), self.weights[4]
+            elapsed = max(now - last_reviewed_at, 0) / DAY
+            recall = retrievability(elapsed, stability)
+            stability = self.next_stability(stability, difficulty, recall, rating)
+            difficulty = self.next_difficulty(difficulty, rating)
+        stability = min(max(stability, 0.1), MAX_INTERVAL)
+        repetition = card['repetition'] + 1 if rating > 1 else 0
+        return Schedule(repetition, card['easiness_factor'], self.interval(stability), stability, difficulty)
+
+
+SCHEDULERS = {scheduler.name: scheduler for scheduler in (SM2Scheduler, FSRSScheduler)}
+DEFAULT_SCHEDULER = SM2Scheduler.name
+
+
+def make_scheduler(name=None, params=None):
+    """
+    Create the scheduler registered under `name` (default: SM-2).
+    """
+    name = name or DEFAULT_SCHEDULER
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler {name!r}, expected one of {tuple(SCHEDULERS)}")
+    return SCHEDULERS[name](params)
@@ -0,0 +1,85 @@
+"""
+Full-text search support for the flashcards table.
+
+Cards are indexed in an FTS5 table kept in sync by triggers. Next to the raw
+question and answer it stores a copy folded with HebrewHandler.remove_nikkud,
+and queries are folded the same way, so pointed and unpointed Hebrew match
+each other.
+
+The folded copies are computed in Python when DatabaseManager writes a card
+(flashcards.QuestionPlain / AnswerPlain) and the triggers only copy columns,
+so the schema does not depend on a Python function: other writers such as
+the sqlite3 shell keep working. Cards they insert without the plain columns
+are indexed with the raw text, which still matches unpointed queries for
+unpointed text.
+"""
+import os
+import sqlite3
+import sys
+
+try:
+    from hebrewhandler import HebrewHandler
+except ImportError:
+    # iQuiz Pro runs from its own folder; the handler lives in the add-on root
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from hebrewhandler import HebrewHandler
+
+FTS_TABLE = "flashcards_fts"
+
+FTS_SCHEMA = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5 (
+        Question, Answer, QuestionPlain, AnswerPlain,
+        tokenize = 'unicode61'
+    );
+    CREATE TRIGGER IF NOT EXISTS flashcards_fts_insert AFTER INSERT ON flashcards BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, Question, Answer, QuestionPlain, AnswerPlain)
+        VALUES (new.rowid, new.Question, new.Answer,
+                COALESCE(new.QuestionPlain, new.Question), COALESCE(new.AnswerPlain, new.Answer));
+    END;
+    CREATE TRIGGER IF NOT EXISTS flashcards_fts_delete AFTER DELETE ON flashcards BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS flashcards_fts_update
+    AFTER UPDATE OF Question, Answer, QuestionPlain, AnswerPlain ON flashcards BEGIN
+        UPDATE {FTS_TABLE}
+        SET Question = new.Question, Answer = new.Answer,
+            QuestionPlain = COALESCE(new.QuestionPlain, new.Question),
+            AnswerPlain = COALESCE(new.AnswerPlain, new.Answer)
+        WHERE rowid = new.rowid;
+    END;
+"""
+
+FTS_BACKFILL = f"""
+    INSERT INTO {FTS_TABLE} (rowid, Question, Answer, QuestionPlain, AnswerPlain)
+    SELECT rowid, Question, Answer, COALESCE(QuestionPlain, Question), COALESCE(AnswerPlain, Answer) FROM flashcards
+"""
+
+# Triggers of older versions that called nikkud_fold from SQL
+FTS_LEGACY_TRIGGERS = ("flashcards_fts_insert", "flashcards_fts_update")
+
+
+def nikkud_fold(text):
+    return HebrewHandler.remove_nikkud(text) if text else text
+
+
+def register_functions(conn):
+    # Only needed by databases whose triggers predate the plain columns
+    conn.create_function("nikkud_fold", 1, nikkud_fold, deterministic=True)
+
+
+def fts5_available(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 query: every word is folded, quoted and
+    prefix-matched, and all words must match.
+    """
+    words = nikkud_fold(text).replace('"', " ").split()
+    return " ".join(f'"{word}"*' for word in words)
@@ -0,0 +1,169 @@
+"""
+Boolean tag queries over in-memory tag bitmaps.
+
+Every tag is kept as a Python int used as a bitset over card IDs (bit n set
+= card n has the tag), loaded once from flashcard_tags and kept current as
+tags are set and removed. An expression such as `verbs AND NOT mastered` or
+`(nouns OR verbs) -"needs audio"` is evaluated with integer &, | and ~ on
+these bitsets, and only the matching rows are then read from the table.
+
+Syntax: tags are bare words or "quoted names"; NOT (or -) binds tightest,
+then AND (also implied between adjacent terms), then OR; parentheses group.
+Keywords are case-insensitive.
+"""
+import re
+import threading
+
+TOKEN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|(-)|([^\s()"]+))')
+KEYWORDS = ("AND", "OR", "NOT")
+
+
+def ids_to_bitmap(ids):
+    """
+    Build a bitset from card IDs in linear time (OR-ing shifted ones into a
+    growing int would copy it for every ID).
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for card_id in ids:
+        buffer[card_id >> 3] |= 1 << (card_id & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def bitmap_to_ids(bitmap):
+    """
+    Return the card IDs set in a bitset, ascending.
+    """
+    ids = []
+    for index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+        if byte:
+            base = index << 3
+            ids.extend(base + bit for bit in range(8) if byte >> bit & 1)
+    return ids
+
+
+def _tokenize(text):
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match:
+            raise ValueError(f"Cannot parse tag query at: {text[position:]!r}")
+        position = match.end()
+        open_paren, close_paren, quoted, minus, word = match.groups()
+        if open_paren or close_paren:
+            tokens.append(("op", open_paren or close_paren))
+        elif quoted is not None:
+            tokens.append(("tag", quoted))
+        elif minus:
+            tokens.append(("op", "NOT"))
+        elif word.upper() in KEYWORDS:
+            tokens.append(("op", word.upper()))
+        else:
+            tokens.append(("tag", word))
+    return tokens
+
+
+def parse_tag_query(text):
+    """
+    Parse a tag expression into nested tuples: ("tag", name), ("not", node),
+    ("and", left, right) and ("or", left, right). Raises ValueError on bad syntax.
+    """
+    tokens = _tokenize(text)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == ("op", "OR"):
+            take()
+            node = ("or", node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while True:
+            kind, value = peek()
+            if (kind, value) == ("op", "AND"):
+                take()
+            elif kind != "tag" and value not in ("NOT", "("):
+                return node
+            node = ("and", node, parse_not())
+
+    def parse_not():
+        if position == len(tokens):
+            raise ValueError(f"Tag query {text!r} ends early")
+        kind, value = take()
+        if (kind, value) == ("op", "NOT"):
+            return ("not", parse_not())
+        if (kind, value) == ("op", "("):
+            node = parse_or()
+            if peek() != ("op", ")"):
+                raise ValueError(f"Missing ')' in tag query {text!r}")
+            take()
+            return node
+        if kind == "tag":
+            return ("tag", value)
+        raise ValueError(f"Expected a tag in tag query {text!r}")
+
+    if not tokens:
+        raise ValueError("Empty tag query")
+    node = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected {tokens[position][1]!r} in tag query {text!r}")
+    return node
+
+
+class TagBitmaps:
+    """
+    Tag name -> card ID bitset, for all tags.
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: (tag name, card ID) pairs of every tag link
+        """
+        ids = {}
+        for name, card_id in rows:
+            ids.setdefault(name, []).append(card_id)
+        self._bitmaps = {name: ids_to_bitmap(card_ids) for name, card_ids in ids.items()}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        return self._bitmaps.get(name, 0)
+
+    def add(self, card_id, names):
+        with self._lock:
+            for name in names:
+                self._bitmaps[name] = self._bitmaps.get(name, 0) | (1 << card_id)
+
+    def remove(self, card_id, name):
+        with self._lock:
+            if name in self._bitmaps:
+                self._bitmaps[name] &= ~(1 << card_id)
+
+    def evaluate(self, node, universe):
+        """
+        Evaluate a parsed expression, restricted to the cards in `universe`.
+        NOT is a plain ~ here; Python's unbounded two's complement makes
+        `a & ~b` exact, and the final mask with the universe resolves the rest.
+        """
+        return self._evaluate(node) & universe
+
+    def _evaluate(self, node):
+        op = node[0]
+        if op == "tag":
+            return self.get(node[1])
+        if op == "not":
+            return ~self._evaluate(node[1])
+        left, right = self._evaluate(node[1]), self._evaluate(node[2])
+        return left & right if op == "and" else left | right
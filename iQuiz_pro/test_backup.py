@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from backup import BackupManager
+from db import DatabaseManager
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "flashcards.db")
+    with DatabaseManager(path) as db:
+        db.add_flashcard("question", "answer", db.add_deck("deck"))
+    return path
+
+
+@pytest.mark.parametrize("keep", [0, -1])
+def test_keep_below_one_is_rejected(db_file, keep):
+    with pytest.raises(ValueError):
+        BackupManager(db_file, keep=keep)
+
+
+def test_rotation_keeps_the_newest_backups(db_file, tmp_path):
+    backups = BackupManager(db_file, str(tmp_path / "backups"), keep=2, compression="none")
+    targets = [backups.backup(wait=True) for _ in range(3)]
+
+    assert backups.list_backups() == targets[1:]
+    assert all(os.path.exists(target) for target in targets[1:])
+
+
+def test_keep_one_keeps_the_new_backup(db_file, tmp_path):
+    backups = BackupManager(db_file, str(tmp_path / "backups"), keep=1, compression="none")
+    backups.backup(wait=True)
+    target = backups.backup(wait=True)
+
+    assert backups.list_backups() == [target]
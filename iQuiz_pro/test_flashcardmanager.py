@@ -0,0 +1,35 @@
+import pytest
+
+from flashcardmanager import FlashcardManager
+from schedulers import FSRSScheduler, SM2Scheduler
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = FlashcardManager(db_file=str(tmp_path / "flashcards.db"))
+    yield manager
+    manager.db.close()
+
+
+def _deck_with_card(manager, name, scheduler):
+    deck_id = manager.create_deck(name)
+    manager.set_scheduler(scheduler, deck_id)
+    manager.add_flashcard(f"{name} question", "answer")
+    return deck_id
+
+
+@pytest.mark.parametrize("button", ["easy", "hard", "very hard", "again"])
+def test_mixed_review_grades_a_card_with_its_own_deck(manager, button):
+    fsrs_deck = _deck_with_card(manager, "fsrs", "fsrs")
+    sm2_deck = _deck_with_card(manager, "sm2", "sm2")
+    manager.set_current_deck(sm2_deck)
+    manager.start_mixed_review()
+
+    cards = {card.deck_id: card for card in iter(manager.get_next_flashcard, None)}
+    manager.update_card_schedule(cards[fsrs_deck].id, button)
+    manager.update_card_schedule(cards[sm2_deck].id, button)
+
+    assert manager.db.get_grade_counts(fsrs_deck) == {FSRSScheduler.grades[button]: 1}
+    assert manager.db.get_grade_counts(sm2_deck) == {SM2Scheduler.grades[button]: 1}
+    assert manager.db.get_card_data(cards[fsrs_deck].id)['stability'] is not None
+    assert manager.db.get_card_data(cards[sm2_deck].id)['stability'] is None
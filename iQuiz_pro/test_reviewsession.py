@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from flashcardmanager import FlashcardManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = FlashcardManager(db_file=str(tmp_path / "flashcards.db"))
+    manager.create_deck("deck")
+    manager.add_flashcard("question", "answer")
+    yield manager
+    manager.db.close()
+
+
+def test_failed_card_comes_back_after_its_learning_step(manager):
+    manager.start_review_session(learning_steps=(1, 10))
+    card = manager.get_next_flashcard()
+    before = time.time()
+    manager.update_card_schedule(card.id, 'again')
+
+    # Only the learning card is left: nothing to show yet, but the review is not over
+    assert manager.get_next_flashcard() is None
+    due = manager.next_review_due()
+    assert due is not None
+    assert before + 60 <= due <= time.time() + 60
+
+    session = manager.review_session
+    assert session.next_card(now=due - 1) is None
+    assert session.next_card(now=due).id == card.id
+
+
+def test_session_ends_once_the_learning_steps_are_passed(manager):
+    manager.start_review_session(learning_steps=(1,))
+    card = manager.get_next_flashcard()
+    manager.update_card_schedule(card.id, 'again')
+    session = manager.review_session
+    due = manager.next_review_due()
+
+    session.answer(card.id, 5, now=due)
+
+    assert session.next_card(now=due) is None
+    assert manager.next_review_due() is None
+
+
+def test_mixed_review_has_no_learning_wait(manager):
+    manager.start_review_session()
+    manager.start_mixed_review()
+
+    assert manager.next_review_due() is None
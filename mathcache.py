@@ -0,0 +1,230 @@
+"""
+This module caches the HTML pandoc renders for math expressions.
+
+Renders are content-addressed: the key is a hash of the expression together
+with the pandoc version and command line flags, so upgrading pandoc or
+changing the flags never serves stale HTML. Lookups go through an in-memory
+LRU first and then a small SQLite database in the add-on folder, which keeps
+renders across Anki restarts and is trimmed back to a size limit by evicting
+the least recently used entries.
+
+Showing a card never waits for a disk write. The main lock only guards the
+in-memory LRU. Disk hits read through a connection of their own, which WAL
+mode never blocks on the writer. Writes (new renders, the LastUsed times
+that disk hits refresh, eviction) go through a second connection under a
+separate lock, on the render workers or when the cache is closed.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'math_cache.db')
+MEMORY_ENTRIES = 1024
+MAX_DISK_BYTES = 16 * 1024 * 1024
+# Evicting goes down to this fraction of the limit, so it does not run on every write
+EVICT_TO = 0.9
+
+logger = logging.getLogger("anki_addon")
+
+
+def pandoc_version(pandoc_path):
+    """
+    Returns the first line of `pandoc --version`, or None if pandoc cannot be run.
+    """
+    try:
+        result = subprocess.run([pandoc_path, '--version'], capture_output=True, text=True,
+                                encoding='utf-8', timeout=10)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug("Could not get the pandoc version: %s", e)
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout.splitlines()[0].strip()
+
+
+class MathRenderCache:
+    """
+    Two-level cache of rendered math: an in-memory LRU in front of a
+    size-bounded SQLite store. Safe to use from several threads.
+    """
+
+    def __init__(self, version, flags, path=CACHE_FILE, memory_entries=MEMORY_ENTRIES,
+                 max_disk_bytes=MAX_DISK_BYTES):
+        self._salt = f"{version}\0{' '.join(flags)}\0"
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        # Guards the LRU, the touched times and the counters; never held during disk access
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = None  # Writes
+        self._reader = None  # Lookups
+        self._disk_bytes = 0
+        self._touched = {}  # key -> LastUsed of disk hits not written yet
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            # Losing the last writes on a power cut only loses cached renders
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS renders (
+                    Key TEXT PRIMARY KEY,
+                    Html TEXT NOT NULL,
+                    Size INTEGER NOT NULL,
+                    LastUsed REAL NOT NULL
+                ) WITHOUT ROWID
+                """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_renders_last_used ON renders (LastUsed)")
+            self._conn.commit()
+            self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(Size), 0) FROM renders").fetchone()[0]
+            self._reader = sqlite3.connect(path, check_same_thread=False)
+        except sqlite3.Error as e:
+            # Rendering still works, only without persistence
+            logger.debug("Math render cache %s unavailable: %s", path, e)
+            for conn in (self._conn, self._reader):
+                if conn is not None:
+                    conn.close()
+            self._conn = self._reader = None
+
+    def key(self, expression):
+        return hashlib.sha256((self._salt + expression).encode('utf-8')).hexdigest()
+
+    def get(self, expression):
+        """
+        Returns the cached HTML of an expression, or None.
+        """
+        key = self.key(expression)
+        with self._lock:
+            html = self._memory.get(key)
+            if html is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return html
+        html = self._load(key)
+        with self._lock:
+            if html is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, html)
+            # Keeps the entry from being evicted as least recently used, once written
+            self._touched[key] = time.time()
+            return html
+
+    def put(self, expression, html):
+        key = self.key(expression)
+        with self._lock:
+            self._remember(key, html)
+            self._touched.pop(key, None)
+            touched, self._touched = self._touched, {}
+        with self._write_lock:
+            self._write_touched(touched)
+            self._store(key, html)
+
+    def stats(self):
+        with self._lock:
+            return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "memory_entries": len(self._memory), "disk_bytes": self._disk_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+        with self._write_lock:
+            if self._conn is not None:
+                self._execute("DELETE FROM renders")
+                self._disk_bytes = 0
+
+    def close(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        with self._write_lock:
+            if self._conn is not None:
+                self._write_touched(touched)
+                self._conn.close()
+                self._conn = None
+        with self._read_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+    def _remember(self, key, html):
+        self._memory[key] = html
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _execute(self, sql, params=()):
+        try:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+        except sqlite3.Error as e:
+            logger.debug("Math render cache query failed: %s", e)
+            return None
+
+    def _load(self, key):
+        with self._read_lock:
+            if self._reader is None:
+                return None
+            try:
+                row = self._reader.execute("SELECT Html FROM renders WHERE Key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.debug("Math render cache query failed: %s", e)
+                return None
+        return row[0] if row is not None else None
+
+    def _write_touched(self, touched):
+        if not touched or self._conn is None:
+            return
+        try:
+            self._conn.executemany("UPDATE renders SET LastUsed = ? WHERE Key = ?",
+                                   [(last_used, key) for key, last_used in touched.items()])
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.debug("Math render cache query failed: %s", e)
+
+    def _store(self, key, html):
+        if self._conn is None:
+            return
+        size = len(key) + len(html.encode('utf-8'))
+        cursor = self._execute("SELECT Size FROM renders WHERE Key = ?", (key,))
+        replaced = cursor.fetchone() if cursor is not None else None
+        if self._execute("INSERT OR REPLACE INTO renders (Key, Html, Size, LastUsed) VALUES (?, ?, ?, ?)",
+                         (key, html, size, time.time())) is None:
+            return
+        self._disk_bytes += size - (replaced[0] if replaced else 0)
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict()
+
+    def _evict(self):
+        # Oldest first, summing sizes until enough is freed
+        target = self._disk_bytes - int(self.max_disk_bytes * EVICT_TO)
+        cursor = self._execute("SELECT Key, Size FROM renders ORDER BY LastUsed")
+        if cursor is None:
+            return
+        doomed, freed = [], 0
+        for key, size in cursor:
+            if freed >= target:
+                break
+            doomed.append((key,))
+            freed += size
+        cursor.close()
+        try:
+            self._conn.executemany("DELETE FROM renders WHERE Key = ?", doomed)
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.debug("Math render cache eviction failed: %s", e)
+            return
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(Size), 0) FROM renders").fetchone()[0]
+        logger.debug("Evicted %d math renders (%d bytes)", len(doomed), freed)
@@ -0,0 +1,206 @@
+"""
+This module renders math expressions with pandoc off the Qt main thread.
+
+All expressions missing from the cache are rendered with a single pandoc run:
+they are joined into one document, separated by a marker paragraph, and the
+HTML output is split back on that marker. If the batch fails, or its output
+does not split into as many pieces as there were expressions, every
+expression is rendered on its own, so one bad formula only leaves itself
+unrendered. Every pandoc run has a timeout.
+
+Renders run on a small thread pool; the caller gets the results through a
+callback on the worker thread. Shutting the renderer down kills any pandoc
+still running, so closing the profile never waits on a render.
+"""
+import hashlib
+import logging
+import subprocess
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from .mathcache import MathRenderCache, pandoc_version
+
+PANDOC_TIMEOUT = 10  # seconds per pandoc run
+WORKERS = 2
+# A paragraph of its own between expressions; plain letters survive the LaTeX reader unchanged
+SPLIT_MARKER = "SMARTREVIEWPADSPLITMARKER"
+
+logger = logging.getLogger("anki_addon")
+
+
+def _clean(html):
+    return html.strip().replace("<p>", "").replace("</p>", "").strip()
+
+
+def placeholder_id(expression):
+    """
+    Returns a stable id for the element showing an expression until it is rendered.
+    """
+    return hashlib.sha1(expression.encode('utf-8')).hexdigest()[:16]
+
+
+class MathRenderer:
+    """
+    Batched pandoc rendering on a background pool, in front of a MathRenderCache.
+    """
+
+    def __init__(self, pandoc_path, flags, workers=WORKERS, timeout=PANDOC_TIMEOUT):
+        self.pandoc_path = pandoc_path
+        self.flags = list(flags)
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pandoc")
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._processes = set()  # Running pandoc processes, killed on shutdown
+        self._closed = False
+        # Opening the cache runs `pandoc --version`; keep it off the main thread too
+        self._cache = self._pool.submit(self._open_cache)
+
+    def _open_cache(self):
+        version = pandoc_version(self.pandoc_path)
+        return MathRenderCache(version, self.flags) if version is not None else None
+
+    @property
+    def cache(self):
+        """
+        The MathRenderCache, or None while it is still opening or if pandoc is missing.
+        """
+        if not self._cache.done():
+            return None
+        return self._opened_cache()
+
+    def _opened_cache(self):
+        """
+        Waits for the cache to open. None if pandoc is missing, or opening failed or was cancelled.
+        """
+        try:
+            return self._cache.result()
+        except CancelledError:
+            return None
+        except Exception as e:
+            logger.debug("Could not open the math render cache: %s", e)
+            return None
+
+    def cached(self, expression):
+        cache = self.cache
+        return cache.get(expression) if cache is not None else None
+
+    def submit(self, expressions, on_rendered):
+        """
+        Renders the expressions in the background, skipping those already being
+        rendered. Calls on_rendered({expression: html}) on the worker thread with
+        the expressions that rendered; failed ones are left out.
+        """
+        with self._lock:
+            expressions = [expr for expr in dict.fromkeys(expressions) if expr not in self._in_flight]
+            self._in_flight.update(expressions)
+        if not expressions:
+            return None
+        return self._pool.submit(self._render_job, expressions, on_rendered)
+
+    def _render_job(self, expressions, on_rendered):
+        try:
+            rendered = self.render(expressions)
+        finally:
+            with self._lock:
+                self._in_flight.difference_update(expressions)
+        if rendered:
+            on_rendered(rendered)
+        return rendered
+
+    def render(self, expressions):
+        """
+        Renders the expressions with as few pandoc runs as possible and caches
+        the results. Returns {expression: html} of those that rendered.
+        """
+        cache = self._opened_cache()
+        rendered = {}
+        missing = []
+        # The cache may have been filled, or opened, since the caller looked
+        for expr in dict.fromkeys(expressions):
+            html = cache.get(expr) if cache is not None else None
+            if html is None:
+                missing.append(expr)
+            else:
+                rendered[expr] = html
+        pieces = self._render_batch(missing) if len(missing) > 1 else None
+        if pieces is None:
+            pieces = [self._run_pandoc(expr) for expr in missing]
+        for expr, html in zip(missing, pieces):
+            if html is None:
+                continue
+            rendered[expr] = html
+            if cache is not None:
+                cache.put(expr, html)
+        return rendered
+
+    def _render_batch(self, expressions):
+        document = f"\n\n{SPLIT_MARKER}\n\n".join(expressions)
+        output = self._run_pandoc(document)
+        if output is None:
+            return None
+        pieces = [_clean(piece) for piece in output.split(SPLIT_MARKER)]
+        if len(pieces) != len(expressions):
+            logger.debug("Pandoc batch split into %d pieces for %d expressions, rendering them one by one",
+                         len(pieces), len(expressions))
+            return None
+        return pieces
+
+    def _run_pandoc(self, source):
+        """
+        Runs pandoc on a LaTeX snippet, returning its HTML or None on failure.
+        """
+        with self._lock:
+            if self._closed:
+                return None
+            try:
+                process = subprocess.Popen(
+                    [self.pandoc_path, *self.flags],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    encoding='utf-8'  # handle non-ASCII characters
+                )
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.debug("Error occurred while running pandoc: %s", e)
+                return None
+            self._processes.add(process)
+        try:
+            stdout, stderr = process.communicate(source, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            logger.debug("Pandoc timed out after %s s on: %s", self.timeout, source)
+            return None
+        except (OSError, ValueError) as e:
+            # Killed by shutdown while its pipes were in use
+            logger.debug("Error occurred while running pandoc: %s", e)
+            return None
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        if process.returncode != 0:
+            if not self._closed:
+                logger.debug("Pandoc failed with error code %d: %s", process.returncode, stderr)
+            return None
+        return _clean(stdout)
+
+    def shutdown(self):
+        """
+        Stops rendering without waiting: queued renders are cancelled and
+        running pandoc processes killed, so no worker holds up closing Anki.
+        """
+        with self._lock:
+            self._closed = True
+            processes = list(self._processes)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+        # Runs now if the cache is open, or once it is if it is still opening
+        self._cache.add_done_callback(_close_cache)
+
+
+def _close_cache(future):
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        future.result().close()
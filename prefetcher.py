@@ -0,0 +1,106 @@
+"""
+This module builds the HTML of upcoming cards before they are shown.
+
+The cards next in the scheduler's queue are read on the main thread, which
+is cheap, and their HTML is built on a small thread pool, where cloze
+extraction and math rendering happen. Results are kept in a bounded LRU keyed
+by card id and note mod time, so an edited note is never served stale HTML.
+"""
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+LOOKAHEAD = 5
+CAPACITY = 64
+WORKERS = 2
+
+logger = logging.getLogger("anki_addon")
+
+
+def upcoming_cards(col, limit=LOOKAHEAD, skip_id=None):
+    """
+    Returns (card_id, note_id, note_mod, fields, ordinal) of the next cards in the queue.
+    Schedulers without a queue to look into give no cards.
+    """
+    get_queued_cards = getattr(col.sched, "get_queued_cards", None)
+    if get_queued_cards is None:
+        return []
+    try:
+        queued = get_queued_cards(fetch_limit=limit + 1)
+        upcoming = []
+        for entry in queued.cards:
+            if entry.card.id == skip_id:
+                continue
+            card = col.get_card(entry.card.id)
+            note = card.note()
+            upcoming.append((card.id, note.id, note.mod, tuple(note.fields), card.ord))
+        return upcoming[:limit]
+    except Exception as e:
+        logger.debug("Could not look ahead in the review queue: %s", e)
+        return []
+
+
+class CardPrefetcher:
+    """
+    Builds card HTML in the background with build(fields, ordinal, (note_id, note_mod)) and hands it
+    out by card. Meant to be used from the main thread only; just the builds
+    run on the pool.
+    """
+
+    def __init__(self, build, capacity=CAPACITY, workers=WORKERS):
+        self._build = build
+        self.capacity = capacity
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._entries = OrderedDict()  # (card id, note mod) -> Future of the built HTML
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, cards):
+        """
+        Starts building the given (card_id, note_id, note_mod, fields, ordinal) cards that are not built yet.
+        """
+        for card_id, note_id, note_mod, fields, ordinal in cards:
+            key = (card_id, note_mod)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                continue
+            self._entries[key] = self._pool.submit(self._build, list(fields), ordinal, (note_id, note_mod))
+        while len(self._entries) > self.capacity:
+            _, future = self._entries.popitem(last=False)
+            future.cancel()
+
+    def get(self, card_id, note_mod):
+        """
+        Returns the built HTML of a card, or None if the card was not
+        prefetched or its build has not finished. The main thread never waits
+        on a build: the caller builds the card itself without waiting for
+        math, which shows placeholders until it renders.
+        """
+        future = self._entries.get((card_id, note_mod))
+        if future is None or future.cancelled() or not future.done():
+            self.misses += 1
+            return None
+        try:
+            built = future.result()
+        except Exception as e:
+            logger.debug("Prefetching card %s failed: %s", card_id, e)
+            del self._entries[(card_id, note_mod)]
+            self.misses += 1
+            return None
+        self._entries.move_to_end((card_id, note_mod))
+        self.hits += 1
+        return built
+
+    def stats(self):
+        looked_up = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "hit_rate": self.hits / looked_up if looked_up else 0.0}
+
+    def clear(self):
+        for future in self._entries.values():
+            future.cancel()
+        self._entries.clear()
+
+    def shutdown(self):
+        self.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)